@@ -12,14 +12,16 @@ from os import path
 import argparse
 import glob
 import shutil
-import subprocess
 from layout_builder import layout_builder
 from datetime import datetime
-from helpers import find_and_copy_file
-from PIL import Image                      # for BrainSprite
-from packaging.version import Version
-from re import split
-from math import sqrt
+from helpers import find_and_copy_file, STAGE_MODES
+from manifest import Manifest
+from profiler import RunProfile, PROFILE_NAME, CPROFILE_NAME
+from preproc import Preprocessor, SUBCORT_SLICES
+from resample import RESAMPLERS, nibabel
+from brainsprite import MOSAIC_IMAGE_DIM, FULL_FRAME_SIZE, RENDER_QUALITIES, SPRITE_RENDERERS
+from slices import SLICE_RENDERERS, parse_slices
+from views import VIEW_RENDERERS
 
 
 def generate_parser():
@@ -67,6 +69,116 @@ def generate_parser():
             help='Optional. Expects the path to the atlas to register to the images. '
             'Default: templates/MNI_T1_1mm_brain.nii.gz. '
             )
+    parser.add_argument(
+            '--jobs', '-j', dest='jobs', type=int, default=1,
+            metavar='N',
+            help='Optional. Number of external tools (e.g., renders of brainsprite '
+            'frames) to run at the same time. Preprocessing stages that do not '
+            'depend on each other share the same N workers. Also the number '
+            'of thumbnails made at the same time by the layout. Default: 1.'
+            )
+    parser.add_argument(
+            '--quality', '-q', dest='quality', default='full',
+            choices=RENDER_QUALITIES,
+            help='Optional. Size at which to render the brainsprite frames. '
+            '"full" renders at %sx%s and shrinks the frames when making the mosaic. '
+            '"draft" renders the frames at mosaic size (%s pixels), which is much '
+            'faster for batch QC runs. Default: full.' % (FULL_FRAME_SIZE + (MOSAIC_IMAGE_DIM,))
+            )
+    parser.add_argument(
+            '--stream', dest='stream', action='store_true',
+            help='Optional. Paste each brainsprite frame into the mosaic as soon '
+            'as it is rendered. Frames are kept only in scratch space ($TMPDIR) '
+            'rather than in T1_pngs and T2_pngs under the output directory.'
+            )
+    parser.add_argument(
+            '--sprite-renderer', dest='sprite_renderer', default='workbench',
+            choices=SPRITE_RENDERERS,
+            help='Optional. How to make the brainsprite mosaics. "workbench" '
+            'renders each frame of the brainsprite scene with wb_command. '
+            '"native" loads the T1 or T2 volume once and slices it in-process '
+            '(needs nibabel), outlined with the pial and white surfaces; it '
+            'takes seconds rather than minutes, but does not look the same as '
+            'the workbench frames. Default: workbench.'
+            )
+    parser.add_argument(
+            '--view-renderer', dest='view_renderer', default='workbench',
+            choices=VIEW_RENDERERS,
+            help='Optional. How to make the named T1 and T2 pngs (e.g., '
+            'T1-Axial-SuperiorFrontal). "workbench" renders each scene of the '
+            'pngs scene with wb_command, which loads the volume and the four '
+            'surfaces for each png. "native" loads them once (needs nibabel) '
+            'and renders the slices, outlined with the pial and white '
+            'surfaces, in-process and at the same time (see --jobs). '
+            'Default: workbench.'
+            )
+    parser.add_argument(
+            '--incremental', dest='incremental', action='store_true',
+            help='Optional. Keep the images made by a prior run, and remake only '
+            'those whose inputs (images, surfaces, scene templates, atlas, or tool '
+            'versions) have changed. Removes the images whose input files are '
+            'gone. Reports which images were skipped.'
+            )
+    parser.add_argument(
+            '--stage-mode', dest='stage_mode', default='copy',
+            choices=STAGE_MODES,
+            help='Optional. How to put the DCAN-BOLD gray plots in the img '
+            'directory. "link" makes a reflink or hardlink when the summary '
+            'and img directories are on the same file system, and copies '
+            'otherwise. Either way, plots already in place (same size and '
+            'modification time) are not staged again. Default: copy.'
+            )
+    parser.add_argument(
+            '--resampler', dest='resampler', default='flirt',
+            choices=RESAMPLERS,
+            help='Optional. How to resample the T1 and T2 brains to the grid '
+            'of each task. "flirt" calls flirt -applyxfm. "numpy" resamples '
+            'in-process (needs nibabel) and keeps the result in memory, with '
+            'no flirt process and no compressed .2.nii.gz. "validate" does '
+            'both, reports whether they agree, and uses flirt\'s. Default: flirt.'
+            )
+    parser.add_argument(
+            '--slice-renderer', dest='slice_renderer', default='fsl',
+            choices=SLICE_RENDERERS,
+            help='Optional. How to make the subcortical, registration, and '
+            'BOLD and SBRef images. "fsl" calls slicer and pngappend '
+            '(subcorticals), slicesdir (atlas and task registrations) and '
+            'slicer (BOLD and SBRef) on copies of the volumes. "numpy" loads '
+            'each volume once and renders the slices and their outlines '
+            'in-process (needs nibabel). Either way, only the first volume '
+            'of a BOLD run is read. Default: fsl.'
+            )
+    parser.add_argument(
+            '--subcort-slices', dest='subcort_slices', nargs='+',
+            metavar='AXIS=SLICE',
+            help='Optional. Slices of the subcortical images, by axis (x, y '
+            'or z) and slice number. Default: %s.' % ' '.join('%s=%s' % piece for piece in SUBCORT_SLICES)
+            )
+    parser.add_argument(
+            '--temporal-stats', dest='temporal_stats', action='store_true',
+            help='Optional. Add a row of the temporal mean, standard deviation '
+            'and tSNR of each BOLD run to each task (needs nibabel). Each run '
+            'is read once, a chunk of volumes at a time, and runs are read at '
+            'the same time (see --jobs).'
+            )
+    parser.add_argument(
+            '--grayplots', dest='grayplots', action='store_true',
+            help='Optional. Make the task and resting state gray plots that '
+            'DCAN-BOLD processing did not put in the summary directory, from '
+            'the timeseries and movement regressors in MNINonLinear/Results '
+            '(needs nibabel). Each run is read a block at a time.'
+            )
+    parser.add_argument(
+            '--profile', dest='profile', action='store_true',
+            help='Optional. Record the wall time, CPU time and peak memory of '
+            'each stage and of each call to an external tool, and write them '
+            'to %s in the executivesummary directory.' % PROFILE_NAME
+            )
+    parser.add_argument(
+            '--cprofile', dest='cprofile', action='store_true',
+            help='Optional. Also write cProfile stats of the Python stages to '
+            '%s in the executivesummary directory. Implies --profile.' % CPROFILE_NAME
+            )
     parser.add_argument(
             '--version', '-v', action='version', version='%(prog)s ' + __version__
             )
@@ -80,7 +192,7 @@ def generate_parser():
     return parser
 
 
-def init_summary(proc_files, summary_dir=None, layout_only=False):
+def init_summary(proc_files, summary_dir=None, layout_only=False, incremental=False):
 
     summary_path = None
     html_path = None
@@ -95,8 +207,9 @@ def init_summary(proc_files, summary_dir=None, layout_only=False):
         # This also ensures we can write to the path.
         html_path = os.path.join(summary_path, 'executivesummary')
 
-        # If we are going to create the files, need to clean up old files.
-        if path.exists(html_path) and not layout_only:
+        # If we are going to create the files, need to clean up old files
+        # (unless we are only remaking the files that are out of date).
+        if path.exists(html_path) and not (layout_only or incremental):
                 shutil.rmtree(html_path)
 
         if not path.exists(html_path):
@@ -131,64 +244,6 @@ def init_summary(proc_files, summary_dir=None, layout_only=False):
     return summary_path, html_path, images_path
 
 
-def make_mosaic(png_path, mosaic_path):
-    # Takes path to .png anatomical slices, creates a mosaic that can be
-    # used in a BrainSprite viewer, and saves to a specified filename.
-
-    # Get the cwd so we can get back; then change directory.
-    cwd = os.getcwd()
-    os.chdir(png_path)
-
-    # Need this function so frames sort in correct order.
-    def natural_sort(l):
-        convert = lambda text: int(text) if text.isdigit() else text.lower()
-        alphanum_key = lambda key: [ convert(c) for c in split('([0-9]+)', key) ]
-        return sorted(l, key = alphanum_key)
-
-    files = os.listdir(png_path)
-    files = natural_sort(files)
-    files = files[::-1]
-
-    image_dim = 218
-    images_per_side = int(sqrt(len(files)))
-    square_dim = image_dim * images_per_side
-    result = Image.new("RGB", (square_dim, square_dim))
-
-    for index, file in enumerate(files):
-        path = os.path.expanduser(file)
-        img = Image.open(path)
-        img = img.transpose(Image.FLIP_LEFT_RIGHT)
-        if Version(Image.__version__) >= Version('10.0.0'):
-            img.thumbnail((image_dim, image_dim), resample=Image.Resampling.LANCZOS)
-        else:
-            img.thumbnail((image_dim, image_dim), resample=Image.ANTIALIAS)
-        x = index % images_per_side * image_dim
-        y = index // images_per_side * image_dim
-        w, h = img.size
-        result.paste(img, (x, y, x + w, y + h))
-
-    # Back to original working dir.
-    os.chdir(cwd)
-
-    quality_val = 95
-    dest = os.path.join(mosaic_path)
-    result.save(dest, 'JPEG', quality=quality_val)
-
-def preprocess_tx (tx, files_path, images_path):
-    # If there are pngs for tx, make the mosaic file for the brainsprite.
-    # If not, no problem. Layout will use the mosaic if it is there.
-    pngs = tx + '_pngs'
-    pngs_dir = os.path.join(files_path, pngs)
-
-    if os.path.isdir(pngs_dir):
-        # Call the program to make the mosaic from the pngs. and write
-        mosaic = tx + '_mosaic.jpg'
-        mosaic_path = os.path.join(images_path, mosaic)
-        make_mosaic(pngs_dir, mosaic_path)
-    else:
-        print('There is no path: %s.' % pngs_dir)
-
-
 def _cli():
     # Command line interface
     parser = generate_parser()
@@ -205,9 +260,23 @@ def _cli():
     assert os.path.isdir(args.output_dir), args.output_dir + ' is not a directory!'
 
     kwargs = {
-        'files_path'   : args.output_dir,
-        'subject_id'   : args.subject_id,
-        'layout_only'  : args.layout_only
+        'files_path'      : args.output_dir,
+        'subject_id'      : args.subject_id,
+        'layout_only'     : args.layout_only,
+        'jobs'            : args.jobs,
+        'quality'         : args.quality,
+        'stream'          : args.stream,
+        'sprite_renderer' : args.sprite_renderer,
+        'view_renderer'   : args.view_renderer,
+        'incremental'     : args.incremental,
+        'stage_mode'      : args.stage_mode,
+        'resampler'       : args.resampler,
+        'slice_renderer'  : args.slice_renderer,
+        'subcort_slices'  : args.subcort_slices,
+        'temporal_stats'  : args.temporal_stats,
+        'grayplots'       : args.grayplots,
+        'profile'         : args.profile,
+        'cprofile'        : args.cprofile
         }
 
     # If the caller specifies an arg is None, python is treating it as a string.
@@ -236,43 +305,94 @@ def _cli():
         assert os.path.exists(args.atlas), args.atlas + ' does not exist!'
         kwargs['atlas'] = args.atlas
 
+    assert args.jobs >= 1, '--jobs must be at least 1'
+    print('\tJobs:                  %s' % args.jobs)
+    print('\tQuality:               %s' % args.quality)
+    print('\tStream:                %s' % args.stream)
+    print('\tSprite renderer:       %s' % args.sprite_renderer)
+    assert args.sprite_renderer == 'workbench' or nibabel is not None, '--sprite-renderer %s needs nibabel' % args.sprite_renderer
+    print('\tView renderer:         %s' % args.view_renderer)
+    assert args.view_renderer == 'workbench' or nibabel is not None, '--view-renderer %s needs nibabel' % args.view_renderer
+    print('\tIncremental:           %s' % args.incremental)
+    print('\tStage mode:            %s' % args.stage_mode)
+    print('\tResampler:             %s' % args.resampler)
+    assert args.resampler == 'flirt' or nibabel is not None, '--resampler %s needs nibabel' % args.resampler
+    print('\tSlice renderer:        %s' % args.slice_renderer)
+    assert args.slice_renderer == 'fsl' or nibabel is not None, '--slice-renderer %s needs nibabel' % args.slice_renderer
+    if args.subcort_slices is not None:
+        try:
+            parse_slices(args.subcort_slices)
+        except ValueError as e:
+            parser.error(str(e))
+        print('\tSubcortical slices:    %s' % ' '.join(args.subcort_slices))
+    print('\tTemporal stats:        %s' % args.temporal_stats)
+    assert not args.temporal_stats or nibabel is not None, '--temporal-stats needs nibabel'
+    print('\tGray plots:            %s' % args.grayplots)
+    assert not args.grayplots or nibabel is not None, '--grayplots needs nibabel'
+    print('\tProfile:               %s' % (args.profile or args.cprofile))
+
     # Call the interface.
     interface(**kwargs)
 
-def interface(files_path, subject_id, summary_dir=None, func_path=None, session_id=None, atlas=None, layout_only=False):
+def interface(files_path, subject_id, summary_dir=None, func_path=None, session_id=None, atlas=None, layout_only=False, jobs=1, quality='full', stream=False, sprite_renderer='workbench', view_renderer='workbench', incremental=False, stage_mode='copy', resampler='flirt', slice_renderer='fsl', subcort_slices=None, temporal_stats=False, grayplots=False, profile=False, cprofile=False):
 
     # Most of the data needed is in the summary directory. Also, it is where the
     # preprocessor will make the images and where the layout_builder will write
     # the HTML. We must be able to write to the path.
     if summary_dir is not None:
         print ('summary_dir is %s' % summary_dir)
-    summary_path, html_path, images_path = init_summary(files_path, summary_dir, layout_only)
+    summary_path, html_path, images_path = init_summary(files_path, summary_dir, layout_only, incremental)
     if summary_path is None:
         # We were not able to find and/or write to the path.
         print('Exiting.')
-        return
+        return False
+
+    # Times (etc.) of the stages, and of the tools they call, if asked.
+    run_profile = RunProfile(html_path, enabled=profile, cprofile=cprofile)
+
+    # Whatever happens in preprocessing, lay out what we have. But let the
+    # caller know if something went wrong.
+    succeeded = True
 
     if not layout_only:
-        preproc_cmd = os.path.dirname(os.path.abspath(__file__)) + '/executivesummary_preproc.sh '
-        preproc_cmd += '--output-dir %s ' % files_path
-        preproc_cmd += '--html-path %s ' % html_path
-        preproc_cmd += '--subject-id %s ' % subject_id
-        if session_id is not None:
-            preproc_cmd += '--session-id %s ' % session_id
-        if func_path is not None:
-            preproc_cmd += '--bids-input %s ' % func_path
-        if atlas is not None:
-            preproc_cmd += '--atlas %s ' % atlas
-
-        subprocess.call(preproc_cmd, shell=True)
-
-        # Make mosaic(s) for brainsprite(s).
-        print('Making mosaic for T1 BrainSprite.')
-        preprocess_tx('T1', files_path, images_path)
-        print('Making mosaic for T2 BrainSprite.')
-        preprocess_tx('T2', files_path, images_path)
+        manifest = None
+        if incremental:
+            manifest = Manifest(html_path)
+            manifest.begin_run()
+
+        kwargs = {
+            'files_path'      : files_path,
+            'html_path'       : html_path,
+            'images_path'     : images_path,
+            'subject_id'      : subject_id,
+            'session_id'      : session_id,
+            'func_path'       : func_path,
+            'atlas'           : atlas,
+            'jobs'            : jobs,
+            'quality'         : quality,
+            'stream'          : stream,
+            'sprite_renderer' : sprite_renderer,
+            'view_renderer'   : view_renderer,
+            'resampler'       : resampler,
+            'slice_renderer'  : slice_renderer,
+            'subcort_slices'  : subcort_slices,
+            'temporal_stats'  : temporal_stats,
+            'grayplots'       : grayplots,
+            'manifest'        : manifest,
+            'profile'         : run_profile
+            }
+
+        # Make the images, and the mosaic(s) for the brainsprite(s).
+        with run_profile.stage('preproc'):
+            if not Preprocessor(**kwargs).run():
+                print('ERROR: not all of the images were made.')
+                succeeded = False
         print('Finished with preprocessing.')
 
+        if manifest is not None:
+            manifest.end_run()
+            manifest.report()
+
     # Done with preproc (or skipped it). Call the page layout to make the page.
 
     print('Begin page layout.')
@@ -282,10 +402,17 @@ def interface(files_path, subject_id, summary_dir=None, func_path=None, session_
         'html_path'     : html_path,
         'images_path'   : images_path,
         'subject_id'    : subject_id,
-        'session_id'    : session_id
+        'session_id'    : session_id,
+        'stage_mode'    : stage_mode,
+        'jobs'          : jobs
         }
 
-    layout_builder(**kwargs)
+    with run_profile.stage('layout'):
+        layout_builder(**kwargs)
+
+    run_profile.save()
+
+    return succeeded
 
 if __name__ == '__main__':
 
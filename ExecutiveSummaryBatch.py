@@ -0,0 +1,383 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Runs the Executive Summary for many subjects/sessions at once. Sessions come
+from a list file and/or a BIDS-style glob of "files" directories, and are
+run by one bounded pool of worker processes, whose stages share one bounded
+pool of tool slots (--jobs). A session that fails does not stop the others;
+a summary of every session is printed at the end.
+"""
+
+import os
+import sys
+import re
+import glob
+import argparse
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from preproc import share_tools
+from ExecutiveSummary import interface, RENDER_QUALITIES, SPRITE_RENDERERS, STAGE_MODES, RESAMPLERS, SLICE_RENDERERS, VIEW_RENDERERS, __version__
+
+
+def parse_ids(files_path):
+    # Get the participant label and session id from a path such as
+    # /data/sub-01/ses-baseline/files. The last of each in the path wins.
+    subjects = re.findall(r'sub-([^/_]+)', files_path)
+    sessions = re.findall(r'ses-([^/_]+)', files_path)
+    subject_id = subjects[-1] if subjects else None
+    session_id = sessions[-1] if sessions else None
+    return subject_id, session_id
+
+
+def read_sessions_file(sessions_file):
+    # Each line has a path to a "files" directory, optionally followed by
+    # the participant label and session id (without "sub-" and "ses-"). If
+    # they are not given, they are taken from the path. Lines that start
+    # with '#' are ignored.
+    sessions = []
+    with open(sessions_file) as fd:
+        for line in fd:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+
+            files_path = fields[0]
+            subject_id, session_id = parse_ids(files_path)
+            if len(fields) > 1:
+                subject_id = fields[1]
+            if len(fields) > 2:
+                session_id = fields[2]
+            sessions.append((files_path, subject_id, session_id))
+
+    return sessions
+
+
+def glob_sessions(pattern):
+    # Every directory that matches the pattern is a "files" directory.
+    sessions = []
+    for files_path in sorted(glob.glob(pattern)):
+        if os.path.isdir(files_path):
+            subject_id, session_id = parse_ids(files_path)
+            sessions.append((files_path, subject_id, session_id))
+
+    return sessions
+
+
+def session_label(subject_id, session_id):
+    label = 'sub-%s' % subject_id
+    if session_id is not None:
+        label += '_ses-%s' % session_id
+    return label
+
+
+def unique_labels(sessions):
+    # The label of each session, e.g., sub-01_ses-A, made unique (sub-01_2,
+    # sub-01_3, ...) when sessions share one, so each has its own log.
+    labels = []
+    counts = {}
+    for _, subject_id, session_id in sessions:
+        label = session_label(subject_id, session_id)
+        counts[label] = counts.get(label, 0) + 1
+        if counts[label] > 1:
+            label = '%s_%s' % (label, counts[label])
+        labels.append(label)
+    return labels
+
+
+def run_session(files_path, subject_id, session_id, log_dir, kwargs, label=None):
+    """
+    Runs one session in a worker process, with all of its output (including
+    that of the preprocessor) written to its own log file.
+
+    :parameter: label: name of the session and of its log. Default: from
+                its participant label and session id.
+    :return: tuple of label, status ('ok', 'failed' or 'error'), wall time
+             in seconds, and log path.
+    """
+    label = label or session_label(subject_id, session_id)
+    log_path = os.path.join(log_dir, label + '.log')
+
+    session_kwargs = dict(kwargs)
+    error = None
+    func_path = session_kwargs.get('func_path')
+    if func_path is not None:
+        # The BIDS input may be a template for this session's func directory.
+        # Only the two placeholders are filled in: the rest of the path may
+        # have braces of its own.
+        for name, value in [ ('subject', subject_id), ('session', session_id) ]:
+            placeholder = '{%s}' % name
+            if placeholder in func_path:
+                if value is None:
+                    error = 'ERROR: --bids-input has %s, but %s has no %s id.' % (placeholder, files_path, name)
+                    break
+                func_path = func_path.replace(placeholder, value)
+        session_kwargs['func_path'] = func_path
+
+    start = time.time()
+
+    # Point this process's stdout and stderr at the log, so the output of
+    # subprocesses goes there too. Put them back when done, along with the
+    # working directory (the layout changes it): the process is reused for
+    # other sessions.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    saved_cwd = os.getcwd()
+    with open(log_path, 'w') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            if error is not None:
+                log.write(error + '\n')
+                status = 'failed'
+            elif interface(files_path, subject_id, session_id=session_id, **session_kwargs):
+                status = 'ok'
+            else:
+                status = 'failed'
+        except Exception:
+            traceback.print_exc()
+            status = 'error'
+        finally:
+            os.chdir(saved_cwd)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+
+    return label, status, time.time() - start, log_path
+
+
+def run_batch(sessions, workers=1, log_dir='.', **kwargs):
+    """
+    Runs every session on a pool of 'workers' processes. The stages of all
+    of the sessions share kwargs['jobs'] tool slots, so no more than that
+    many tools run at once, however many sessions do.
+
+    :parameter: sessions: list of (files_path, subject_id, session_id).
+    :parameter: workers: number of sessions to run at the same time.
+    :parameter: log_dir: directory for the per-session logs.
+    :parameter: kwargs: passed to ExecutiveSummary.interface for each session.
+    :return: list of (label, status, wall time, log path), in session order.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+
+    labels = unique_labels(sessions)
+    tools = multiprocessing.BoundedSemaphore(kwargs.get('jobs', 1))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=share_tools, initargs=(tools,)) as pool:
+        futures = {}
+        for idx, (files_path, subject_id, session_id) in enumerate(sessions):
+            future = pool.submit(run_session, files_path, subject_id, session_id, log_dir, kwargs, labels[idx])
+            futures[future] = idx
+
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                results[idx] = future.result()
+            except Exception as err:
+                # The worker itself died (e.g., killed for memory).
+                results[idx] = (labels[idx], 'error: %s' % err, 0.0, None)
+            print('%-40s %-8s %8.1fs' % results[idx][:3])
+
+    return [ results[idx] for idx in range(len(sessions)) ]
+
+
+def print_summary(results, wall_time):
+    print('\nBatch summary:')
+    print('%-40s %-8s %9s  %s' % ('session', 'status', 'wall time', 'log'))
+    for label, status, seconds, log_path in results:
+        print('%-40s %-8s %8.1fs  %s' % (label, status, seconds, log_path))
+
+    succeeded = sum(1 for result in results if result[1] == 'ok')
+    print('\n%s of %s sessions succeeded; %s failed. Total wall time: %.1fs' % (
+            succeeded, len(results), len(results) - succeeded, wall_time))
+
+
+def generate_parser():
+
+    parser = argparse.ArgumentParser(
+            prog='ExecutiveSummaryBatch',
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter
+            )
+    parser.add_argument(
+            '--sessions-file', '-f', dest='sessions_file',
+            metavar='SESSIONS_FILE',
+            help='file with one session per line: path to its "files" directory, '
+            'optionally followed by participant label and session id.'
+            )
+    parser.add_argument(
+            '--glob', '-g', dest='glob',
+            metavar='PATTERN',
+            help='BIDS-style glob for "files" directories, e.g., '
+            '"/data/sub-*/ses-*/files". Labels are taken from the sub- and '
+            'ses- parts of each path.'
+            )
+    parser.add_argument(
+            '--workers', '-w', dest='workers', type=int, default=1,
+            metavar='N',
+            help='number of sessions to run at the same time. Default: 1.'
+            )
+    parser.add_argument(
+            '--log-dir', '-l', dest='log_dir', default='executivesummary_logs',
+            metavar='LOG_DIR',
+            help='directory for the per-session logs. Default: executivesummary_logs.'
+            )
+    parser.add_argument(
+            '--bids-input', '-i', dest='bids_dir',
+            metavar='FUNC_PATH',
+            help='Optional. Path to the bids func directory of each session; may '
+            'contain {subject} and {session}, e.g., "/bids/sub-{subject}/ses-{session}/func".'
+            )
+    parser.add_argument(
+            '--dcan-summary', '-d', dest='summary_dir',
+            metavar='DCAN_SUMMARY',
+            help='Optional. Name of the subdirectory used for the summary data.'
+            )
+    parser.add_argument(
+            '--atlas', '-a', dest='atlas',
+            metavar='ATLAS_PATH',
+            help='Optional. Path to the atlas to register to the images.'
+            )
+    parser.add_argument(
+            '--jobs', '-j', dest='jobs', type=int, default=1,
+            metavar='N',
+            help='Optional. External tools to run at once, across all of the sessions. Default: 1.'
+            )
+    parser.add_argument(
+            '--quality', '-q', dest='quality', default='full',
+            choices=RENDER_QUALITIES,
+            help='Optional. Size at which to render the brainsprite frames. Default: full.'
+            )
+    parser.add_argument(
+            '--stream', dest='stream', action='store_true',
+            help='Optional. Stream brainsprite frames into the mosaics.'
+            )
+    parser.add_argument(
+            '--sprite-renderer', dest='sprite_renderer', default='workbench',
+            choices=SPRITE_RENDERERS,
+            help='Optional. Make the brainsprite mosaics with workbench or natively. Default: workbench.'
+            )
+    parser.add_argument(
+            '--view-renderer', dest='view_renderer', default='workbench',
+            choices=VIEW_RENDERERS,
+            help='Optional. Make the named T1 and T2 pngs with workbench or natively. Default: workbench.'
+            )
+    parser.add_argument(
+            '--incremental', dest='incremental', action='store_true',
+            help='Optional. Remake only the images whose inputs have changed.'
+            )
+    parser.add_argument(
+            '--stage-mode', dest='stage_mode', default='copy',
+            choices=STAGE_MODES,
+            help='Optional. Copy or link (where possible) the gray plots into img. Default: copy.'
+            )
+    parser.add_argument(
+            '--resampler', dest='resampler', default='flirt',
+            choices=RESAMPLERS,
+            help='Optional. Resample the brains to each task grid with flirt, numpy, or both (validate). Default: flirt.'
+            )
+    parser.add_argument(
+            '--slice-renderer', dest='slice_renderer', default='fsl',
+            choices=SLICE_RENDERERS,
+            help='Optional. Make the subcortical, registration, and BOLD images with FSL tools or in-process. Default: fsl.'
+            )
+    parser.add_argument(
+            '--subcort-slices', dest='subcort_slices', nargs='+',
+            metavar='AXIS=SLICE',
+            help='Optional. Slices of the subcortical images, e.g., x=36 y=43 z=23.'
+            )
+    parser.add_argument(
+            '--temporal-stats', dest='temporal_stats', action='store_true',
+            help='Optional. Add the temporal mean, SD and tSNR of each BOLD run.'
+            )
+    parser.add_argument(
+            '--grayplots', dest='grayplots', action='store_true',
+            help='Optional. Make the gray plots that DCAN-BOLD processing did not.'
+            )
+    parser.add_argument(
+            '--profile', dest='profile', action='store_true',
+            help='Optional. Write a profile.json of stage and tool timings for each session.'
+            )
+    parser.add_argument(
+            '--cprofile', dest='cprofile', action='store_true',
+            help='Optional. Also write cProfile stats for each session. Implies --profile.'
+            )
+    parser.add_argument(
+            '--layout-only', dest='layout_only', action='store_true',
+            help='Optional. Only lay out the pages of sessions that are already preprocessed.'
+            )
+    parser.add_argument(
+            '--version', '-v', action='version', version='%(prog)s ' + __version__
+            )
+
+    return parser
+
+
+def _cli():
+    # Command line interface
+    parser = generate_parser()
+    args = parser.parse_args()
+
+    if args.sessions_file is None and args.glob is None:
+        parser.error('one of --sessions-file or --glob is required.')
+    if args.workers < 1 or args.jobs < 1:
+        parser.error('--workers and --jobs must be at least 1.')
+
+    sessions = []
+    if args.sessions_file is not None:
+        sessions += read_sessions_file(args.sessions_file)
+    if args.glob is not None:
+        sessions += glob_sessions(args.glob)
+
+    # Every session needs a participant label and a directory.
+    runnable = []
+    for files_path, subject_id, session_id in sessions:
+        if subject_id is None:
+            print('Skipping %s: no participant label (sub-) found.' % files_path)
+        elif not os.path.isdir(files_path):
+            print('Skipping %s: not a directory.' % files_path)
+        else:
+            runnable.append((files_path, subject_id, session_id))
+
+    date_stamp = "{:%Y%m%d %H:%M}".format(datetime.now())
+    print('Executive Summary batch was called at %s with %s sessions on %s workers.' % (
+            date_stamp, len(runnable), args.workers))
+
+    kwargs = {
+        'summary_dir'     : args.summary_dir,
+        'func_path'       : args.bids_dir,
+        'atlas'           : args.atlas,
+        'layout_only'     : args.layout_only,
+        'jobs'            : args.jobs,
+        'quality'         : args.quality,
+        'stream'          : args.stream,
+        'sprite_renderer' : args.sprite_renderer,
+        'view_renderer'   : args.view_renderer,
+        'incremental'     : args.incremental,
+        'stage_mode'      : args.stage_mode,
+        'resampler'       : args.resampler,
+        'slice_renderer'  : args.slice_renderer,
+        'subcort_slices'  : args.subcort_slices,
+        'temporal_stats'  : args.temporal_stats,
+        'grayplots'       : args.grayplots,
+        'profile'         : args.profile,
+        'cprofile'        : args.cprofile
+        }
+
+    start = time.time()
+    results = run_batch(runnable, workers=args.workers, log_dir=os.path.abspath(args.log_dir), **kwargs)
+    print_summary(results, time.time() - start)
+
+    if any(result[1] != 'ok' for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    _cli()
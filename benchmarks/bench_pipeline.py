@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Runs the whole Executive Summary (ExecutiveSummary.interface) on a synthetic
+subject, with stub workbench and FSL tools that take a set time per call,
+and reports the total wall time and the critical path: the chain of tool
+calls and Python stages that the run had to wait for, one after another.
+Wall time that is not on the critical path is orchestration (Python, and
+waiting between calls).
+
+The stubs are on the PATH (and are CARET7DIR) only for this run. The code
+is run from a directory of links to this checkout, next to stand-ins for
+its templates, so the checkout is not changed.
+
+Tool calls are recorded with --profile. Use --no-profile to time the run
+without it (and without the critical path).
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, REPO_DIR)
+from fixtures import make_pipeline_inputs, make_templates
+from stub_tools import make_stub_tools, STUB_TOOLS
+from profiler import PROFILE_NAME
+
+
+def make_install(install_dir, num_frames):
+    # Link the code (and setup_env.sh) into a directory of its own, with the
+    # templates the preprocessor looks for next to itself.
+    os.makedirs(install_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(REPO_DIR, '*.py')) + glob.glob(os.path.join(REPO_DIR, '*.sh')):
+        link = os.path.join(install_dir, os.path.basename(path))
+        if not os.path.lexists(link):
+            os.symlink(path, link)
+    make_templates(os.path.join(install_dir, 'templates'), num_frames)
+    return install_dir
+
+
+def critical_path(profile):
+    """
+    Finds the chain of tool calls and Python stages that ended the run:
+    from the end of the run, the unit that ended last, then the one that
+    ended last before that one started, and so on. The preproc stage
+    itself is not a unit (its stages and tool calls are), nor is a call
+    made within a unit.
+
+    :parameter: profile: the contents of profile.json.
+    :return: list of units (dicts with 'name', 'start', 'wall'), in order.
+    """
+    units = []
+    for record in profile['tools']:
+        if record['stage'] != 'preproc':
+            units.append({ 'name': '%s:%s' % (record['stage'], record['tool']),
+                           'start': record['start'], 'wall': record['wall'] })
+    for record in profile['stages']:
+        if record['stage'] != 'preproc':
+            units.append({ 'name': record['stage'], 'start': record['start'], 'wall': record['wall'] })
+
+    # Drop units within other units (e.g., wb_command calls in a mosaic stage).
+    def within(inner, outer):
+        return (inner is not outer and outer['start'] <= inner['start'] and
+                inner['start'] + inner['wall'] <= outer['start'] + outer['wall'])
+    units = [ unit for unit in units if not any(within(unit, other) for other in units) ]
+
+    path = []
+    end = profile['start'] + profile['wall']
+    while True:
+        candidates = [ unit for unit in units if unit['start'] + unit['wall'] <= end ]
+        if not candidates:
+            break
+        unit = max(candidates, key=lambda unit: (unit['start'] + unit['wall'], unit['wall']))
+        path.append(unit)
+        end = unit['start']
+
+    return path[::-1]
+
+
+def report(profile, path, out=sys.stdout):
+    wall = profile['wall']
+    on_path = sum(unit['wall'] for unit in path)
+    print('\nTotal wall time: %.2fs' % wall, file=out)
+    print('Critical path: %s units, %.2fs; orchestration and waiting: %.2fs (%.0f%%)' % (
+            len(path), on_path, wall - on_path, 100 * (wall - on_path) / wall if wall else 0), file=out)
+
+    # The path, with the units of the same name added up, in the order in
+    # which each first appears.
+    print('\n%-36s %6s %9s' % ('critical path', 'calls', 'wall'), file=out)
+    totals = {}
+    for unit in path:
+        total = totals.setdefault(unit['name'], [ 0, 0.0 ])
+        total[0] += 1
+        total[1] += unit['wall']
+    for name, (calls, seconds) in totals.items():
+        print('%-36s %6s %8.2fs' % (name, calls, seconds), file=out)
+
+    print('\n%-36s %6s %9s %9s' % ('tool', 'calls', 'wall', 'cpu'), file=out)
+    for tool, total in sorted(profile['summary'].items(), key=lambda item: -item[1]['wall']):
+        print('%-36s %6s %8.2fs %8.2fs' % (tool, total['calls'], total['wall'], total['cpu']), file=out)
+
+
+def run_once(work_dir, args):
+    """
+    Makes a fresh subject and runs the pipeline on it.
+
+    :return: tuple of wall time, whether it succeeded, html_path and log path.
+    """
+    subject_dir = tempfile.mkdtemp(prefix='subject_', dir=work_dir)
+    inputs = make_pipeline_inputs(subject_dir, args.tasks, args.runs)
+
+    from ExecutiveSummary import interface
+
+    kwargs = {
+        'summary_dir': inputs['summary_dir'],
+        'func_path'  : inputs['func_path'],
+        'jobs'       : args.jobs,
+        'quality'    : args.quality,
+        'stream'     : args.stream,
+        'profile'    : args.profile
+        }
+
+    log_path = os.path.join(subject_dir, 'run.log')
+    start = time.time()
+    with open(log_path, 'w') as log:
+        # The tools write to the same stdout and stderr; send all
+        # of it to the log.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = (os.dup(1), os.dup(2))
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            with redirect_stdout(log):
+                succeeded = interface(inputs['files_path'], '01', **kwargs)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+    wall = time.time() - start
+
+    html_path = os.path.join(inputs['files_path'], inputs['summary_dir'], 'executivesummary')
+    return wall, succeeded, html_path, log_path
+
+
+def generate_parser():
+
+    parser = argparse.ArgumentParser(
+            prog='bench_pipeline',
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter
+            )
+    parser.add_argument(
+            '--tasks', dest='tasks', type=int, default=4,
+            help='number of tasks. Default: 4.'
+            )
+    parser.add_argument(
+            '--runs', dest='runs', type=int, default=2,
+            help='number of runs of each task. Default: 2.'
+            )
+    parser.add_argument(
+            '--frames', dest='frames', type=int, default=169,
+            help='number of frames in each brainsprite. Default: 169.'
+            )
+    parser.add_argument(
+            '--latency', dest='latency', type=float, default=0.05,
+            help='seconds each tool call takes. Default: 0.05.'
+            )
+    parser.add_argument(
+            '--tool-latency', dest='tool_latency', action='append', default=[],
+            metavar='TOOL=SECONDS',
+            help='latency of one tool (one of %s), e.g., wb_command=0.5. '
+            'May be given more than once.' % ', '.join(STUB_TOOLS)
+            )
+    parser.add_argument(
+            '--jobs', '-j', dest='jobs', type=int, default=1,
+            help='passed to the Executive Summary. Default: 1.'
+            )
+    parser.add_argument(
+            '--quality', dest='quality', default='full', choices=[ 'full', 'draft' ],
+            help='passed to the Executive Summary. Default: full.'
+            )
+    parser.add_argument(
+            '--stream', dest='stream', action='store_true',
+            help='passed to the Executive Summary.'
+            )
+    parser.add_argument(
+            '--no-profile', dest='profile', action='store_false',
+            help='do not record tool calls (no critical path).'
+            )
+    parser.add_argument(
+            '--repeat', '-r', dest='repeat', type=int, default=1,
+            help='number of runs; the fastest is reported. Default: 1.'
+            )
+    parser.add_argument(
+            '--output', '-o', dest='output',
+            help='also write the wall times and critical path to this json.'
+            )
+    parser.add_argument(
+            '--work-dir', '-w', dest='work_dir',
+            help='where to make the stubs and subjects. Default: a temporary directory, removed when done.'
+            )
+
+    return parser
+
+
+def _cli():
+    parser = generate_parser()
+    args = parser.parse_args()
+
+    tool_latency = {}
+    for item in args.tool_latency:
+        tool, _, seconds = item.partition('=')
+        if tool not in STUB_TOOLS or not seconds:
+            parser.error('--tool-latency must be TOOL=SECONDS, with TOOL one of %s' % ', '.join(STUB_TOOLS))
+        tool_latency[tool] = float(seconds)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='es_pipeline_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        stub_dir = make_stub_tools(os.path.join(work_dir, 'stubs'), args.latency, tool_latency)
+        install_dir = make_install(os.path.join(work_dir, 'install'), args.frames)
+
+        os.environ['PATH'] = stub_dir + os.pathsep + os.environ['PATH']
+        os.environ['CARET7DIR'] = stub_dir
+        os.environ.pop('wb_command', None)
+        sys.path.insert(0, install_dir)
+
+        print('Running %s tasks x %s runs, %s frames, latency %ss %s, jobs %s, quality %s%s.' % (
+                args.tasks, args.runs, args.frames, args.latency, tool_latency or '',
+                args.jobs, args.quality, ', stream' if args.stream else ''))
+
+        runs = []
+        for attempt in range(args.repeat):
+            wall, succeeded, html_path, log_path = run_once(work_dir, args)
+            print('Run %s: %.2fs%s' % (attempt + 1, wall, '' if succeeded else ' (FAILED; see %s)' % log_path))
+            runs.append((wall, succeeded, html_path))
+
+        wall, succeeded, html_path = min(runs, key=lambda run: run[0])
+        result = { 'wall': wall, 'succeeded': succeeded, 'walls': [ run[0] for run in runs ] }
+
+        profile_path = os.path.join(html_path, PROFILE_NAME)
+        if args.profile and os.path.isfile(profile_path):
+            with open(profile_path) as fd:
+                profile = json.load(fd)
+            path = critical_path(profile)
+            report(profile, path)
+            result['critical_path'] = path
+            result['summary'] = profile['summary']
+
+        if args.output:
+            with open(args.output, 'w') as fd:
+                json.dump(result, fd, indent=1)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not all(run[1] for run in runs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    _cli()
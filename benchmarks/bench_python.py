@@ -0,0 +1,227 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Times the Python hot paths of the Executive Summary on synthetic inputs at
+several scales: make_mosaic, building the layout (with and without cached
+thumbnails), file lookups with find_one_file and with a DirectoryIndex, and
+get_list_of_tasks.
+
+Results can be saved as a baseline and later runs compared with it; a case
+that is slower than the baseline by more than the threshold is reported as
+a regression, and the script exits with 1. Baselines depend on the machine,
+so make one on the machine on which you compare.
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+
+# The modules of the Executive Summary are in the directory above.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from brainsprite import make_mosaic
+from layout_builder import layout_builder
+from helpers import find_one_file, DirectoryIndex
+from thumbnails import THUMBNAILS_DIR
+from constants import IMAGE_INFO
+from fixtures import make_frames, make_files_tree
+
+SCALES = {
+    'small' : { 'frames': 49,  'tasks': 2,  'runs': 2 },
+    'medium': { 'frames': 169, 'tasks': 4,  'runs': 3 },
+    'large' : { 'frames': 289, 'tasks': 12, 'runs': 4 }
+    }
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Differences smaller than this (in seconds) are noise, whatever the ratio.
+NOISE_FLOOR = 0.005
+
+
+def time_case(func, repeat, setup=None):
+    # Returns the fastest and the median of 'repeat' runs. Output of the
+    # code being timed is thrown away.
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def lookup_patterns(tasks):
+    # The patterns the layout looks up, for every task/run.
+    patterns = [ IMAGE_INFO[key]['pattern'] for key in
+            [ 'atlas_in_t1', 't1_in_atlas', 'atlas_in_subcort', 'subcort_in_atlas',
+              'concat_pre_reg_gray', 'concat_post_reg_gray' ] ]
+    for task_name, task_num in tasks:
+        task_pattern = task_name + '*' + task_num
+        for key in [ 'task_in_t1', 't1_in_task', 'bold', 'ref', 'task_pre_reg_gray', 'task_post_reg_gray' ]:
+            patterns.append(IMAGE_INFO[key]['pattern'] % task_pattern)
+    return patterns
+
+
+def run_scale(scale, work_dir, repeat, jobs):
+    """
+    Makes the inputs for one scale and times each case.
+
+    :return: dict of case name to (fastest, median) seconds.
+    """
+    params = SCALES[scale]
+    scale_dir = os.path.join(work_dir, scale)
+    frames_dir = make_frames(os.path.join(scale_dir, 'T1_pngs'), params['frames'])
+    tree = make_files_tree(scale_dir, params['tasks'], params['runs'])
+    images_path = tree['images_path']
+    mosaic_path = os.path.join(scale_dir, 'T1_mosaic.jpg')
+
+    def layout():
+        layout_builder(tree['files_path'], tree['summary_path'], tree['html_path'],
+                images_path, '01', jobs=jobs)
+
+    def drop_thumbnails():
+        shutil.rmtree(os.path.join(images_path, THUMBNAILS_DIR), ignore_errors=True)
+
+    patterns = lookup_patterns(tree['tasks'])
+
+    def glob_lookups():
+        for pattern in patterns:
+            find_one_file(images_path, pattern)
+
+    def index_lookups():
+        index = DirectoryIndex(images_path)
+        for pattern in patterns:
+            index.find_one_file(pattern)
+
+    tasks_owner = SimpleNamespace(files_path=tree['files_path'])
+
+    results = {}
+    results['make_mosaic'] = time_case(lambda: make_mosaic(frames_dir, mosaic_path, jobs=jobs), repeat)
+    results['layout_cold'] = time_case(layout, repeat, setup=drop_thumbnails)
+    results['layout_warm'] = time_case(layout, repeat)
+    results['find_one_file'] = time_case(glob_lookups, repeat)
+    results['directory_index'] = time_case(index_lookups, repeat)
+    results['get_list_of_tasks'] = time_case(lambda: layout_builder.get_list_of_tasks(tasks_owner), repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Prints each case next to its baseline. Returns the regressions.
+    regressions = []
+    print('%-28s %10s %10s %10s %8s' % ('case', 'fastest', 'median', 'baseline', 'ratio'))
+    for case, (fastest, median) in sorted(results.items()):
+        base = baseline.get(case)
+        if base is None:
+            print('%-28s %9.4fs %9.4fs %10s %8s' % (case, fastest, median, '-', '-'))
+            continue
+
+        ratio = fastest / base if base > 0 else float('inf')
+        flag = ''
+        if ratio > threshold and fastest - base > NOISE_FLOOR:
+            regressions.append(case)
+            flag = '  REGRESSION'
+        print('%-28s %9.4fs %9.4fs %9.4fs %7.2fx%s' % (case, fastest, median, base, ratio, flag))
+
+    return regressions
+
+
+def generate_parser():
+
+    parser = argparse.ArgumentParser(
+            prog='bench_python',
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter
+            )
+    parser.add_argument(
+            '--scales', dest='scales', nargs='+', default=[ 'small', 'medium' ],
+            choices=sorted(SCALES),
+            help='scales at which to run. Default: small medium.'
+            )
+    parser.add_argument(
+            '--repeat', '-r', dest='repeat', type=int, default=3,
+            help='times to run each case; the fastest is compared. Default: 3.'
+            )
+    parser.add_argument(
+            '--jobs', '-j', dest='jobs', type=int, default=1,
+            help='threads for make_mosaic and the thumbnails. Default: 1.'
+            )
+    parser.add_argument(
+            '--baseline', '-b', dest='baseline', default=DEFAULT_BASELINE,
+            help='baseline json to compare with (or save to). Default: %s.' % DEFAULT_BASELINE
+            )
+    parser.add_argument(
+            '--save-baseline', dest='save_baseline', action='store_true',
+            help='save the results as the baseline instead of comparing.'
+            )
+    parser.add_argument(
+            '--threshold', '-t', dest='threshold', type=float, default=1.25,
+            help='a case slower than baseline times this is a regression. Default: 1.25.'
+            )
+    parser.add_argument(
+            '--output', '-o', dest='output',
+            help='also write the results to this json.'
+            )
+    parser.add_argument(
+            '--work-dir', '-w', dest='work_dir',
+            help='where to make the inputs. Default: a temporary directory, removed when done.'
+            )
+
+    return parser
+
+
+def _cli():
+    parser = generate_parser()
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='es_bench_')
+    results = {}
+    try:
+        for scale in args.scales:
+            print('Running %s: %s' % (scale, SCALES[scale]))
+            for case, times in run_scale(scale, work_dir, args.repeat, args.jobs).items():
+                results['%s/%s' % (scale, case)] = times
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({ case: { 'fastest': t[0], 'median': t[1] } for case, t in results.items() }, fd, indent=1)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as fd:
+                baseline = json.load(fd)
+        baseline.update({ case: times[0] for case, times in results.items() })
+        with open(args.baseline, 'w') as fd:
+            json.dump(baseline, fd, indent=1, sort_keys=True)
+        compare(results, {}, args.threshold)
+        print('\nSaved baseline: %s' % args.baseline)
+        return
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+    else:
+        print('No baseline at %s; run with --save-baseline to make one.' % args.baseline)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('\n%s regression(s): %s' % (len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    _cli()
@@ -0,0 +1,200 @@
+__doc__ = """
+Synthetic inputs for the benchmarks: brainsprite frame pngs, and a "files"
+directory with an executivesummary/img directory for N tasks of M runs each,
+as the preprocessor would leave it, plus the DCAN-BOLD gray plots. Also the
+inputs of the preprocessor itself and its scene templates, for running the
+whole pipeline with the stub tools (see stub_tools.py).
+"""
+
+import os
+import shutil
+import numpy as np
+from PIL import Image
+
+# Task names may not have digits (see layout_builder.get_list_of_tasks).
+TASK_NAMES = [ 'rest', 'nback', 'sst', 'mid', 'faces', 'gambling', 'motor',
+               'language', 'social', 'relational', 'emotion', 'wm' ]
+
+TX_VIEWS = [ 'Axial-InferiorTemporal-Cerebellum', 'Axial-BasalGangila-Putamen',
+             'Axial-SuperiorFrontal', 'Coronal-PosteriorParietal-Lingual',
+             'Coronal-Caudate-Amygdala', 'Coronal-OrbitoFrontal',
+             'Sagittal-Insula-FrontoTemporal', 'Sagittal-CorpusCallosum',
+             'Sagittal-Insula-Temporal-HippocampalSulcus' ]
+
+
+def write_png(path, size, seed=0):
+    # An image with some structure (a blob on a gradient), so that it
+    # compresses and decodes about like a brain slice, not like noise.
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    cx = width * (0.4 + 0.2 * ((seed * 7) % 10) / 10)
+    cy = height / 2
+    blob = np.exp(-(((x - cx) / (width / 4)) ** 2 + ((y - cy) / (height / 3)) ** 2))
+    gray = (blob * 200 + x * 40 / width).astype(np.uint8)
+    rgb = np.stack([ gray, gray, (gray * 0.8).astype(np.uint8) ], axis=-1)
+    Image.fromarray(rgb).save(path, 'PNG')
+
+
+def copy_or_write(path, size, cache):
+    # Writing a png is slow. Write one for each size and copy it.
+    if size not in cache:
+        write_png(path, size, seed=len(cache))
+        cache[size] = path
+    else:
+        shutil.copyfile(cache[size], path)
+
+
+def task_names(num_tasks):
+    names = []
+    for idx in range(num_tasks):
+        name = TASK_NAMES[idx % len(TASK_NAMES)]
+        # Letters only: rest, ..., wm, resta, nbacka, ...
+        suffix = ''
+        count = idx // len(TASK_NAMES)
+        while count > 0:
+            count -= 1
+            suffix = chr(ord('a') + count % 26) + suffix
+            count //= 26
+        names.append(name + suffix)
+    return names
+
+
+def make_frames(frames_dir, num_frames, size=(900, 800)):
+    """
+    Makes a directory of brainsprite frames, as wb_command would.
+
+    :return: frames_dir
+    """
+    os.makedirs(frames_dir, exist_ok=True)
+    cache = {}
+    for frame in range(1, num_frames + 1):
+        copy_or_write(os.path.join(frames_dir, 'P_T1_frame_%d.png' % frame), size, cache)
+    return frames_dir
+
+
+def make_files_tree(root, num_tasks, num_runs, subject_id='01', summary_dir='summary_DCANBOLDProc_v4.0.0'):
+    """
+    Makes a "files" directory for one subject, with the images made by the
+    preprocessor in executivesummary/img, a task directory for each run in
+    MNINonLinear/Results, and the gray plots in the DCAN-BOLD summary dir.
+
+    :parameter: root: directory in which to make "files".
+    :parameter: num_tasks: number of tasks.
+    :parameter: num_runs: number of runs of each task.
+    :return: dict of files_path, summary_path, html_path, images_path and tasks.
+    """
+    files_path = os.path.join(root, 'files')
+    summary_path = os.path.join(files_path, summary_dir)
+    html_path = os.path.join(summary_path, 'executivesummary')
+    images_path = os.path.join(html_path, 'img')
+    results_path = os.path.join(files_path, 'MNINonLinear', 'Results')
+    for directory in [ images_path, results_path ]:
+        os.makedirs(directory, exist_ok=True)
+
+    sub = 'sub-%s' % subject_id
+    cache = {}
+
+    def img(name, size):
+        copy_or_write(os.path.join(images_path, name), size, cache)
+
+    # Anatomical images. The registration "gifs" are pngs, as slicesdir
+    # makes them.
+    for desc in [ 'AtlasInT1w', 'T1wInAtlas', 'AtlasInSubcort', 'SubcortInAtlas' ]:
+        img('%s_desc-%s.gif' % (sub, desc), (1800, 220))
+    for tx in [ 'T1', 'T2' ]:
+        for view in TX_VIEWS:
+            img('%s_%s-%s.png' % (sub, tx, view), (900, 800))
+
+    tasks = []
+    for task in task_names(num_tasks):
+        img('%s_task-%s_ref.png' % (sub, task), (480, 480))
+        for run in range(1, num_runs + 1):
+            fmri_name = 'task-%s%02d' % (task, run)
+            tasks.append((task, '%02d' % run))
+            os.makedirs(os.path.join(results_path, fmri_name), exist_ok=True)
+            for desc in [ 'TaskInT1', 'T1InTask' ]:
+                img('%s_%s_desc-%s.gif' % (sub, fmri_name, desc), (1800, 220))
+            img('%s_task-%s_run-%02d_bold.png' % (sub, task, run), (480, 480))
+
+            # Gray plots: made by DCAN-BOLD processing in the summary dir, and
+            # copied to img by the layout.
+            for prefix in [ '', 'postreg_' ]:
+                copy_or_write(os.path.join(summary_path, '%sDVARS_and_FD_%s.png' % (prefix, fmri_name)), (1600, 1200), cache)
+
+    for concat in [ 'CONCA', 'CONCP' ]:
+        copy_or_write(os.path.join(summary_path, 'DVARS_and_FD_%s_task-rest.png' % concat), (1600, 1200), cache)
+
+    return { 'files_path'  : files_path,
+             'summary_path': summary_path,
+             'html_path'   : html_path,
+             'images_path' : images_path,
+             'tasks'       : tasks }
+
+
+def make_pipeline_inputs(root, num_tasks, num_runs, subject_id='01', summary_dir='summary_DCANBOLDProc_v4.0.0'):
+    """
+    Makes the inputs of the preprocessor for one subject: a "files"
+    directory with the anatomicals, surfaces, subcorticals and a volume for
+    each task run, a bids func directory, and the DCAN-BOLD gray plots. The
+    volumes are empty; they are only read by the stub tools.
+
+    :parameter: root: directory in which to make "files" and "func".
+    :parameter: num_tasks: number of tasks.
+    :parameter: num_runs: number of runs of each task.
+    :return: dict of files_path, func_path, summary_dir and tasks.
+    """
+    files_path = os.path.join(root, 'files')
+    atlas_space = os.path.join(files_path, 'MNINonLinear')
+    func_path = os.path.join(root, 'func')
+    summary_path = os.path.join(files_path, summary_dir)
+    for directory in [ os.path.join(atlas_space, 'fsaverage_LR32k'), os.path.join(atlas_space, 'ROIs'),
+                       os.path.join(atlas_space, 'Results'), func_path, summary_path ]:
+        os.makedirs(directory, exist_ok=True)
+
+    def touch(path):
+        open(path, 'w').close()
+
+    for name in [ 'T1w_restore', 'T1w_restore_brain', 'T2w_restore', 'T2w_restore_brain' ]:
+        touch(os.path.join(atlas_space, name + '.nii.gz'))
+    for hemi in [ 'L', 'R' ]:
+        for surf in [ 'white', 'pial' ]:
+            touch(os.path.join(atlas_space, 'fsaverage_LR32k', '%s.%s.%s.32k_fs_LR.surf.gii' % (subject_id, hemi, surf)))
+    for name in [ 'sub2atl_ROI.2', 'Atlas_ROIs.2' ]:
+        touch(os.path.join(atlas_space, 'ROIs', name + '.nii.gz'))
+
+    cache = {}
+    tasks = []
+    for task in task_names(num_tasks):
+        for run in range(1, num_runs + 1):
+            fmri_name = 'task-%s%02d' % (task, run)
+            tasks.append((task, '%02d' % run))
+            os.makedirs(os.path.join(atlas_space, 'Results', fmri_name), exist_ok=True)
+            touch(os.path.join(atlas_space, 'Results', fmri_name, fmri_name + '.nii.gz'))
+            for suffix in [ 'bold', 'sbref' ]:
+                touch(os.path.join(func_path, 'sub-%s_task-%s_run-%02d_%s.nii.gz' % (subject_id, task, run, suffix)))
+            for prefix in [ '', 'postreg_' ]:
+                copy_or_write(os.path.join(summary_path, '%sDVARS_and_FD_%s.png' % (prefix, fmri_name)), (1600, 1200), cache)
+
+    return { 'files_path'  : files_path,
+             'func_path'   : func_path,
+             'summary_dir' : summary_dir,
+             'tasks'       : tasks }
+
+
+def make_templates(templates_dir, num_frames=169):
+    """
+    Makes stand-ins for the scene templates and the default atlas that the
+    preprocessor expects in its templates directory. The brainsprite
+    template has one SceneInfo per frame; the stubs ignore the rest.
+
+    :return: templates_dir
+    """
+    os.makedirs(templates_dir, exist_ok=True)
+    with open(os.path.join(templates_dir, 'parasagittal_Tx_169_template.scene'), 'w') as fd:
+        fd.write('TX_IMG_NAME_and_PATH R_PIAL_NAME_and_PATH L_PIAL_NAME_and_PATH R_WHITE_NAME_and_PATH L_WHITE_NAME_and_PATH\n')
+        for frame in range(1, num_frames + 1):
+            fd.write('<SceneInfo Index="%d">TX_IMG_NAME</SceneInfo>\n' % frame)
+    with open(os.path.join(templates_dir, 'image_template_temp.scene'), 'w') as fd:
+        fd.write('T2_IMG_PATH T1_IMG_PATH RPIAL_PATH LPIAL_PATH RWHITE_PATH LWHITE_PATH\n')
+    open(os.path.join(templates_dir, 'MNI152_T1_1mm_brain.nii.gz'), 'w').close()
+    return templates_dir
@@ -0,0 +1,102 @@
+__doc__ = """
+Stand-ins for the workbench and FSL tools called by the Executive Summary,
+so that the whole pipeline can be run (and timed) on any Linux box. Each
+stub waits for a set latency and then writes the same output every time:
+a png from the stub directory, or an empty file for the volumes.
+"""
+
+import os
+import stat
+from fixtures import write_png
+from brainsprite import frame_size
+
+STUB_TOOLS = [ 'wb_command', 'slicesdir', 'slicer', 'pngappend', 'flirt', 'imcp', 'fslmaths' ]
+
+# What each stub does after its latency. $STUBS is the stub directory.
+STUB_BODIES = {
+    # wb_command -show-scene <scene> <index> <out> <width> <height>
+    'wb_command': '''
+if [ "$1" = "-version" ] ; then
+    echo "Version: stub"
+    exit 0
+fi
+if [ -f "${STUBS}/frame_${5}x${6}.png" ] ; then
+    cp "${STUBS}/frame_${5}x${6}.png" "$4"
+else
+    cp "${STUBS}/frame_900x800.png" "$4"
+fi
+''',
+    # slicesdir [-p <red>] <img>: leaves slicesdir/<img>.png
+    'slicesdir': '''
+for img ; do : ; done
+img=$( basename ${img%.gz} )
+mkdir -p slicesdir
+cp "${STUBS}/strip.png" "slicesdir/${img%.nii}.png"
+''',
+    # slicer <in> [<in2>] ... <out>.png ...: every .png arg is an output.
+    'slicer': '''
+for arg ; do
+    case "${arg}" in
+        *.png) cp "${STUBS}/slice.png" "${arg}" ;;
+    esac
+done
+''',
+    # pngappend <a> + <b> ... <out>
+    'pngappend': '''
+for out ; do : ; done
+cp "${STUBS}/strip.png" "${out}"
+''',
+    # flirt ... -out <out>
+    'flirt': '''
+while [ $# -gt 0 ] ; do
+    if [ "$1" = "-out" ] ; then
+        : > "$2"
+    fi
+    shift
+done
+''',
+    # imcp <src> <dst>
+    'imcp': '''
+cp "$1" "$2"
+''',
+    # fslmaths <in> <ops> ... <out>
+    'fslmaths': '''
+for out ; do : ; done
+: > "${out}"
+'''
+    }
+
+
+def make_stub_tools(stub_dir, latency=0.0, tool_latency=None):
+    """
+    Writes the stub tools, and the pngs they hand out, to stub_dir. Put
+    stub_dir on the PATH, and set CARET7DIR to it for wb_command.
+
+    :parameter: stub_dir: directory for the stubs.
+    :parameter: latency: seconds each call takes.
+    :parameter: tool_latency: dict of tool name to seconds, to override latency.
+    :return: stub_dir
+    """
+    tool_latency = tool_latency or {}
+    os.makedirs(stub_dir, exist_ok=True)
+
+    # Outputs: brainsprite frames at both qualities, named scene pngs, and
+    # slices and strips of slices.
+    for quality in [ 'full', 'draft' ]:
+        width, height = frame_size(quality)
+        write_png(os.path.join(stub_dir, 'frame_%sx%s.png' % (width, height)), (width, height))
+    write_png(os.path.join(stub_dir, 'slice.png'), (200, 220), seed=1)
+    write_png(os.path.join(stub_dir, 'strip.png'), (1800, 220), seed=2)
+
+    for tool in STUB_TOOLS:
+        seconds = tool_latency.get(tool, latency)
+        path = os.path.join(stub_dir, tool)
+        with open(path, 'w') as fd:
+            fd.write('#!/bin/sh\n')
+            fd.write('STUBS=%s\n' % os.path.abspath(stub_dir))
+            if seconds > 0:
+                fd.write('sleep %s\n' % seconds)
+            fd.write(STUB_BODIES[tool].lstrip('\n'))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return stub_dir
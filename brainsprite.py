@@ -0,0 +1,329 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from PIL import Image
+from packaging.version import Version
+from re import split
+from math import sqrt, ceil
+from surfaces import load_surface, plane_segments, draw_segments, CONTOUR_COLORS
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# Each frame of the brainsprite occupies a square of this size in the mosaic.
+MOSAIC_IMAGE_DIM = 218
+
+# Size at which wb_command renders each brainsprite frame. 'full' is the size
+# used by the workbench scenes; 'draft' renders the frames at the size they
+# will have in the mosaic, so make_mosaic does not need to shrink them.
+FULL_FRAME_SIZE = (900, 800)
+RENDER_QUALITIES = [ 'full', 'draft' ]
+
+# How the brainsprite frames are made. 'workbench' renders each frame of the
+# scene with wb_command; 'native' slices the volume in this process.
+SPRITE_RENDERERS = [ 'workbench', 'native' ]
+
+# Frames in a native sprite (as in the parasagittal scene template), and the
+# percentiles of the head's intensities shown as black and white.
+NATIVE_FRAMES = 169
+SPRITE_PERCENTILES = (2, 98)
+
+# Decide once which name the resampling filter has in this version of PIL.
+if Version(Image.__version__) >= Version('10.0.0'):
+    LANCZOS = Image.Resampling.LANCZOS
+else:
+    LANCZOS = Image.ANTIALIAS
+
+
+def frame_size(quality, image_dim=MOSAIC_IMAGE_DIM):
+    # Returns the (width, height) at which to render brainsprite frames.
+    # Draft frames have the aspect of full frames, scaled down to fit in
+    # an image_dim square (the same size thumbnail() would make).
+    full_w, full_h = FULL_FRAME_SIZE
+    if quality == 'full':
+        return full_w, full_h
+
+    scale = image_dim / max(full_w, full_h)
+    return max(1, round(full_w * scale)), max(1, round(full_h * scale))
+
+
+def count_scene_frames(scene_path):
+    # Each frame of a brainsprite scene file has its own SceneInfo.
+    with open(scene_path) as scene:
+        return sum(1 for line in scene if 'SceneInfo Index=' in line)
+
+
+def find_wb_command():
+    # setup_env.sh sets wb_command (and CARET7DIR) to where the site keeps
+    # workbench. Use the first of those, or of wb_command on the PATH, that
+    # can be run. None if there is none.
+    candidates = [ os.environ.get('wb_command') ]
+    if os.environ.get('CARET7DIR'):
+        candidates.append(os.path.join(os.environ['CARET7DIR'], 'wb_command'))
+    candidates.append(shutil.which('wb_command'))
+    for wb_command in candidates:
+        if wb_command and os.path.isfile(wb_command) and os.access(wb_command, os.X_OK):
+            return wb_command
+    return None
+
+
+def natural_sort(l):
+    # Sort so that frames come out in numeric order (frame_2 before frame_10).
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    alphanum_key = lambda key: [ convert(c) for c in split('([0-9]+)', key) ]
+    return sorted(l, key = alphanum_key)
+
+
+def mosaic_grid(num_frames):
+    # Returns (columns, rows) for the mosaic. A square number of frames
+    # (e.g., 169) makes a square mosaic; any other number gets as many
+    # rows as needed to hold all of the frames.
+    columns = max(1, int(ceil(sqrt(num_frames))))
+    rows = max(1, int(ceil(num_frames / columns)))
+    return columns, rows
+
+
+def new_canvas(num_frames, image_dim=MOSAIC_IMAGE_DIM):
+    # Allocate the whole mosaic up front; frames are copied into it.
+    columns, rows = mosaic_grid(num_frames)
+    canvas = np.zeros((rows * image_dim, columns * image_dim, 3), dtype=np.uint8)
+    return canvas, columns
+
+
+def load_frame(path, image_dim=MOSAIC_IMAGE_DIM):
+    # Decode a frame and shrink it to fit in its square of the mosaic. The
+    # file is closed before returning. The frame is not flipped here; that
+    # is done by paste_frame as it is copied into the canvas.
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+    if max(img.size) > image_dim:
+        img.thumbnail((image_dim, image_dim), resample=LANCZOS)
+    # Otherwise, frame was rendered at mosaic size (draft quality).
+    return np.asarray(img)
+
+
+def paste_frame(canvas, frame, index, columns, image_dim=MOSAIC_IMAGE_DIM):
+    # Copy a frame, flipped left to right, into its square of the mosaic.
+    x = index % columns * image_dim
+    y = index // columns * image_dim
+    h, w = frame.shape[:2]
+    canvas[y:y + h, x:x + w] = frame[:, ::-1]
+
+
+def save_mosaic(canvas, mosaic_path):
+    quality_val = 95
+    Image.fromarray(canvas).save(mosaic_path, 'JPEG', quality=quality_val)
+
+
+def make_mosaic(png_path, mosaic_path, image_dim=MOSAIC_IMAGE_DIM, jobs=None):
+    """
+    Takes path to .png anatomical slices, creates a mosaic that can be
+    used in a BrainSprite viewer, and saves to a specified filename.
+
+    Frames are decoded and shrunk by a pool of threads (PIL releases the
+    GIL while it does both). Only a few frames per thread are in flight at
+    any time, so memory is the canvas plus a handful of frames no matter
+    how many frames there are.
+
+    :parameter: png_path: directory holding only the frames.
+    :parameter: mosaic_path: path of the jpg to write.
+    :parameter: image_dim: size of each frame's square in the mosaic.
+    :parameter: jobs: number of decoding threads. Default: cpu count.
+    :return: None
+    """
+    # Frames are named with their numbers; the mosaic is in reverse order.
+    files = natural_sort(os.listdir(png_path))[::-1]
+    paths = [ os.path.join(png_path, file) for file in files ]
+
+    canvas, columns = new_canvas(len(paths), image_dim)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    max_in_flight = 2 * jobs
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        in_flight = deque()
+        for index, path in enumerate(paths):
+            in_flight.append((index, pool.submit(load_frame, path, image_dim)))
+            if len(in_flight) >= max_in_flight:
+                done_index, future = in_flight.popleft()
+                paste_frame(canvas, future.result(), done_index, columns, image_dim)
+
+        while in_flight:
+            done_index, future = in_flight.popleft()
+            paste_frame(canvas, future.result(), done_index, columns, image_dim)
+
+    save_mosaic(canvas, mosaic_path)
+
+
+def stream_mosaic(scene_path, mosaic_path, wb_command=None, jobs=1,
+        quality='full', image_dim=MOSAIC_IMAGE_DIM, scratch_dir=None, call=None, num_frames=None):
+    """
+    Renders every frame of a brainsprite scene and pastes each frame into
+    the mosaic as soon as its render finishes. Frames are written to a
+    scratch directory (by default, tempfile's, i.e. $TMPDIR) and removed as
+    soon as they are pasted, so no frame pngs are left in the files dir.
+
+    :parameter: scene_path: brainsprite scene built from the template.
+    :parameter: mosaic_path: path of the jpg to write.
+    :parameter: wb_command: path to wb_command. Default: find_wb_command().
+    :parameter: jobs: number of frames to render at the same time.
+    :parameter: quality: one of RENDER_QUALITIES.
+    :parameter: image_dim: size of each frame's square in the mosaic.
+    :parameter: scratch_dir: node-local directory for frames in flight.
+    :parameter: call: function with which to run each wb_command, taking the
+                args of subprocess.call and a 'stage' (e.g., RunProfile.call).
+    :parameter: num_frames: frames in the scene, if known (e.g., from the
+                scene template). Default: count them.
+    :return: True if the mosaic was written; False if a frame failed.
+    """
+    if wb_command is None:
+        wb_command = find_wb_command()
+
+    total_frames = num_frames or count_scene_frames(scene_path)
+    width, height = frame_size(quality, image_dim)
+
+    canvas, columns = new_canvas(total_frames, image_dim)
+
+    scratch = tempfile.mkdtemp(prefix='brainsprite_', dir=scratch_dir)
+
+    def render(frame):
+        out = os.path.join(scratch, 'frame_%d.png' % frame)
+        cmd = [ wb_command, '-show-scene', scene_path, str(frame), out, str(width), str(height) ]
+        if call is not None:
+            returncode = call(cmd, stage='brainsprite', stdout=subprocess.DEVNULL)
+        else:
+            returncode = subprocess.call(cmd, stdout=subprocess.DEVNULL)
+        return frame, out, returncode
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [ pool.submit(render, frame) for frame in range(1, total_frames + 1) ]
+
+            for future in as_completed(futures):
+                frame, out, returncode = future.result()
+                if returncode != 0:
+                    # Stop on the first failed frame: do not start any more.
+                    for pending in futures:
+                        pending.cancel()
+                    print('ERROR: wb_command failed (%s) on frame %s of %s.' % (returncode, frame, scene_path))
+                    return False
+
+                # Frames are numbered from 1 and the mosaic is in reverse
+                # order (see make_mosaic), so frame 'total_frames' is first.
+                frame_data = load_frame(out, image_dim)
+                paste_frame(canvas, frame_data, total_frames - frame, columns, image_dim)
+                os.remove(out)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    save_mosaic(canvas, mosaic_path)
+    return True
+
+
+def axis_samples(data, axis, positions):
+    # Linearly interpolates data at (fractional) positions along one axis;
+    # 0 outside of the data.
+    size = data.shape[axis]
+    low = np.floor(positions).astype(np.intp)
+    frac = (positions - low).astype(np.float32)
+    inside = (positions >= 0) & (positions <= size - 1)
+    high = np.clip(low + 1, 0, size - 1)
+    low = np.clip(low, 0, size - 1)
+
+    shape = [ 1 ] * data.ndim
+    shape[axis] = -1
+    w_low = ((1 - frac) * inside).reshape(shape)
+    w_high = (frac * inside).reshape(shape)
+    return np.take(data, low, axis=axis) * w_low + np.take(data, high, axis=axis) * w_high
+
+
+def volume_mosaic(volume_path, mosaic_path, surfaces=None, num_frames=NATIVE_FRAMES,
+        image_dim=MOSAIC_IMAGE_DIM):
+    """
+    Makes a brainsprite mosaic straight from a volume, with no per-frame
+    renders: the volume is loaded once, and its parasagittal slices are
+    resampled (with numpy, a row of the mosaic at a time) to fill their
+    squares, scaled to the head's intensities and, optionally, outlined
+    with surfaces.
+
+    The layout is the one brainsprite.js reads: slices from left to right,
+    row by row, each with anterior to the right and superior at the top.
+
+    :parameter: volume_path: e.g., T1w_restore.nii.gz.
+    :parameter: mosaic_path: path of the jpg to write.
+    :parameter: surfaces: GIFTI surfaces (pial and/or white) to outline.
+    :parameter: num_frames: number of slices.
+    :parameter: image_dim: size of each frame's square in the mosaic.
+    :return: None
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to make a native brainsprite.')
+
+    image = nibabel.as_closest_canonical(nibabel.load(volume_path))
+    data = np.asanyarray(image.dataobj)
+    if data.ndim > 3:
+        data = data[..., 0]
+    data = data.astype(np.float32, copy=False)
+    zooms = image.header.get_zooms()[:3]
+
+    head = data[data > 0]
+    if head.size:
+        vmin, vmax = np.percentile(head, SPRITE_PERCENTILES)
+    else:
+        vmin, vmax = 0.0, 1.0
+    scale = 255.0 / max(float(vmax - vmin), 1e-6)
+
+    # Frame the head: slices across its width, and squares that fit its
+    # height and depth (in mm).
+    mask = data > vmin
+    low, high = [], []
+    for axis in range(3):
+        extent = np.flatnonzero(mask.any(axis=tuple(other for other in range(3) if other != axis)))
+        if extent.size == 0:
+            extent = np.array([ 0, data.shape[axis] - 1 ])
+        low.append(extent[0])
+        high.append(extent[-1])
+
+    xs = np.linspace(low[0], high[0], num_frames)
+    mm_per_pixel = max((high[1] - low[1] + 1) * zooms[1], (high[2] - low[2] + 1) * zooms[2]) / image_dim
+    offsets = np.arange(image_dim) - (image_dim - 1) / 2.0
+    ys = (low[1] + high[1]) / 2.0 + offsets * mm_per_pixel / zooms[1]
+    zs = (low[2] + high[2]) / 2.0 - offsets * mm_per_pixel / zooms[2]
+
+    # Surfaces, in voxels of the (canonical) volume.
+    outlines = []
+    to_voxels = np.linalg.inv(image.affine)
+    for surface in surfaces or []:
+        vertices, faces = load_surface(surface)
+        voxels = vertices @ to_voxels[:3, :3].T + to_voxels[:3, 3]
+        kind = 'pial' if 'pial' in os.path.basename(surface) else 'white'
+        outlines.append((voxels, faces, CONTOUR_COLORS[kind]))
+
+    canvas, columns = new_canvas(num_frames, image_dim)
+    for first in range(0, num_frames, columns):
+        last = min(num_frames, first + columns)
+        frames = axis_samples(data, 0, xs[first:last])
+        frames = axis_samples(frames, 1, ys)
+        frames = axis_samples(frames, 2, zs)
+        gray = np.clip((frames.transpose(0, 2, 1) - vmin) * scale, 0, 255).astype(np.uint8)
+
+        for index in range(first, last):
+            rgb = np.repeat(gray[index - first][:, :, None], 3, axis=2)
+            for voxels, faces, color in outlines:
+                segments = plane_segments(voxels, faces, 0, xs[index])
+                # (y, z) in voxels to (row, column) in pixels.
+                pixels = np.stack([ (segments[:, :, 2] - zs[0]) / (zs[1] - zs[0]),
+                                    (segments[:, :, 1] - ys[0]) / (ys[1] - ys[0]) ], axis=2)
+                draw_segments(rgb, pixels, color)
+
+            x = index % columns * image_dim
+            y = index // columns * image_dim
+            canvas[y:y + image_dim, x:x + image_dim] = rgb
+
+    save_mosaic(canvas, mosaic_path)
@@ -47,6 +47,18 @@ IMAGE_INFO = {
     'bold': {
         'pattern': '*%s*bold.png',
         'title': 'BOLD'
+        },
+    'temporal_mean': {
+        'pattern': '*%s*_desc-TemporalMean.png',
+        'title': 'Temporal Mean'
+        },
+    'temporal_std': {
+        'pattern': '*%s*_desc-TemporalStd.png',
+        'title': 'Temporal SD'
+        },
+    'tsnr': {
+        'pattern': '*%s*_desc-tSNR.png',
+        'title': 'tSNR'
         }
     }
 
@@ -118,28 +130,30 @@ TX_SECTION = """
 
 # Layout images in different formats - row, half, quarter.
 # Needs the following values:
-#    row_label, row_img, row_modal, row_idx
+#    row_label, row_thumb, row_modal, row_idx
+# The page shows the thumbnail of the image (see thumbnails.py); the full
+# image is in the modal container.
 # Modal and idx are the slider and the index into the slider (or other modal
 # container) to which the image was added. If the user clicks on the image, html
 # will open the modal container to the index.
 LAYOUT_ROW = """
         <div  class="w3-row-padding">
             <div class="w3-col l1 label2">{row_label}</div>
-            <div class="w3-col l11"><img src="{row_img}" onclick="open_{row_modal}_to_index({row_idx})"></div>
+            <div class="w3-col l11"><img src="{row_thumb}" onclick="open_{row_modal}_to_index({row_idx})"></div>
         </div>
         """
 
 LAYOUT_HALF_ROW = """
         <div  class="w3-row-padding">
             <div class="w3-col l2 label2">{row_label}</div>
-            <div class="w3-col l9"><img src="{row_img}" onclick="open_{row_modal}_to_index({row_idx})"></div>
+            <div class="w3-col l9"><img src="{row_thumb}" onclick="open_{row_modal}_to_index({row_idx})"></div>
         </div>
         """
 
 LAYOUT_QUARTER_ROW = """
             <div class="w3-quarter">
                 <div class="w3-row w3-center label1">{row_label}</div>
-                <div class="w3-row"><img src="{row_img}" onclick="open_{row_modal}_to_index({row_idx})"></div>
+                <div class="w3-row"><img src="{row_thumb}" onclick="open_{row_modal}_to_index({row_idx})"></div>
             </div>
             """
 
@@ -234,6 +248,15 @@ BOLD_GRAY_END = """
         </div>
         """
 
+# Layout the row of temporal statistics (mean, SD, tSNR) of the task's BOLD.
+TEMPORAL_ROW_START = """
+        <div class="w3-row-padding">
+            <div class="w3-col l1 label2"><br>Temporal Statistics</div>
+        """
+TEMPORAL_ROW_END = """
+        </div>
+        """
+
 # Layout the row of bold, reference and gray-ordinates images for the task.
 # Needs the following values and corresponding indices:
 #    modal_id, bold, ref, task_pre_reg_gray, task_post_reg_gray
@@ -303,32 +326,55 @@ MODAL_END = """
 # too obtrusive.
 # We assign a specific class so that scripts can find the images
 # by calling getElementsByClassName().
+# The image's path is in data-src rather than src, so the browser does
+# not fetch it when the page loads. load_slide() fetches it when the
+# image is first shown (see MODAL_SCRIPTS and SLIDER_SCRIPTS).
 # Needs the following values:
 #    image_class, image_file, display_name.
 IMAGE_WITH_CLASS = """
                 <div class="w3-display-container {image_class}">
-                    <img src="{image_file}">
+                    <img data-src="{image_file}">
                     <div class="w3-display-topleft w3-black"><p>{display_name}</p></div>
                 </div>
                 """
 
+# Fetches the image of a slide (an element made with IMAGE_WITH_CLASS)
+# the first time it is called for that slide. Only needed once, before
+# the modal and slider scripts.
+LAZY_LOAD_SCRIPT = """
+<script>
+    function load_slide(slide) {
+        var img = slide.getElementsByTagName("img")[0];
+        if (img && img.hasAttribute("data-src")) {
+            img.src = img.getAttribute("data-src");
+            img.removeAttribute("data-src");
+        }
+    }
+</script>
+"""
+
 # The modal scripts that will show the chosen image.
+# The images of the class are looked up once. Showing an image hides
+# only the one shown before it, fetches the image if need be, and
+# prefetches the next one.
 # Needs the following values:
 #    modal_id, image_class.
 MODAL_SCRIPTS = """
 <script>
     var %(image_class)sIdx = 1;
-    show_%(image_class)s(%(image_class)sIdx)
+    var %(image_class)sSlides = document.getElementsByClassName("%(image_class)s");
+    var %(image_class)sShown = null;
 
     function show_%(image_class)s(n) {
-        var i;
-        var x = document.getElementsByClassName("%(image_class)s");
+        var x = %(image_class)sSlides;
+        if (x.length == 0) { return }
         if (n > x.length) { %(image_class)sIdx = 1 }
         if (n < 1) { %(image_class)sIdx = x.length }
-        for (i = 0; i < x.length; i++) {
-            x[i].style.display = "none";
-        }
-        x[%(image_class)sIdx-1].style.display = "block";
+        if (%(image_class)sShown) { %(image_class)sShown.style.display = "none" }
+        %(image_class)sShown = x[%(image_class)sIdx-1];
+        load_slide(%(image_class)sShown);
+        %(image_class)sShown.style.display = "block";
+        load_slide(x[%(image_class)sIdx %% x.length]);
     }
 
     function open_%(modal_id)s_to_index(idx) {
@@ -339,27 +385,29 @@ MODAL_SCRIPTS = """
 """
 
 # The slider scripts that will show the next or previous image
-# in a given class.
+# in a given class. Images are shown (and fetched) as in MODAL_SCRIPTS.
 # Needs the following values:
 #    modal_id, image_class.
 SLIDER_SCRIPTS = """
 <script>
     var %(image_class)sIdx = 1;
-    show_%(image_class)s(%(image_class)sIdx)
+    var %(image_class)sSlides = document.getElementsByClassName("%(image_class)s");
+    var %(image_class)sShown = null;
 
     function change_%(image_class)s(n) {
         show_%(image_class)s(%(image_class)sIdx += n)
     }
 
     function show_%(image_class)s(n) {
-        var i;
-        var x = document.getElementsByClassName("%(image_class)s");
+        var x = %(image_class)sSlides;
+        if (x.length == 0) { return }
         if (n > x.length) { %(image_class)sIdx = 1 }
         if (n < 1) { %(image_class)sIdx = x.length }
-        for (i = 0; i < x.length; i++) {
-            x[i].style.display = "none";
-        }
-        x[%(image_class)sIdx-1].style.display = "block";
+        if (%(image_class)sShown) { %(image_class)sShown.style.display = "none" }
+        %(image_class)sShown = x[%(image_class)sIdx-1];
+        load_slide(%(image_class)sShown);
+        %(image_class)sShown.style.display = "block";
+        load_slide(x[%(image_class)sIdx %% x.length]);
     }
 
     function open_%(modal_id)s_to_index(idx) {
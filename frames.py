@@ -0,0 +1,110 @@
+import os
+import gzip
+import numpy as np
+from resample import Volume
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# Most bytes of a run read at a time by iter_frames.
+CHUNK_BYTES = 64 << 20
+
+
+def frame_count(proxy):
+    # Number of 3-D frames in a run; 1 for a 3-D volume.
+    shape = proxy.shape
+    return int(np.prod(shape[3:])) if len(shape) > 3 else 1
+
+
+def frame_layout(proxy, frame):
+    """
+    Finds where a frame of a NIfTI volume is in its (uncompressed) file.
+
+    :parameter: proxy: nibabel array proxy (the dataobj of a loaded image,
+                which holds the offset, dtype and scaling from the header).
+    :parameter: frame: index of the 3-D volume in the run.
+    :return: tuple of the offset and size (in bytes), the shape, and the
+             dtype (with its byte order) of the frame.
+    """
+    frames = frame_count(proxy)
+    if not 0 <= frame < frames:
+        raise IndexError('frame %s of a run of %s' % (frame, frames))
+    shape = tuple(int(dim) for dim in (tuple(proxy.shape[:3]) + (1, 1))[:3])
+    dtype = np.dtype(proxy.dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    return int(proxy.offset) + frame * size, size, shape, dtype
+
+
+def scaled(array, proxy):
+    # Applies the scaling of the header (scl_slope and scl_inter), if any.
+    slope, inter = float(proxy.slope), float(proxy.inter)
+    if (slope, inter) != (1.0, 0.0):
+        array = array.astype(np.float32) * slope + inter
+    return array
+
+
+def read_frame(path, frame=0):
+    """
+    Reads one 3-D frame of a (possibly 4-D, possibly gzipped) NIfTI run,
+    e.g., the first volume of a BOLD run, as slicer shows it. Only the
+    header and the bytes of that frame are read: memory is one frame
+    however long the run is. In a gzipped run, the data before the frame is
+    decompressed and dropped; the first frame comes right after the header.
+
+    :parameter: path: .nii or .nii.gz file.
+    :parameter: frame: which frame. Default: the first.
+    :return: Volume of the frame, named after the run.
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read a frame of %s' % path)
+
+    image = nibabel.load(path)
+    offset, size, shape, dtype = frame_layout(image.dataobj, frame)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as fd:
+        fd.seek(offset)
+        data = fd.read(size)
+    if len(data) != size:
+        raise ValueError('%s is truncated: frame %s is incomplete' % (path, frame))
+
+    array = scaled(np.frombuffer(data, dtype=dtype).reshape(shape, order='F'), image.dataobj)
+
+    frame_image = image.__class__(array, image.affine, header=image.header)
+    frame_image.header.set_data_dtype(array.dtype)
+    name = os.path.basename(path).replace('.nii.gz', '').replace('.nii', '')
+    return Volume(name, frame_image)
+
+
+def iter_frames(path, chunk_bytes=CHUNK_BYTES, itemsize=None):
+    """
+    Reads a run from its first frame to its last, in one pass over the
+    (possibly gzipped) file, a chunk of frames at a time. Memory is one
+    chunk however long the run is.
+
+    :parameter: path: .nii or .nii.gz file.
+    :parameter: chunk_bytes: most bytes of data in a chunk. A chunk has at
+                least one frame.
+    :parameter: itemsize: bytes the caller holds for each voxel of a chunk,
+                e.g., for the data as read and a float64 copy of it.
+                Default: the size of the data as read.
+    :return: generator of arrays of shape (X, Y, Z, frames in the chunk).
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read the frames of %s' % path)
+
+    image = nibabel.load(path)
+    offset, size, shape, dtype = frame_layout(image.dataobj, 0)
+    frames = frame_count(image.dataobj)
+    voxels = size // dtype.itemsize
+    per_chunk = max(1, chunk_bytes // (voxels * (itemsize or dtype.itemsize)))
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as fd:
+        fd.seek(offset)
+        for first in range(0, frames, per_chunk):
+            count = min(per_chunk, frames - first)
+            data = fd.read(count * size)
+            if len(data) != count * size:
+                raise ValueError('%s is truncated: frame %s is incomplete' % (path, first + len(data) // size))
+            yield scaled(np.frombuffer(data, dtype=dtype).reshape(shape + (count,), order='F'), image.dataobj)
@@ -0,0 +1,197 @@
+import os
+import numpy as np
+from PIL import Image, ImageDraw
+from frames import iter_frames, CHUNK_BYTES
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# Size of a gray plot (as DCAN-BOLD processing makes them), and the heights
+# of its FD and DVARS traces. The rest is the plot of the grayordinates.
+GRAYPLOT_SIZE = (1600, 1200)
+TRACE_HEIGHT = 200
+
+# Rows of grayordinates (or voxels) averaged into each row of the plot.
+GRAYPLOT_ROWS = 400
+
+# Grayordinates are shown in standard deviations from their mean, clipped
+# to this many.
+GRAYPLOT_RANGE = 2.0
+
+# FD (mm) above which a frame is marked, and the head radius (mm) used to
+# turn rotations into displacements.
+FD_THRESHOLD = 0.2
+HEAD_RADIUS = 50.0
+
+FD_COLOR = (200, 0, 0)
+DVARS_COLOR = (0, 0, 200)
+LINE_COLOR = (160, 160, 160)
+
+
+def binned_sums(block, bins, rows):
+    """
+    Adds up the grayordinates of a block into the rows of the plot they
+    fall into, all at once.
+
+    :parameter: block: array (grayordinates, frames).
+    :parameter: bins: row of each grayordinate of the block; ascending.
+    :parameter: rows: number of rows of the plot.
+    :return: array (rows, frames).
+    """
+    sums = np.zeros((rows, block.shape[1]))
+    starts = np.flatnonzero(np.r_[ True, bins[1:] != bins[:-1] ])
+    sums[bins[starts]] = np.add.reduceat(block, starts, axis=0)
+    return sums
+
+
+def dtseries_rows(path, rows=GRAYPLOT_ROWS, chunk_bytes=CHUNK_BYTES):
+    """
+    Reads a CIFTI dtseries, a block of grayordinates at a time. The time
+    series of each grayordinate is contiguous in the file, so a block is one
+    read, and memory is one block however long the run is.
+
+    :return: tuple of the mean of the grayordinates in each row of the plot
+             (rows x frames), and the sum over grayordinates of the squared
+             change from each frame to the next (frames; 0 for the first),
+             and the number of grayordinates.
+    """
+    image = nibabel.load(path)
+    frames, count = image.dataobj.shape[:2]
+    bins = (np.arange(count) * rows) // count
+    per_chunk = max(1, chunk_bytes // (frames * np.dtype(image.dataobj.dtype).itemsize))
+
+    sums = np.zeros((rows, frames))
+    squares = np.zeros(frames)
+    for first in range(0, count, per_chunk):
+        last = min(count, first + per_chunk)
+        block = np.asanyarray(image.dataobj[:, first:last], dtype=np.float64).T
+        sums += binned_sums(block, bins[first:last], rows)
+        squares[1:] += (np.diff(block, axis=1) ** 2).sum(axis=0)
+    return sums / np.maximum(np.bincount(bins, minlength=rows), 1)[:, None], squares, count
+
+
+def volume_rows(path, rows=GRAYPLOT_ROWS, chunk_bytes=CHUNK_BYTES):
+    """
+    Reads a 4-D NIfTI run, a chunk of frames at a time, as dtseries_rows
+    reads a dtseries. The voxels are those that are not 0 in the first
+    frame.
+    """
+    columns = []
+    squares = []
+    mask = None
+    previous = None
+    for chunk in iter_frames(path, chunk_bytes):
+        if mask is None:
+            mask = chunk[..., 0] != 0
+            count = max(1, int(mask.sum()))
+            bins = (np.arange(count) * rows) // count
+            counts = np.maximum(np.bincount(bins, minlength=rows), 1)[:, None]
+        block = chunk[mask].astype(np.float64)
+        columns.append(binned_sums(block, bins, rows) / counts)
+        if previous is None:
+            previous = block[:, :1]
+        squares.append((np.diff(np.hstack([ previous, block ]), axis=1) ** 2).sum(axis=0))
+        previous = block[:, -1:]
+    return np.hstack(columns), np.concatenate(squares), count
+
+
+def timeseries_rows(path, rows=GRAYPLOT_ROWS, chunk_bytes=CHUNK_BYTES):
+    # A dtseries or a volume; see dtseries_rows.
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read %s' % path)
+    if path.endswith('.dtseries.nii'):
+        return dtseries_rows(path, rows, chunk_bytes)
+    return volume_rows(path, rows, chunk_bytes)
+
+
+def framewise_displacement(movement_path):
+    """
+    Computes FD (Power et al.) from HCP-style Movement_Regressors.txt: the
+    first 6 columns are the translations (mm) and rotations (degrees).
+
+    :return: array of FD (mm) of each frame (0 for the first), or None if
+             there are no movement regressors.
+    """
+    if movement_path is None or not os.path.exists(movement_path):
+        return None
+    movement = np.loadtxt(movement_path, ndmin=2)
+    if movement.shape[1] < 6:
+        return None
+    deltas = np.abs(np.diff(movement[:, :6], axis=0))
+    deltas[:, 3:] *= np.pi / 180 * HEAD_RADIUS
+    return np.r_[ 0.0, deltas.sum(axis=1) ]
+
+
+def draw_trace(draw, values, box, color, label, threshold=None):
+    # Plots values (one per frame) across box (left, top, right, bottom),
+    # from 0 at the bottom to their max (or the threshold) near the top,
+    # under the label.
+    left, top, right, bottom = box
+    draw.rectangle(box, outline=LINE_COLOR)
+    top_value = max(float(values.max()) if len(values) else 0.0, threshold or 0.0, 1e-6)
+    scale = 0.9 * (bottom - top - 1) / top_value
+    x = left + (np.arange(len(values)) + 0.5) * (right - left) / max(len(values), 1)
+    y = bottom - np.clip(values, 0, top_value) * scale
+    if threshold is not None:
+        level = bottom - threshold * scale
+        draw.line([ (left, level), (right, level) ], fill=LINE_COLOR)
+    if len(values) > 1:
+        draw.line(list(zip(x.tolist(), y.tolist())), fill=color, width=2)
+    draw.text((left + 4, top + 2), '%s (max %.3g)' % (label, top_value), fill=color)
+
+
+def grayplot(runs, out_path, movement_paths=None, rows=GRAYPLOT_ROWS, chunk_bytes=CHUNK_BYTES):
+    """
+    Makes a gray plot of one run, or of runs one after another (e.g., the
+    concatenated resting state): FD and DVARS over the grayordinates, one
+    column per frame.
+
+    :parameter: runs: paths of the dtseries (or 4-D volumes).
+    :parameter: out_path: .png to write.
+    :parameter: movement_paths: Movement_Regressors.txt of each run, or
+                None; without them, FD is not shown.
+    :return: out_path
+    """
+    means = []
+    dvars = []
+    fds = []
+    for idx, run in enumerate(runs):
+        run_means, squares, count = timeseries_rows(run, rows, chunk_bytes)
+        means.append(run_means)
+        dvars.append(np.sqrt(squares / count))
+        movement_path = movement_paths[idx] if movement_paths else None
+        fd = framewise_displacement(movement_path)
+        if fd is not None and len(fd) != run_means.shape[1]:
+            print('%s has %s frames, %s has %s; FD is not shown.' % (
+                    movement_path, len(fd), run, run_means.shape[1]))
+            fd = None
+        fds.append(fd)
+
+    # Each row of the plot in standard deviations from its mean.
+    plot = np.hstack(means)
+    plot -= plot.mean(axis=1, keepdims=True)
+    std = plot.std(axis=1, keepdims=True)
+    plot /= np.where(std > 0, std, 1)
+    grey = ((np.clip(plot, -GRAYPLOT_RANGE, GRAYPLOT_RANGE) + GRAYPLOT_RANGE) * (255 / (2 * GRAYPLOT_RANGE))).astype(np.uint8)
+
+    width, height = GRAYPLOT_SIZE
+    image = Image.new('RGB', GRAYPLOT_SIZE, (255, 255, 255))
+    plot_top = 2 * TRACE_HEIGHT
+    image.paste(Image.fromarray(grey).resize((width, height - plot_top), Image.NEAREST), (0, plot_top))
+
+    draw = ImageDraw.Draw(image)
+    if all(fd is not None for fd in fds):
+        draw_trace(draw, np.concatenate(fds), (0, 0, width - 1, TRACE_HEIGHT - 1), FD_COLOR, 'FD (mm)', FD_THRESHOLD)
+    else:
+        draw.text((4, 2), 'FD not available', fill=FD_COLOR)
+    draw_trace(draw, np.concatenate(dvars), (0, TRACE_HEIGHT, width - 1, plot_top - 1), DVARS_COLOR, 'DVARS')
+
+    # Mark where each run starts.
+    frames = np.cumsum([ run_means.shape[1] for run_means in means ])
+    for end in frames[:-1]:
+        x = end * width / frames[-1]
+        draw.line([ (x, 0), (x, height) ], fill=LINE_COLOR)
+
+    image.save(out_path)
+    return out_path
@@ -1,7 +1,20 @@
 import os
 from os import path
 import glob
+import fnmatch
 import shutil
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# How find_and_copy_files puts files in the output directory. 'link' makes a
+# reflink or a hardlink when the source is on the same file system, and falls
+# back to a copy when it is not.
+STAGE_MODES = [ 'copy', 'link' ]
+
+# ioctl to clone a file's extents (i.e., make a reflink) on Linux.
+FICLONE = 0x40049409
 
 def find_files(seek_dir, pattern):
     """
@@ -21,15 +34,16 @@ def find_files(seek_dir, pattern):
 
 
 
-def find_and_copy_files(seek_dir, pattern, output_dir):
+def find_and_copy_files(seek_dir, pattern, output_dir, mode='copy'):
     """
     Finds all files within the directory specified that match
-    the glob-style pattern. Copies each file to the output
-    directory.
+    the glob-style pattern. Copies (or links) each file to the
+    output directory, unless it is already there.
 
     :parameter: seek_dir: directory to be searched.
     :parameter: pattern: Unix shell pattern for finding files.
     :parameter: output_dir: directory to which to copy files.
+    :parameter: mode: one of STAGE_MODES.
     :return: list of relative paths of copied files (may be empty).
     """
     rel_paths = []
@@ -39,12 +53,89 @@ def find_and_copy_files(seek_dir, pattern, output_dir):
         # TODO: change name to BIDS name?
         filename = os.path.basename(found_file)
         rel_path = os.path.relpath(os.path.join(output_dir, filename), os.getcwd())
-        shutil.copy(found_file, rel_path)
+        stage_file(found_file, rel_path, mode)
         rel_paths.append(rel_path)
 
     return rel_paths
 
 
+def stage_file(src, dst, mode='copy'):
+    """
+    Puts the contents of src at dst. Does nothing if dst already has the
+    size and modification time of src (or is src). With mode 'link', tries
+    a reflink and then a hardlink before falling back to a copy. Copies
+    keep the modification time of src, so the next call can skip them.
+
+    :parameter: src: path of the file to stage.
+    :parameter: dst: path at which to stage it.
+    :parameter: mode: one of STAGE_MODES.
+    :return: how the file was staged: 'skipped', 'reflinked', 'linked' or 'copied'.
+    """
+    src_stat = os.stat(src)
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        dst_stat = None
+
+    if dst_stat is not None:
+        if path.samestat(src_stat, dst_stat):
+            return 'skipped'
+        # Some file systems keep only whole seconds.
+        if dst_stat.st_size == src_stat.st_size and int(dst_stat.st_mtime) == int(src_stat.st_mtime):
+            return 'skipped'
+
+    # Stage to a temporary name of this process's own (another layout of
+    # the same session may be staging the same file), then rename over
+    # whatever is at dst.
+    tmp_dst = path.join(path.dirname(dst), '.%s.%s.staging' % (path.basename(dst), os.getpid()))
+    if path.lexists(tmp_dst):
+        os.remove(tmp_dst)
+
+    try:
+        how = None
+        if mode == 'link' and os.stat(path.dirname(path.abspath(dst))).st_dev == src_stat.st_dev:
+            if reflink(src, tmp_dst):
+                shutil.copystat(src, tmp_dst)
+                how = 'reflinked'
+            else:
+                try:
+                    os.link(src, tmp_dst)
+                    how = 'linked'
+                except OSError:
+                    # E.g., the file system does not do hardlinks.
+                    pass
+
+        if how is None:
+            shutil.copy2(src, tmp_dst)
+            how = 'copied'
+
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if path.lexists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+    return how
+
+
+def reflink(src, dst):
+    # Makes dst share src's data (copy-on-write) where the file system can
+    # (e.g., btrfs, XFS). Returns False, leaving no dst, where it cannot.
+    if fcntl is None:
+        return False
+
+    with open(src, 'rb') as src_fd:
+        with open(dst, 'wb') as dst_fd:
+            try:
+                fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+
+    if not cloned:
+        os.remove(dst)
+    return cloned
+
+
 def find_and_copy_file(seek_dir, pattern, output_dir):
     """
     Finds a single file within seek_dir, using the pattern.
@@ -72,15 +163,20 @@ def find_and_copy_file(seek_dir, pattern, output_dir):
 
 def find_one_file(seek_dir, pattern):
 
-    one_file = None
-
     # Try to find a file with the pattern given in the directory given.
     glob_pattern = path.join(seek_dir, pattern)
     filelist = glob.glob(glob_pattern)
 
+    return only_file(filelist, glob_pattern)
+
+
+def only_file(filelist, glob_pattern):
+
+    one_file = None
+
     # Make sure we got exactly one file.
     numfiles=len(filelist)
-    if numfiles is 1:
+    if numfiles == 1:
         one_file = filelist[0]
     else:
         # TODO: Log info in errorfile.
@@ -89,3 +185,52 @@ def find_one_file(seek_dir, pattern):
     return one_file
 
 
+class DirectoryIndex(object):
+    """
+    Lists a directory once, with a single os.scandir, and answers the same
+    glob-style lookups as find_files and find_one_file from that listing.
+    Use it when many patterns are looked up in a directory that does not
+    change in the meantime (e.g., img while the layout is written).
+    """
+
+    def __init__ (self, seek_dir):
+        self.seek_dir = seek_dir
+        self.matches = {}
+
+        # Keep the order of the directory, as glob does.
+        try:
+            with os.scandir(seek_dir) as entries:
+                self.names = [ entry.name for entry in entries ]
+        except OSError:
+            # Same as glob: a missing directory has no matches.
+            self.names = []
+
+
+    def find_files(self, pattern):
+        """
+        Same as find_files(seek_dir, pattern), without listing the directory.
+
+        :parameter: pattern: Unix shell pattern for finding files.
+        :return: list of paths (may be empty).
+        """
+        if pattern not in self.matches:
+            names = self.names
+            if not pattern.startswith('.'):
+                # glob does not match hidden files unless asked to.
+                names = [ name for name in names if not name.startswith('.') ]
+            self.matches[pattern] = [ os.path.join(self.seek_dir, name)
+                    for name in fnmatch.filter(names, pattern) ]
+
+        return list(self.matches[pattern])
+
+
+    def find_one_file(self, pattern):
+        """
+        Same as find_one_file(seek_dir, pattern), without listing the directory.
+
+        :parameter: pattern: Unix shell pattern for finding files.
+        :return: path of the file, or None unless exactly one file matched.
+        """
+        return only_file(self.find_files(pattern), path.join(self.seek_dir, pattern))
+
+
@@ -13,7 +13,8 @@ import stat
 import re
 import glob
 from constants import *
-from helpers import (find_one_file, find_files, find_and_copy_files)
+from helpers import (DirectoryIndex, find_and_copy_files)
+from thumbnails import ThumbnailCache
 
 
 class ModalContainer(object):
@@ -37,7 +38,9 @@ class ModalContainer(object):
     def __init__ (self, modal_id, image_class):
 
         self.modal_id = modal_id
-        self.modal_container = MODAL_START.format(modal_id=self.modal_id)
+        # The HTML is kept as a list of fragments and joined once, when the
+        # container is closed.
+        self.modal_container = [ MODAL_START.format(modal_id=self.modal_id) ]
         self.button = ''
 
         self.image_class = image_class
@@ -68,10 +71,10 @@ class ModalContainer(object):
         self.state = 'closed'
 
         # Close up the elements.
-        self.modal_container += MODAL_END.format(modal_id=self.modal_id)
+        self.modal_container.append(MODAL_END.format(modal_id=self.modal_id))
 
         # Return the HTML.
-        return self.modal_container
+        return ''.join(self.modal_container)
 
 
     def get_scripts(self):
@@ -104,11 +107,11 @@ class ModalContainer(object):
         display_name = os.path.basename(image_file)
 
         # Add the image to container, and assign the class.
-        self.modal_container += IMAGE_WITH_CLASS.format(
+        self.modal_container.append(IMAGE_WITH_CLASS.format(
                 modal_id      = self.modal_id,
                 image_class   = self.image_class,
                 image_file    = image_file,
-                display_name  = display_name)
+                display_name  = display_name))
 
         self.image_class_idx += 1
         return self.image_class_idx
@@ -136,10 +139,10 @@ class ModalSlider(ModalContainer):
         self.state = 'closed'
 
         # Add the buttons and close up the elements.
-        self.modal_container += SLIDER_END.format(image_class=self.image_class)
-        self.modal_container += MODAL_END.format(modal_id=self.modal_id)
+        self.modal_container.append(SLIDER_END.format(image_class=self.image_class))
+        self.modal_container.append(MODAL_END.format(modal_id=self.modal_id))
         # Return the HTML.
-        return self.modal_container
+        return ''.join(self.modal_container)
 
 
     def get_scripts(self):
@@ -153,14 +156,34 @@ class ModalSlider(ModalContainer):
 
 
 class Section(object):
-    def __init__ (self, img_path='./img', regs_slider=None, img_modal=None, **kwargs):
-        self.section = ''
+    def __init__ (self, img_path='./img', regs_slider=None, img_modal=None, img_index=None, thumbnails=None, **kwargs):
+        # The HTML is kept as a list of fragments, so that it can be written
+        # piece by piece rather than built up by concatenation.
+        self.section = []
         self.scripts = ''
         self.img_path = img_path
         self.regs_slider = regs_slider
         self.img_modal = img_modal
 
+        # All of the images are looked up in img_path. List it once (or use
+        # the listing shared by all sections) rather than globbing each time.
+        if img_index is None:
+            img_index = DirectoryIndex(img_path)
+        self.img_index = img_index
+
+        # Rows show thumbnails of their images, when there is a cache to
+        # make them.
+        self.thumbnails = thumbnails
+
+    def thumb(self, img_file, kind):
+        if self.thumbnails is None:
+            return img_file
+        return self.thumbnails.thumbnail(img_file, kind)
+
     def get_section(self):
+        return ''.join(self.section)
+
+    def get_fragments(self):
         return self.section
 
     def get_scripts(self):
@@ -221,7 +244,7 @@ class TxSection(Section):
         # The pngs for the slider are already in the img_path. Get the pngs that start
         # with 'tx' so users can view the higher resolution pngs.
         pngs_glob = '*_' + self.tx + '-*.png'
-        pngs_list = sorted(find_files(self.img_path, pngs_glob))
+        pngs_list = sorted(self.img_index.find_files(pngs_glob))
 
         # Just a sanity check, since we happen to know how many to expect.
         if len(pngs_list) is not 9:
@@ -234,11 +257,11 @@ class TxSection(Section):
         # Add HTML for the bar with the brainsprite label and pngs button,
         # and for the brainsprite viewer.
         btn_label = 'View %s pngs' % self.tx
-        self.section += TX_SECTION.format(tx=self.tx, brainsprite_label=brainsprite_label,
-                pngs_button=pngs_slider.get_button(btn_label), brainsprite_viewer=brainsprite_viewer)
+        self.section.append(TX_SECTION.format(tx=self.tx, brainsprite_label=brainsprite_label,
+                pngs_button=pngs_slider.get_button(btn_label), brainsprite_viewer=brainsprite_viewer))
 
         # HTML for the modal container should be tacked on the end.
-        self.section += pngs_slider.get_container()
+        self.section.append(pngs_slider.get_container())
 
         self.scripts = brainsprite_loader + pngs_slider.get_scripts()
 
@@ -246,9 +269,7 @@ class TxSection(Section):
 class AnatSection(Section):
 
     def __init__ (self, img_path='./img', **kwargs):
-        Section.__init__(self, **kwargs)
-
-        self.img_path = img_path
+        Section.__init__(self, img_path=img_path, **kwargs)
 
         self.run()
 
@@ -261,19 +282,19 @@ class AnatSection(Section):
         for key in [ 'atlas_in_t1', 't1_in_atlas', 'atlas_in_subcort', 'subcort_in_atlas' ]:
             values = IMAGE_INFO[key]
             pattern = values['pattern']
-            img_file = find_one_file(self.img_path, pattern)
+            img_file = self.img_index.find_one_file(pattern)
             if img_file is not None:
                 # Add image to data and to slider.
                 row_data['row_label'] = values['title']
-                row_data['row_img'] = img_file
+                row_data['row_thumb'] = self.thumb(img_file, 'row')
                 row_data['row_idx'] = self.regs_slider.add_image(img_file)
-                self.section += LAYOUT_ROW.format(**row_data)
+                self.section.append(LAYOUT_ROW.format(**row_data))
             else:
-                self.section += PLACEHOLDER_ROW.format( row_label = values['title'] )
+                self.section.append(PLACEHOLDER_ROW.format( row_label = values['title'] ))
 
 
     def write_gray_row(self):
-        self.section += GRAY_ROW_START
+        self.section.append(GRAY_ROW_START)
 
         # Get gray-ordinates plots.
         gray_data = {}
@@ -281,39 +302,37 @@ class AnatSection(Section):
 
         for key in [ 'concat_pre_reg_gray', 'concat_post_reg_gray' ]:
             values = IMAGE_INFO[key]
-            img_file = find_one_file(self.img_path, values['pattern'])
+            img_file = self.img_index.find_one_file(values['pattern'])
             if img_file is not None:
                 # Add image to data, and to the 'generic' images container.
                 gray_data['row_label'] = values['title']
-                gray_data['row_img'] = img_file
+                gray_data['row_thumb'] = self.thumb(img_file, 'quarter')
                 gray_data['row_idx'] = self.img_modal.add_image(img_file)
-                self.section += LAYOUT_QUARTER_ROW.format(**gray_data)
+                self.section.append(LAYOUT_QUARTER_ROW.format(**gray_data))
             else:
-                self.section += PLACEHOLDER_QUARTER_ROW.format( row_label = values['title'] )
+                self.section.append(PLACEHOLDER_QUARTER_ROW.format( row_label = values['title'] ))
 
-        self.section += GRAY_ROW_END
+        self.section.append(GRAY_ROW_END)
 
     def run(self):
         # Write the HTML for the section.
-        self.section += ANAT_SECTION_START
+        self.section.append(ANAT_SECTION_START)
         self.write_atlas_rows()
         self.write_gray_row()
-        self.section += ANAT_SECTION_END
+        self.section.append(ANAT_SECTION_END)
 
 
 class TasksSection(Section):
 
     def __init__ (self, tasks=[], img_path='./img', **kwargs):
-        Section.__init__(self, **kwargs)
-
-        self.img_path = img_path
+        Section.__init__(self, img_path=img_path, **kwargs)
 
         self.run(tasks)
 
     def write_T1_reg_rows(self, task_name, task_num):
 
         # Write the header for the next few rows.
-        self.section += TASK_LABEL_ROW.format( task_name = task_name, task_num = task_num )
+        self.section.append(TASK_LABEL_ROW.format( task_name = task_name, task_num = task_num ))
 
         row_data = {}
         row_data['row_modal'] = self.regs_slider.get_modal_id()
@@ -328,15 +347,15 @@ class TasksSection(Section):
         for key in [ 'task_in_t1', 't1_in_task' ]:
             values = IMAGE_INFO[key]
             pattern = values['pattern'] % task_pattern
-            task_file = find_one_file(self.img_path, pattern)
+            task_file = self.img_index.find_one_file(pattern)
             if task_file:
                 # Add image to data and to slider.
                 row_data['row_label'] = values['title']
-                row_data['row_img'] = task_file
+                row_data['row_thumb'] = self.thumb(task_file, 'row')
                 row_data['row_idx'] = self.regs_slider.add_image(task_file)
-                self.section += LAYOUT_ROW.format(**row_data)
+                self.section.append(LAYOUT_ROW.format(**row_data))
             else:
-                self.section += PLACEHOLDER_ROW.format( row_label=values['title'] )
+                self.section.append(PLACEHOLDER_ROW.format( row_label=values['title'] ))
 
 
     def write_bold_gray_row(self, task_name, task_num):
@@ -348,50 +367,84 @@ class TasksSection(Section):
         task_pattern = task_name + '*' + task_num
 
         # Make the first half of the row - bold and ref data.
-        self.section += BOLD_GRAY_START
+        self.section.append(BOLD_GRAY_START)
 
         # For bold and ref files, may include run number or not.
         for key in [ 'bold', 'ref' ]:
             values = IMAGE_INFO[key]
             pattern = values['pattern'] % task_pattern
-            task_file = find_one_file(self.img_path, pattern)
+            task_file = self.img_index.find_one_file(pattern)
             if task_file:
                 # Add image to data, and to the 'generic' images container.
                 bold_data['row_label'] = values['title']
-                bold_data['row_img'] = task_file
+                bold_data['row_thumb'] = self.thumb(task_file, 'half')
                 bold_data['row_idx'] = self.img_modal.add_image(task_file)
-                self.section += LAYOUT_HALF_ROW.format(**bold_data)
+                self.section.append(LAYOUT_HALF_ROW.format(**bold_data))
             else:
                 # File was not found with both task name and run number.
                 # Try again with task name only (no run number).
                 pattern = values['pattern'] % task_name
-                task_file = find_one_file(self.img_path, pattern)
+                task_file = self.img_index.find_one_file(pattern)
                 if task_file:
                     # Add image to data, and to the 'generic' images container.
                     bold_data['row_label'] = values['title']
-                    bold_data['row_img'] = task_file
+                    bold_data['row_thumb'] = self.thumb(task_file, 'half')
                     bold_data['row_idx'] = self.img_modal.add_image(task_file)
-                    self.section += LAYOUT_HALF_ROW.format(**bold_data)
+                    self.section.append(LAYOUT_HALF_ROW.format(**bold_data))
                 else:
-                    self.section += PLACEHOLDER_HALF_ROW.format( row_label = values['title'] )
+                    self.section.append(PLACEHOLDER_HALF_ROW.format( row_label = values['title'] ))
 
-        self.section += BOLD_GRAY_SPLIT
+        self.section.append(BOLD_GRAY_SPLIT)
 
         # For each gray-plot, there is only one name to look for.
         for key in [ 'task_pre_reg_gray', 'task_post_reg_gray' ]:
             values = IMAGE_INFO[key]
             pattern = values['pattern'] % task_pattern
-            task_file = find_one_file(self.img_path, pattern)
+            task_file = self.img_index.find_one_file(pattern)
             if task_file:
                 # Add image to data, and to the 'generic' images container.
                 bold_data['row_label'] = values['title']
-                bold_data['row_img'] = task_file
+                bold_data['row_thumb'] = self.thumb(task_file, 'quarter')
                 bold_data['row_idx'] = self.img_modal.add_image(task_file)
-                self.section += LAYOUT_QUARTER_ROW.format(**bold_data)
+                self.section.append(LAYOUT_QUARTER_ROW.format(**bold_data))
             else:
-                self.section += PLACEHOLDER_QUARTER_ROW.format( row_label = values['title'] )
+                self.section.append(PLACEHOLDER_QUARTER_ROW.format( row_label = values['title'] ))
+
+        self.section.append(BOLD_GRAY_END)
+
+
+    def write_temporal_row(self, task_name, task_num):
+        # The temporal statistics are only made when asked for, so there is
+        # no row (not even placeholders) for a task without any of them.
+        keys = [ 'temporal_mean', 'temporal_std', 'tsnr' ]
+        if not any(self.img_index.find_files(IMAGE_INFO[key]['pattern'] % task_name) for key in keys):
+            return
+
+        task_pattern = task_name + '*' + task_num
+
+        # Like bold files, may include run number or not.
+        task_files = []
+        for key in keys:
+            values = IMAGE_INFO[key]
+            task_file = self.img_index.find_one_file(values['pattern'] % task_pattern)
+            if task_file is None:
+                task_file = self.img_index.find_one_file(values['pattern'] % task_name)
+            task_files.append((values['title'], task_file))
+
+        temporal_data = {}
+        temporal_data['row_modal'] = self.img_modal.get_modal_id()
 
-        self.section += BOLD_GRAY_END
+        self.section.append(TEMPORAL_ROW_START)
+        for title, task_file in task_files:
+            if task_file:
+                # Add image to data, and to the 'generic' images container.
+                temporal_data['row_label'] = title
+                temporal_data['row_thumb'] = self.thumb(task_file, 'quarter')
+                temporal_data['row_idx'] = self.img_modal.add_image(task_file)
+                self.section.append(LAYOUT_QUARTER_ROW.format(**temporal_data))
+            else:
+                self.section.append(PLACEHOLDER_QUARTER_ROW.format( row_label = title ))
+        self.section.append(TEMPORAL_ROW_END)
 
 
     def run(self, tasks):
@@ -400,21 +453,22 @@ class TasksSection(Section):
             return
 
         # Write the column headings.
-        self.section += TASKS_SECTION_START
+        self.section.append(TASKS_SECTION_START)
 
         # Each entry in task_entries is a tuple of the task-name (without
         # task-) and run number (without run-).
         for task_name, task_num in tasks:
             self.write_T1_reg_rows(task_name, task_num)
             self.write_bold_gray_row(task_name, task_num)
+            self.write_temporal_row(task_name, task_num)
 
         # Add the end of the tasks section.
-        self.section += TASKS_SECTION_END
+        self.section.append(TASKS_SECTION_END)
 
 
 class layout_builder(object):
 
-    def __init__ (self, files_path, summary_path, html_path, images_path, subject_id, session_id=None):
+    def __init__ (self, files_path, summary_path, html_path, images_path, subject_id, session_id=None, stage_mode='copy', jobs=None):
 
         self.working_dir = os.getcwd()
 
@@ -426,6 +480,8 @@ class layout_builder(object):
             self.session_id = 'ses-' + session_id
         else:
             self.session_id = None
+        self.stage_mode = stage_mode
+        self.jobs = jobs
 
         # For the directory where the images used by the HTML are stored,  use
         # the relative path only, as the HTML will need to access it's images
@@ -489,41 +545,47 @@ class layout_builder(object):
         return sorted(taskset)
 
 
-    def write_html(self, document, filename):
+    def write_html(self, fragments, filename):
         """
-        Writes an html document to a filename.
+        Writes an html document to a filename, one fragment at a time. The
+        document is written to a temporary file that is renamed when it is
+        complete, so readers never see a partial page.
 
-        :parameter: document: html document.
+        :parameter: fragments: iterable of the pieces of the html document.
         :parameter: filename: name of html file.
         :return: None
         """
         filepath = os.path.join(os.getcwd(), filename)
+        tmp_path = os.path.join(os.getcwd(), '.%s.%s.tmp' % (filename, os.getpid()))
         try:
-            fd = open(filepath, 'w')
+            with open(tmp_path, 'w') as fd:
+                for fragment in fragments:
+                    fd.write(fragment)
+            os.replace(tmp_path, filepath)
         except OSError as err:
-            print('Unable to open %s for write.\n' % filepath)
+            print('Unable to write %s.\n' % filepath)
             print('Error: {0}'.format(err))
+            return
+        finally:
+            # Only left behind if something went wrong.
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-        fd.writelines(document)
         print('\nExecutive summary can be found in path:\n\t%s/%s' % (os.getcwd(), filename))
-        fd.close()
-
 
 
-    def run(self):
-
-        # Copy gray plot pngs, generated by DCAN-BOLD processing, to the
-        # directory of images used by the HTML.
-        find_and_copy_files(self.summary_path, '*DVARS_and_FD*.png', self.images_path)
+    def html_fragments(self):
+        # Yields the pieces of the HTML document in order. Each section is
+        # built only when the writer gets to it, and is done with once it has
+        # been written.
 
         # Start building the HTML document, and put the subject and session
         # into the title and page header.
-        head = HTML_START
+        yield HTML_START
         if self.session_id is None:
-            head += TITLE.format(subject=self.subject_id, sep='' , session='')
+            yield TITLE.format(subject=self.subject_id, sep='' , session='')
         else:
-            head += TITLE.format(subject=self.subject_id, sep=': ', session=self.session_id)
-        body = ''
+            yield TITLE.format(subject=self.subject_id, sep=': ', session=self.session_id)
 
         # Images included in the Registrations slider and the Images container
         # are found in multiple sections. Create the objects now and add the files
@@ -534,42 +596,65 @@ class layout_builder(object):
         # container when clicked. Create that container now.
         img_modal = ModalContainer('img_modal', 'Images')
 
-        # Some sections require more args, but most will need these:
+        # Some sections require more args, but most will need these. All of
+        # the images are in place now, so list the directory once for all of
+        # the sections to use.
         kwargs = { 'img_path'     : self.images_path,
+                   'img_index'    : DirectoryIndex(self.images_path),
+                   'thumbnails'   : self.thumbnails,
                    'regs_slider'  : regs_slider,
                    'img_modal'    : img_modal }
 
         # Make sections for 'T1' and 'T2' images. Include pngs slider and
-        # BrainSprite for each.
-        t1_section = TxSection(tx='T1', **kwargs)
-        t2_section = TxSection(tx='T2', **kwargs)
-        body += t1_section.get_section() + t2_section.get_section()
+        # BrainSprite for each. Keep the scripts for the end.
+        scripts = [ BRAINSPRITE_SCRIPTS, LAZY_LOAD_SCRIPT ]
+        for tx in [ 'T1', 'T2' ]:
+            tx_section = TxSection(tx=tx, **kwargs)
+            yield from tx_section.get_fragments()
+            scripts.append(tx_section.get_scripts())
 
         # Data for this subject/session: i.e., concatenated gray plots and atlas
         # images. (The atlas images will be added to the Registrations slider.)
-        anat_section = AnatSection(**kwargs)
-        body += anat_section.get_section()
+        yield from AnatSection(**kwargs).get_fragments()
 
         # Tasks section: data specific to each task/run. Get a list of tasks processed
         # for this subject. (The <task>-in-T1 and T1-in-<task> images will be added to
         # the Registrations slider.)
         tasks_list = self.get_list_of_tasks()
-        tasks_section = TasksSection(tasks=tasks_list, **kwargs)
-        body += tasks_section.get_section()
+        yield from TasksSection(tasks=tasks_list, **kwargs).get_fragments()
 
         # Close up the Registrations elements and get the HTML.
-        body += img_modal.get_container() + regs_slider.get_container()
+        yield img_modal.get_container()
+        yield regs_slider.get_container()
 
         # There are a bunch of scripts used in this page. Keep their HTML together.
-        scripts = BRAINSPRITE_SCRIPTS + t1_section.get_scripts() + t2_section.get_scripts()
-        scripts += img_modal.get_scripts() + regs_slider.get_scripts()
+        scripts.append(img_modal.get_scripts())
+        scripts.append(regs_slider.get_scripts())
+        yield from scripts
+
+        # The page is put in place when the last fragment is written, so its
+        # thumbnails must all be there by then.
+        self.thumbnails.wait()
+
+        yield HTML_END
 
-        # Assemble and write the document.
-        html_doc = head + body + scripts + HTML_END
-        if self.session_id is None:
-            self.write_html(html_doc, 'executive_summary_%s.html' % (self.subject_id))
-        else:
-            self.write_html(html_doc, 'executive_summary_%s_%s.html' % (self.subject_id, self.session_id))
 
+    def run(self):
+
+        # Copy (or link) gray plot pngs, generated by DCAN-BOLD processing, to
+        # the directory of images used by the HTML. Those already there from
+        # a prior layout are left alone.
+        find_and_copy_files(self.summary_path, '*DVARS_and_FD*.png', self.images_path, self.stage_mode)
 
+        # Thumbnails of the row images are made while the document is built.
+        self.thumbnails = ThumbnailCache(self.jobs)
 
+        # Write the document as it is built. If that fails, stop making
+        # thumbnails for a page that will not be put in place.
+        try:
+            if self.session_id is None:
+                self.write_html(self.html_fragments(), 'executive_summary_%s.html' % (self.subject_id))
+            else:
+                self.write_html(self.html_fragments(), 'executive_summary_%s_%s.html' % (self.subject_id, self.session_id))
+        finally:
+            self.thumbnails.pool.shutdown(cancel_futures=True)
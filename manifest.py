@@ -0,0 +1,139 @@
+__doc__ = """
+Keeps a manifest of the inputs used to make each output of the Executive
+Summary preprocessor, so that an incremental run only remakes the outputs
+whose inputs have changed.
+
+The Preprocessor asks whether an output is stale with is_current. A stale
+output's new input signature is held as pending until the output has been
+made and commit is called, so an output whose build fails is remade on
+the next run. At the end of the run, end_run forgets the outputs that were
+never made and removes the outputs whose input files no longer exist.
+"""
+
+import os
+import json
+import shutil
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def input_signature(value):
+    # Files (and directories) are identified by size and modification time.
+    # Anything else (e.g., 'wb_command=1.3.2' or a frame size) is a literal
+    # value that becomes stale when it changes.
+    if os.path.exists(value):
+        stat = os.stat(value)
+        return [ stat.st_size, stat.st_mtime_ns ]
+    else:
+        return value
+
+
+class Manifest(object):
+
+    def __init__ (self, html_path):
+        self.path = os.path.join(html_path, MANIFEST_NAME)
+
+        self.data = { 'outputs': {}, 'pending': {}, 'last_run': { 'skipped': [], 'rebuilt': [] } }
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as fd:
+                    self.data.update(json.load(fd))
+            except ValueError as err:
+                # Start over; every output will be remade.
+                print('Unable to read %s; ignoring it.\nError: %s' % (self.path, err))
+
+
+    def save(self):
+        # Write to a temp file and rename, so a crash never leaves half a
+        # manifest behind.
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(self.data, fd, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+    def begin_run(self):
+        # Forget what was skipped and rebuilt by the last run. Saved with
+        # the first commit, or at the end of the run.
+        self.data['last_run'] = { 'skipped': [], 'rebuilt': [] }
+
+
+    def end_run(self):
+        # Pending signatures are outputs whose builds failed (or were never
+        # tried); they stay out of the manifest, so they are remade.
+        self.data['pending'] = {}
+        self.prune()
+        self.save()
+
+
+    def prune(self):
+        """
+        Drops the entries of outputs that are gone, and removes the outputs
+        (and their entries) made from input files that no longer exist.
+        Only outputs under the manifest's directory are ever removed.
+        """
+        top = os.path.dirname(os.path.abspath(self.path)) + os.sep
+        for key, signature in list(self.data['outputs'].items()):
+            if not os.path.exists(key):
+                del self.data['outputs'][key]
+                continue
+            # Files were recorded with their [ size, mtime ]; literals as is.
+            orphaned = any(isinstance(recorded, list) and not os.path.exists(value)
+                    for value, recorded in signature.items())
+            if orphaned and key.startswith(top):
+                print('Removing %s; its inputs no longer exist.' % key)
+                if os.path.isdir(key):
+                    shutil.rmtree(key, ignore_errors=True)
+                else:
+                    os.remove(key)
+                del self.data['outputs'][key]
+
+
+    def is_current(self, output, inputs):
+        """
+        Checks whether output exists and was made from the same inputs.
+        If not, the new signature is held as pending until commit(output).
+
+        :parameter: output: path of the output file or directory.
+        :parameter: inputs: list of input paths and/or literal values.
+        :return: True if the output can be skipped.
+        """
+        key = os.path.abspath(output)
+        signature = { value: input_signature(value) for value in inputs }
+
+        if os.path.exists(key) and self.data['outputs'].get(key) == signature:
+            self.data['last_run']['skipped'].append(key)
+            current = True
+        else:
+            # Drop the old entry, so a failed build is not mistaken for a
+            # current one on the next run.
+            self.data['outputs'].pop(key, None)
+            self.data['pending'][key] = signature
+            current = False
+
+        # Nothing is written here: commit (or end_run) saves the manifest.
+        return current
+
+
+    def commit(self, output):
+        # The output was made; its pending signature is now its signature.
+        key = os.path.abspath(output)
+        signature = self.data['pending'].pop(key, None)
+        if signature is None:
+            # Remade along with a stale output, but was already current.
+            if key not in self.data['outputs']:
+                print('info: No pending inputs for %s' % key)
+            return
+
+        self.data['outputs'][key] = signature
+        self.data['last_run']['rebuilt'].append(key)
+        # Saved as each output is made, so the work survives a crash.
+        self.save()
+
+
+    def report(self):
+        skipped = self.data['last_run']['skipped']
+        rebuilt = self.data['last_run']['rebuilt']
+        print('\nIncremental run: %s outputs skipped (unchanged), %s outputs rebuilt.' % (len(skipped), len(rebuilt)))
+        for output in skipped:
+            print('\tskipped: %s' % output)
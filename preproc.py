@@ -0,0 +1,927 @@
+__doc__ = """
+Makes the images for the Executive Summary, as a graph of stages: each
+stage runs once the stages it requires are done, on a bounded pool of
+threads, so that independent stages (the brainsprites, the named pngs, the
+atlas and subcortical rows, and each task's registrations and BOLD slices)
+run at the same time.
+
+External tools are called with argument lists (not shell strings). No more
+than 'jobs' of them run at once, whichever stages they belong to.
+
+The site settings in setup_env.sh (where workbench and FSL are, and the
+lab's group) are loaded into the environment once, before any tool is run.
+"""
+
+import os
+import grp
+import glob
+import stat
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from resample import grid_signature, resample_to_grid, compare, Volume, nibabel
+from frames import read_frame
+from temporal import temporal_mosaics, TEMPORAL_STATS
+from grayplot import grayplot
+from surfaces import read_surface
+from views import render_view, load_volume as load_view_volume
+from scene_template import load_template
+from slices import load_data, overlay_montage, registration_row, mid_slices, parse_slices
+from brainsprite import (make_mosaic, stream_mosaic, volume_mosaic, frame_size, find_wb_command,
+        NATIVE_FRAMES)
+
+# The named pngs made from the pngs scene template, in scene order. Even
+# numbered scenes (T2) are skipped when there is no T2.
+IMAGE_NAMES = [ 'T1-Axial-InferiorTemporal-Cerebellum', 'T2-Axial-InferiorTemporal-Cerebellum',
+                'T1-Axial-BasalGangila-Putamen', 'T2-Axial-BasalGangila-Putamen',
+                'T1-Axial-SuperiorFrontal', 'T2-Axial-SuperiorFrontal',
+                'T1-Coronal-PosteriorParietal-Lingual', 'T2-Coronal-PosteriorParietal-Lingual',
+                'T1-Coronal-Caudate-Amygdala', 'T2-Coronal-Caudate-Amygdala',
+                'T1-Coronal-OrbitoFrontal', 'T2-Coronal-OrbitoFrontal',
+                'T1-Sagittal-Insula-FrontoTemporal', 'T2-Sagittal-Insula-FrontoTemporal',
+                'T1-Sagittal-CorpusCallosum', 'T2-Sagittal-CorpusCallosum',
+                'T1-Sagittal-Insula-Temporal-HippocampalSulcus', 'T2-Sagittal-Insula-Temporal-HippocampalSulcus' ]
+
+# Slices (axis, slice number) used for the subcorticals: the default slices
+# are not as nice for subcorticals as they are for a whole brain.
+SUBCORT_SLICES = [ ('x', 36), ('x', 45), ('x', 52),
+                   ('y', 43), ('y', 54), ('y', 65),
+                   ('z', 23), ('z', 33), ('z', 39) ]
+
+# FSL tools called to make the slice images, and to resample the brains to
+# the task grids.
+FSL_SLICE_TOOLS = [ 'imcp', 'slicesdir', 'slicer', 'pngappend', 'fslmaths' ]
+FSL_RESAMPLE_TOOLS = [ 'flirt' ]
+
+# Site settings: where workbench and FSL are, and the lab's group.
+SETUP_ENV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'setup_env.sh')
+
+# Name of the stage run by the current thread, for the records of its tools.
+_current = threading.local()
+
+# Whether setup_env.sh has been loaded into the environment of this process.
+_site_env = { 'loaded': False, 'lock': threading.Lock() }
+
+# Slots for tools shared by every session of a batch, across processes (see
+# share_tools), or None: each Preprocessor then has 'jobs' slots of its own.
+_shared = { 'tools': None }
+
+
+def share_tools(tools):
+    """
+    Has every Preprocessor made in this process take its tool slots from
+    tools, e.g., a multiprocessing.BoundedSemaphore made by the batch
+    runner, so that no more than its count of tools run at once across all
+    of the sessions.
+    """
+    _shared['tools'] = tools
+
+
+def load_site_env(path=SETUP_ENV):
+    """
+    Sources setup_env.sh with bash and puts what it sets (CARET7DIR,
+    wb_command, FSLDIR and what fsl.sh sets, and GROUP, which it does not
+    export) in the environment of this process, for the tools to come.
+    Done once per process.
+    """
+    with _site_env['lock']:
+        if _site_env['loaded']:
+            return
+        _site_env['loaded'] = True
+        if not os.path.exists(path):
+            print('Missing %s; using the environment as it is.' % path)
+            return
+        try:
+            output = subprocess.run([ 'bash', '-c', 'source "$0" > /dev/null 2>&1 ; export GROUP ; env -0', path ],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        except (OSError, subprocess.CalledProcessError) as e:
+            print('Cannot load %s (%s); using the environment as it is.' % (path, e))
+            return
+        for entry in output.decode(errors='replace').split('\0'):
+            name, _, value = entry.partition('=')
+            # Leave alone what bash sets for itself.
+            if name and name not in ('_', 'SHLVL', 'PWD', 'OLDPWD') and os.environ.get(name) != value:
+                os.environ[name] = value
+
+
+class Stage(object):
+
+    def __init__ (self, name, func, requires=None):
+        self.name = name
+        self.func = func
+        self.requires = list(requires or [])
+        self.status = 'waiting'
+        self.message = ''
+        self.wall = 0.0
+
+
+class StageGraph(object):
+
+    # A graph of stages. A stage is added with the names of the stages it
+    # requires, which must already have been added, so there are no cycles.
+    # run() starts each stage when all that it requires have succeeded;
+    # the stages that require a failed stage are skipped. Others go on.
+
+    def __init__ (self, profile=None):
+        self.stages = OrderedDict()
+        self.profile = profile
+
+
+    def add(self, name, func, requires=None):
+        """
+        Adds a stage.
+
+        :parameter: name: unique name of the stage.
+        :parameter: func: called with no args. May return a message to log.
+        :parameter: requires: names of the stages that must be done first.
+        :return: name
+        """
+        assert name not in self.stages, 'Duplicate stage: %s' % name
+        for required in requires or []:
+            assert required in self.stages, 'Stage %s requires unknown stage %s' % (name, required)
+        self.stages[name] = Stage(name, func, requires)
+        return name
+
+
+    def run_stage(self, stage):
+        print('Stage %s: started.' % stage.name)
+        _current.stage = stage.name
+        start = time.time()
+        try:
+            if self.profile is not None:
+                with self.profile.stage(stage.name):
+                    message = stage.func()
+            else:
+                message = stage.func()
+            stage.status = 'ok'
+            stage.message = message or ''
+        except Exception as err:
+            stage.status = 'failed'
+            stage.message = '%s: %s' % (type(err).__name__, err)
+        finally:
+            _current.stage = None
+            stage.wall = time.time() - start
+
+        if stage.status == 'ok':
+            print('Stage %s: ok (%.1fs). %s' % (stage.name, stage.wall, stage.message))
+        else:
+            print('ERROR: Stage %s failed (%.1fs). %s' % (stage.name, stage.wall, stage.message))
+
+
+    def run(self, jobs=1):
+        """
+        Runs the stages, at most 'jobs' at a time, in the order they were
+        added as far as their requirements allow.
+
+        :return: True if every stage succeeded.
+        """
+        pending = OrderedDict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                # Skip the stages that can never run, then start the ones
+                # that are ready. (The pool holds them until it has a thread.)
+                for stage in list(pending.values()):
+                    states = [ self.stages[required].status for required in stage.requires ]
+                    if any(state in ('failed', 'skipped') for state in states):
+                        stage.status = 'skipped'
+                        stage.message = 'a required stage did not succeed'
+                        print('Stage %s: skipped; %s.' % (stage.name, stage.message))
+                        del pending[stage.name]
+                    elif all(state == 'ok' for state in states):
+                        stage.status = 'running'
+                        running[pool.submit(self.run_stage, stage)] = stage
+                        del pending[stage.name]
+
+                if not running:
+                    # Whatever is pending is waiting on a skipped stage; the
+                    # next pass skips it.
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+
+        return all(stage.status == 'ok' for stage in self.stages.values())
+
+
+    def summary(self):
+        print('\nPreprocessing stages:')
+        for stage in self.stages.values():
+            print('\t%-50s %-8s %6.1fs' % (stage.name, stage.status, stage.wall))
+
+
+class Preprocessor(object):
+
+    # Makes the images used by the layout, in images_path. Paths, names and
+    # outputs are those the layout looks for (see constants.py).
+
+    def __init__ (self, files_path, html_path, images_path, subject_id, session_id=None,
+            func_path=None, atlas=None, jobs=1, quality='full', stream=False,
+            manifest=None, profile=None, brainsprite_template=None, pngs_template=None,
+            resampler='flirt', sprite_renderer='workbench', slice_renderer='fsl',
+            subcort_slices=None, temporal_stats=False, grayplots=False, view_renderer='workbench'):
+
+        self.files_path = files_path
+        self.html_path = html_path
+        self.summary_path = os.path.dirname(html_path)
+        self.images_path = images_path
+        self.subject_id = subject_id
+        self.session_id = session_id
+        self.func_path = func_path
+        self.jobs = jobs
+        self.quality = quality
+        self.stream = stream
+        self.resampler = resampler
+        self.sprite_renderer = sprite_renderer
+        self.slice_renderer = slice_renderer
+        self.subcort_slices = parse_slices(subcort_slices or SUBCORT_SLICES)
+        self.temporal_stats = temporal_stats
+        self.grayplots = grayplots
+        self.view_renderer = view_renderer
+        self.manifest = manifest
+        self.profile = profile
+
+        templates_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+        self.atlas = atlas or os.path.join(templates_path, 'MNI152_T1_1mm_brain.nii.gz')
+        self.brainsprite_template = brainsprite_template or os.path.join(templates_path, 'parasagittal_Tx_169_template.scene')
+        self.pngs_template = pngs_template or os.path.join(templates_path, 'image_template_temp.scene')
+        self.pngs_scene = os.path.join(files_path, 'pngs_scene.scene')
+
+        load_site_env()
+        self.wb_command = find_wb_command()
+
+        atlas_space = os.path.join(files_path, 'MNINonLinear')
+        self.results_path = os.path.join(atlas_space, 'Results')
+        self.rois_path = os.path.join(atlas_space, 'ROIs')
+        self.t1_mask = os.path.join(atlas_space, 'T1w_restore_brain.nii.gz')
+        self.t1 = os.path.join(atlas_space, 'T1w_restore.nii.gz')
+        self.t2 = os.path.join(atlas_space, 'T2w_restore.nii.gz')
+        self.t1_brain = os.path.join(atlas_space, 'T1w_restore_brain.nii.gz')
+        self.t2_brain = os.path.join(atlas_space, 'T2w_restore_brain.nii.gz')
+        self.has_t2 = os.path.exists(self.t2)
+        if not self.has_t2:
+            print('t2 not found; using t1')
+            self.t2 = self.t1
+
+        surf_pattern = os.path.join(atlas_space, 'fsaverage_LR32k', '%s.%%s.32k_fs_LR.surf.gii' % subject_id)
+        self.rw = surf_pattern % 'R.white'
+        self.rp = surf_pattern % 'R.pial'
+        self.lw = surf_pattern % 'L.white'
+        self.lp = surf_pattern % 'L.pial'
+
+        self.images_pre = os.path.join(images_path, 'sub-%s' % subject_id)
+        if session_id:
+            self.images_pre += '_ses-%s' % session_id
+
+        # Each stage works in its own directory under here.
+        self.working = os.path.join(html_path, 'temp_files')
+
+        # At most 'jobs' tools run at once, across all stages (or across
+        # all of the sessions of a batch).
+        self.tools = _shared['tools'] or threading.BoundedSemaphore(jobs)
+        self.lock = threading.Lock()
+        self.versions = None
+
+        # The brains resampled to each task grid, by grid_signature.
+        self.grids = {}
+        # Data of the volumes (and surfaces) used by more than one stage, by
+        # path; see cached.
+        self.volumes = {}
+        # Grids on which the numpy and flirt resamples did not agree.
+        self.mismatches = []
+
+        self.graph = StageGraph(profile)
+
+
+    ############ HELPERS ##############
+
+    def call(self, cmd, stage=None, **kwargs):
+        # Runs a tool when one of the 'jobs' slots is free, recording it
+        # in the profile (if any). Returns its return code.
+        stage = stage or getattr(_current, 'stage', None)
+        with self.tools:
+            if self.profile is not None:
+                return self.profile.call(cmd, stage=stage, **kwargs)
+            return subprocess.call(cmd, **kwargs)
+
+
+    def check_call(self, cmd, cwd=None):
+        print(' '.join(cmd))
+        returncode = self.call(cmd, cwd=cwd)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+
+    def tool_versions(self):
+        # Everything made here also depends on this code and on the versions
+        # of the tools it calls.
+        if self.versions is None:
+            wb_version = ''
+            try:
+                output = subprocess.run([ self.wb_command, '-version' ], stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+                wb_version = next((line for line in output.splitlines() if line.lower().startswith('version')), '')
+            except (OSError, TypeError):
+                pass
+            fsl_version = ''
+            try:
+                with open(os.path.join(os.environ.get('FSLDIR', ''), 'etc', 'fslversion')) as fd:
+                    fsl_version = fd.read().strip()
+            except OSError:
+                pass
+            self.versions = [ os.path.abspath(__file__), 'wb_command=%s' % wb_version, 'fsl=%s' % fsl_version ]
+        return self.versions
+
+
+    def is_stale(self, output, inputs):
+        # The output must be made, unless this is an incremental run and it
+        # was made from the same inputs and tool versions by a prior run.
+        if self.manifest is None:
+            return True
+        versions = self.tool_versions()
+        with self.lock:
+            return not self.manifest.is_current(output, list(inputs) + versions)
+
+
+    def mark_current(self, output):
+        if self.manifest is not None:
+            with self.lock:
+                self.manifest.commit(output)
+
+
+    def work_dir(self):
+        os.makedirs(self.working, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.working)
+
+
+    def stage_volume(self, volume, work):
+        # Puts a copy of the volume (a path or an in-memory Volume) in the
+        # work directory. Returns its file name there.
+        if isinstance(volume, Volume):
+            return os.path.basename(volume.save(work))
+        self.check_call([ 'imcp', volume, os.path.join(work, os.path.basename(volume)) ])
+        return os.path.basename(volume)
+
+
+    def cached(self, key, load, path):
+        # load(path), made once and kept for the other stages of this run.
+        # Each key has its own lock, so different files load at the same
+        # time. Cleared at the end of the run.
+        with self.lock:
+            entry = self.volumes.setdefault(key, { 'lock': threading.Lock(), 'data': None })
+        with entry['lock']:
+            if entry['data'] is None:
+                entry['data'] = load(path)
+        return entry['data']
+
+
+    def volume_data(self, volume):
+        # The data of a volume: a path (loaded once, and kept for the other
+        # stages that slice it), an in-memory Volume, or an array.
+        if isinstance(volume, np.ndarray):
+            return volume
+        if isinstance(volume, Volume):
+            return load_data(volume.image)
+        return self.cached(volume, load_data, volume)
+
+
+    def slices_row(self, base_img, out_png, red_img=None):
+        # Uses the default slices made by slicesdir (.4, .5, and .6), with
+        # the edges of red_img in red.
+        if self.slice_renderer == 'numpy':
+            # Takes a CPU, as a tool would.
+            with self.tools:
+                red = None if red_img is None else self.volume_data(red_img)
+                registration_row(self.volume_data(base_img), red, out_png)
+            return
+
+        # slicesdir makes a mess, so copy the images to a directory of this
+        # call's own and run it there.
+        work = self.work_dir()
+        try:
+            img_file = self.stage_volume(base_img, work)
+            if red_img is not None:
+                red_file = self.stage_volume(red_img, work)
+                self.check_call([ 'slicesdir', '-p', red_file, img_file ], cwd=work)
+            else:
+                self.check_call([ 'slicesdir', img_file ], cwd=work)
+            shutil.move(os.path.join(work, 'slicesdir', self.png_name(img_file)), out_png)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+    ############ STAGES ##############
+
+    def atlas_row(self, base_img, out_png, red_img):
+        if not self.is_stale(out_png, [ base_img, red_img, 'renderer=%s' % self.slice_renderer ]):
+            return 'Up to date.'
+        self.slices_row(base_img, out_png, red_img)
+        self.mark_current(out_png)
+
+
+    def named_pngs(self, scene_num, name):
+        out = '%s_%s.png' % (self.images_pre, name)
+        inputs = [ self.t2, self.t1, self.rp, self.lp, self.rw, self.lw, self.pngs_template ]
+        if not self.is_stale(out, inputs):
+            return 'Up to date.'
+        self.check_call([ self.wb_command, '-show-scene', self.pngs_scene, str(scene_num), out, '900', '800' ])
+        self.mark_current(out)
+
+
+    def native_named_png(self, tx_img, name):
+        # Renders the view of the named png straight from the volume, with
+        # the outlines of whichever surfaces there are.
+        out = '%s_%s.png' % (self.images_pre, name)
+        surfaces = [ surface for surface in [ self.rp, self.lp, self.rw, self.lw ] if os.path.exists(surface) ]
+        if not self.is_stale(out, [ tx_img ] + surfaces + [ 'renderer=native' ]):
+            return 'Up to date.'
+
+        # The volume and surfaces are read by the first view that needs them,
+        # and kept for the others. Takes a CPU, as a tool would.
+        with self.tools:
+            volume = self.cached(('view', tx_img), load_view_volume, tx_img)
+            meshes = [ (surface, ) + self.cached(('surface', surface), read_surface, surface) for surface in surfaces ]
+            render_view(volume, out, name[len('T1-'):], surfaces=meshes)
+        self.mark_current(out)
+
+
+    def build_pngs_scene(self):
+        values = { 'T2_IMG': self.t2, 'T1_IMG': self.t1, 'RPIAL': self.rp,
+                   'LPIAL': self.lp, 'RWHITE': self.rw, 'LWHITE': self.lw }
+        load_template(self.pngs_template).write(self.pngs_scene, values)
+
+
+    def brainsprite(self, tx, tx_img):
+        # Renders the frames of the tx brainsprite and makes the mosaic.
+        mosaic_path = os.path.join(self.images_path, '%s_mosaic.jpg' % tx)
+        inputs = [ tx_img, self.rp, self.lp, self.rw, self.lw, self.brainsprite_template,
+                   'frame-size=%sx%s' % frame_size(self.quality) ]
+        if not self.is_stale(mosaic_path, inputs):
+            return 'Up to date.'
+
+        scene = os.path.join(self.files_path, '%s_bs_scene.scene' % tx.lower())
+        template = load_template(self.brainsprite_template)
+        template.write(scene, { 'TX_IMG': tx_img, 'R_PIAL': self.rp, 'L_PIAL': self.lp,
+                                'R_WHITE': self.rw, 'L_WHITE': self.lw })
+
+        try:
+            if self.stream:
+                # Frames go straight into the mosaic.
+                if not stream_mosaic(scene, mosaic_path, wb_command=self.wb_command, jobs=self.jobs,
+                        quality=self.quality, call=self.call, num_frames=template.frame_count):
+                    raise RuntimeError('Unable to render %s' % scene)
+            else:
+                # Frames are kept in Tx_pngs, for those who look at them.
+                pngs_dir = os.path.join(self.files_path, '%s_pngs' % tx)
+                os.makedirs(pngs_dir, exist_ok=True)
+                width, height = frame_size(self.quality)
+                cmds = [ [ self.wb_command, '-show-scene', scene, str(frame),
+                           os.path.join(pngs_dir, 'P_%s_frame_%s.png' % (tx, frame)), str(width), str(height) ]
+                         for frame in range(1, template.frame_count + 1) ]
+
+                def render(cmd):
+                    return self.call(cmd, stage='brainsprite', stdout=subprocess.DEVNULL)
+
+                with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    for cmd, returncode in zip(cmds, pool.map(render, cmds)):
+                        if returncode != 0:
+                            raise subprocess.CalledProcessError(returncode, cmd)
+                make_mosaic(pngs_dir, mosaic_path, jobs=self.jobs)
+        finally:
+            os.remove(scene)
+
+        self.mark_current(mosaic_path)
+
+
+    def native_brainsprite(self, tx, tx_img):
+        # Makes the mosaic straight from the volume, outlined with whichever
+        # surfaces there are.
+        mosaic_path = os.path.join(self.images_path, '%s_mosaic.jpg' % tx)
+        surfaces = [ surface for surface in [ self.rp, self.lp, self.rw, self.lw ] if os.path.exists(surface) ]
+        num_frames = NATIVE_FRAMES
+        if os.path.exists(self.brainsprite_template):
+            num_frames = load_template(self.brainsprite_template).frame_count or NATIVE_FRAMES
+        inputs = [ tx_img ] + surfaces + [ 'renderer=native', 'frames=%s' % num_frames ]
+        if not self.is_stale(mosaic_path, inputs):
+            return 'Up to date.'
+
+        # Takes a CPU, as a tool would.
+        with self.tools:
+            volume_mosaic(tx_img, mosaic_path, surfaces=surfaces, num_frames=num_frames)
+        self.mark_current(mosaic_path)
+
+
+    def subcorticals(self, subcort_sub, subcort_atl):
+        outputs = [ ('%s_desc-AtlasInSubcort.gif' % self.images_pre, 'subcort_sub.nii.gz', 'bin_subcort_atl.nii.gz'),
+                    ('%s_desc-SubcortInAtlas.gif' % self.images_pre, 'subcort_atl.nii.gz', 'bin_subcort_sub.nii.gz') ]
+        settings = [ 'renderer=%s' % self.slice_renderer ] + [ '%s=%s' % piece for piece in self.subcort_slices ]
+        stale = [ self.is_stale(outputs[0][0], [ subcort_sub, subcort_atl ] + settings),
+                  self.is_stale(outputs[1][0], [ subcort_atl, subcort_sub ] + settings) ]
+        if not any(stale):
+            return 'Up to date.'
+
+        if self.slice_renderer == 'numpy':
+            # Load each volume once, and outline each with the other.
+            # Takes a CPU, as a tool would.
+            with self.tools:
+                sub = load_data(subcort_sub)
+                atl = load_data(subcort_atl)
+                overlay_montage(sub, atl, self.subcort_slices, outputs[0][0])
+                overlay_montage(atl, sub, self.subcort_slices, outputs[1][0])
+            for out, _, _ in outputs:
+                self.mark_current(out)
+            return
+
+        work = self.work_dir()
+        try:
+            self.check_call([ 'imcp', subcort_sub, os.path.join(work, 'subcort_sub.nii.gz') ])
+            self.check_call([ 'imcp', subcort_atl, os.path.join(work, 'subcort_atl.nii.gz') ])
+
+            # slicer does not do well trying to make the red outline when it
+            # cannot find the edges, so cannot use the ROI files with some low
+            # intensities. Outline binarized copies instead.
+            self.check_call([ 'fslmaths', 'subcort_atl.nii.gz', '-bin', 'bin_subcort_atl.nii.gz' ], cwd=work)
+            self.check_call([ 'fslmaths', 'subcort_sub.nii.gz', '-bin', 'bin_subcort_sub.nii.gz' ], cwd=work)
+
+            for out, base, outline in outputs:
+                slices = []
+                for idx, (axis, number) in enumerate(self.subcort_slices):
+                    # A negative position is a slice number to slicer.
+                    png = 'slice_%s.png' % chr(ord('a') + idx)
+                    self.check_call([ 'slicer', base, outline, '-' + axis, str(-number), png, '-u', '-L' ], cwd=work)
+                    slices.append(png)
+                appended = []
+                for png in slices:
+                    appended += [ png, '+' ]
+                self.check_call([ 'pngappend' ] + appended[:-1] + [ out ], cwd=work)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+        for out, _, _ in outputs:
+            self.mark_current(out)
+
+
+    def resample(self, task_img, work):
+        # Resample the brains to the task's grid, with flirt (into files in
+        # work) or in this process (into memory), or both to check that they
+        # agree.
+        brains = [ ('T1', self.t1_brain) ]
+        if self.has_t2:
+            brains.append(('T2', self.t2_brain))
+
+        resampled = {}
+        for tx, brain in brains:
+            if self.resampler in ('flirt', 'validate'):
+                os.makedirs(work, exist_ok=True)
+                resampled[tx] = os.path.join(work, '%sw_restore_brain.2.nii.gz' % tx)
+                self.check_call([ 'flirt', '-in', brain, '-ref', task_img, '-applyxfm', '-out', resampled[tx] ])
+
+            if self.resampler in ('numpy', 'validate'):
+                # Takes a CPU, as a tool would.
+                with self.tools:
+                    volume = resample_to_grid(brain, task_img)
+                if self.resampler == 'numpy':
+                    resampled[tx] = volume
+                else:
+                    agree, message = compare(volume, resampled[tx])
+                    print('%s resampled to the grid of %s: numpy %s flirt; %s.' % (
+                            tx, task_img, 'agrees with' if agree else 'DIFFERS from', message))
+                    if not agree:
+                        with self.lock:
+                            self.mismatches.append('%s on the grid of %s: %s' % (tx, task_img, message))
+        return resampled
+
+
+    def resampled(self, task_img):
+        # Most runs share a grid, so resample once per grid (in a directory
+        # of that grid's own) and let the tasks on it share the output. A
+        # task whose header cannot be read gets a grid of its own. Tasks on
+        # other grids go on while one grid is being resampled.
+        key = grid_signature(task_img) or task_img
+        with self.lock:
+            grid = self.grids.get(key)
+            if grid is None:
+                grid = { 'lock': threading.Lock(), 'resampled': None,
+                         'work': os.path.join(self.working, 'grid-%s' % len(self.grids)) }
+                self.grids[key] = grid
+
+        with grid['lock']:
+            if grid['resampled'] is None:
+                grid['resampled'] = self.resample(task_img, grid['work'])
+            else:
+                print('Grid of %s was already resampled to; reusing %s.' % (task_img, grid['work']))
+        return grid['resampled']
+
+
+    def task_rows(self, fmri_name, task_img):
+        fmri_pre = os.path.join(self.images_path, 'sub-%s_%s' % (self.subject_id, fmri_name))
+
+        txs = [ ('T1', self.t1_brain) ]
+        if self.has_t2:
+            txs.append(('T2', self.t2_brain))
+
+        stale = False
+        for tx, tx_brain in txs:
+            for desc in [ '%sInTask' % tx, 'TaskIn%s' % tx ]:
+                if self.is_stale('%s_desc-%s.gif' % (fmri_pre, desc), [ task_img, tx_brain, 'renderer=%s' % self.slice_renderer ]):
+                    stale = True
+        if not stale:
+            return 'Up to date.'
+
+        resampled = self.resampled(task_img)
+        task = task_img
+        if self.slice_renderer == 'numpy':
+            # Only this task slices its volume: load it for its rows alone.
+            task = load_data(task_img)
+        for tx, _ in txs:
+            self.slices_row(task, '%s_desc-%sInTask.gif' % (fmri_pre, tx), resampled[tx])
+            self.slices_row(resampled[tx], '%s_desc-TaskIn%s.gif' % (fmri_pre, tx), task)
+
+        for tx, _ in txs:
+            for desc in [ '%sInTask' % tx, 'TaskIn%s' % tx ]:
+                self.mark_current('%s_desc-%s.gif' % (fmri_pre, desc))
+
+
+    def slice_volume(self, volume, png_path):
+        if not self.is_stale(png_path, [ volume, 'renderer=%s' % self.slice_renderer ]):
+            return 'Up to date.'
+        # slicer shows the first frame of a run. Read only that frame, rather
+        # than have slicer load the whole run. If its header cannot be read,
+        # leave the run to slicer.
+        frame = None
+        if self.slice_renderer == 'numpy':
+            frame = read_frame(volume)
+        elif nibabel is not None:
+            try:
+                frame = read_frame(volume)
+            except Exception as e:
+                print('Cannot read the first frame of %s (%s: %s); slicing the whole run.' % (
+                        volume, type(e).__name__, e))
+
+        if frame is None:
+            self.check_call([ 'slicer', volume, '-u', '-a', png_path ])
+        elif self.slice_renderer == 'numpy':
+            # Takes a CPU, as a tool would.
+            with self.tools:
+                mid_slices(load_data(frame.image), png_path)
+        else:
+            work = self.work_dir()
+            try:
+                self.check_call([ 'slicer', frame.save(work), '-u', '-a', png_path ])
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+        self.mark_current(png_path)
+
+
+    def temporal_row(self, bold):
+        # Mosaics of the temporal mean, std and tSNR of a run, named after it
+        # as the layout expects: sub-01_task-rest_run-01_desc-tSNR.png.
+        name = os.path.basename(bold).replace('.nii.gz', '').replace('.nii', '')
+        if name.endswith('_bold'):
+            name = name[:-len('_bold')]
+        out_pre = os.path.join(self.images_path, name)
+        outputs = [ '%s_desc-%s.png' % (out_pre, name) for name in TEMPORAL_STATS ]
+        stale = [ self.is_stale(out, [ bold ]) for out in outputs ]
+        if not any(stale):
+            return 'Up to date.'
+
+        # Reads the whole run, a chunk at a time. Takes a CPU, as a tool would.
+        with self.tools:
+            temporal_mosaics(bold, out_pre)
+        for out in outputs:
+            self.mark_current(out)
+
+
+    def has_grayplot(self, png):
+        # DCAN-BOLD processing writes the gray plots to the summary
+        # directory, from which the layout copies them. Those are kept.
+        return os.path.exists(os.path.join(self.summary_path, png))
+
+
+    def grayplot_row(self, png, runs, movements):
+        # A gray plot of the runs, one after another, as DCAN-BOLD processing
+        # names them: DVARS_and_FD_task-rest01.png.
+        out = os.path.join(self.images_path, png)
+        if not self.is_stale(out, runs + movements):
+            return 'Up to date.'
+
+        # Reads each run a block at a time. Takes a CPU, as a tool would.
+        with self.tools:
+            grayplot(runs, out, movements)
+        self.mark_current(out)
+
+
+    def add_grayplots(self, task_dirs):
+        # Pre- and post-regression gray plots of each task, and of the
+        # resting state runs one after another, for those that DCAN-BOLD
+        # processing did not make.
+        rest = { 'pre': ([], []), 'post': ([], []) }
+        for task_dir in task_dirs:
+            fmri_name = os.path.basename(os.path.normpath(task_dir))
+            movement = os.path.join(task_dir, 'Movement_Regressors.txt')
+            pre = os.path.join(task_dir, '%s_Atlas.dtseries.nii' % fmri_name)
+            if not os.path.exists(pre):
+                pre = os.path.join(task_dir, '%s.nii.gz' % fmri_name)
+            post = sorted(glob.glob(os.path.join(task_dir, '%s_Atlas*regress*.dtseries.nii' % fmri_name)))
+            runs = { 'pre': pre if os.path.exists(pre) else None, 'post': post[0] if post else None }
+
+            for when, prefix in [ ('pre', ''), ('post', 'postreg_') ]:
+                if runs[when] is None:
+                    continue
+                if 'task-rest' in fmri_name:
+                    rest[when][0].append(runs[when])
+                    rest[when][1].append(movement)
+                png = '%sDVARS_and_FD_%s.png' % (prefix, fmri_name)
+                if not self.has_grayplot(png):
+                    self.graph.add('grayplot_%s' % png,
+                            lambda png=png, run=runs[when], movement=movement: self.grayplot_row(png, [ run ], [ movement ]))
+
+        for when, conc in [ ('pre', 'CONCA'), ('post', 'CONCP') ]:
+            runs, movements = rest[when]
+            png = 'DVARS_and_FD_%s_task-rest.png' % conc
+            if runs and not self.has_grayplot(png):
+                self.graph.add('grayplot_%s' % png,
+                        lambda png=png, runs=runs, movements=movements: self.grayplot_row(png, runs, movements))
+
+
+    ############ GRAPH ##############
+
+    def add_stages(self):
+        graph = self.graph
+
+        # Brainsprites take the longest; start them first.
+        if self.sprite_renderer == 'native':
+            graph.add('brainsprite_T1', lambda: self.native_brainsprite('T1', self.t1))
+            if self.has_t2:
+                graph.add('brainsprite_T2', lambda: self.native_brainsprite('T2', self.t2))
+        elif not os.path.exists(self.brainsprite_template):
+            print('Missing %s\nCannot perform processing needed for brainsprite.' % self.brainsprite_template)
+        else:
+            graph.add('brainsprite_T1', lambda: self.brainsprite('T1', self.t1))
+            if self.has_t2:
+                graph.add('brainsprite_T2', lambda: self.brainsprite('T2', self.t2))
+
+        # Atlas rows.
+        if not os.path.exists(self.atlas):
+            print('Missing %s\nCannot create atlas-in-t1 or t1-in-atlas' % self.atlas)
+        else:
+            graph.add('atlas_in_t1', lambda: self.atlas_row(self.t1_mask, '%s_desc-AtlasInT1w.gif' % self.images_pre, self.atlas))
+            graph.add('t1_in_atlas', lambda: self.atlas_row(self.atlas, '%s_desc-T1wInAtlas.gif' % self.images_pre, self.t1_mask))
+
+        # Named pngs: one scene, then each png from it. Natively, each png
+        # is made from the volume and surfaces, which are loaded once.
+        if self.view_renderer == 'native':
+            for idx, name in enumerate(IMAGE_NAMES):
+                if not self.has_t2 and idx % 2 == 1:
+                    continue
+                tx_img = self.t1 if name.startswith('T1-') else self.t2
+                graph.add('png_%s' % name,
+                        lambda tx_img=tx_img, name=name: self.native_named_png(tx_img, name))
+        else:
+            scene_stage = graph.add('pngs_scene', self.build_pngs_scene)
+            for idx, name in enumerate(IMAGE_NAMES):
+                scene_num = idx + 1
+                if not self.has_t2 and scene_num % 2 == 0:
+                    continue
+                graph.add('png_%s' % name,
+                        lambda scene_num=scene_num, name=name: self.named_pngs(scene_num, name), [ scene_stage ])
+
+        # Subcorticals.
+        subcort_sub = os.path.join(self.rois_path, 'sub2atl_ROI.2.nii.gz')
+        subcort_atl = os.path.join(self.rois_path, 'Atlas_ROIs.2.nii.gz')
+        if not os.path.exists(subcort_sub):
+            print('Missing %s.\nNo subcorticals will be included.' % subcort_sub)
+        elif not os.path.exists(subcort_atl):
+            print('Missing %s.\nCannot create atlas-in-subcort or subcort-in-atlas.' % subcort_atl)
+        else:
+            graph.add('subcorticals', lambda: self.subcorticals(subcort_sub, subcort_atl))
+
+        # Registrations of each task.
+        task_dirs = sorted(glob.glob(os.path.join(self.results_path, '*task-*/')))
+        for task_dir in task_dirs:
+            fmri_name = os.path.basename(os.path.normpath(task_dir))
+            task_img = os.path.join(self.results_path, fmri_name, fmri_name + '.nii.gz')
+            graph.add('task_%s' % fmri_name,
+                    lambda fmri_name=fmri_name, task_img=task_img: self.task_rows(fmri_name, task_img))
+
+        # Gray plots that DCAN-BOLD processing did not make.
+        if self.grayplots:
+            self.add_grayplots(task_dirs)
+
+        # Slices of the bold and sbref (or scout) volumes.
+        if self.func_path is not None and os.path.isdir(self.func_path):
+            volumes = []
+            for bold in sorted(glob.glob(os.path.join(self.func_path, '*task-*_bold*.nii*'))):
+                volumes.append((bold, self.png_name(bold)))
+            sbrefs = sorted(glob.glob(os.path.join(self.func_path, '*task-*_sbref*.nii*')))
+            if sbrefs:
+                for sbref in sbrefs:
+                    volumes.append((sbref, self.png_name(sbref)))
+            else:
+                # There are no SBRefs; use scout files for references.
+                for scout in sorted(glob.glob(os.path.join(self.files_path, '*task-*', 'Scout_orig.nii.gz'))):
+                    task_name = os.path.basename(os.path.dirname(scout))
+                    volumes.append((scout, 'sub-%s_%s_ref.png' % (self.subject_id, task_name)))
+            for volume, png in volumes:
+                graph.add('slice_%s' % png,
+                        lambda volume=volume, png=png: self.slice_volume(volume, os.path.join(self.images_path, png)))
+            if self.temporal_stats:
+                # Each run is read by a stage of its own, so runs are read at
+                # the same time.
+                for bold in sorted(glob.glob(os.path.join(self.func_path, '*task-*_bold*.nii*'))):
+                    graph.add('temporal_%s' % os.path.basename(bold),
+                            lambda bold=bold: self.temporal_row(bold))
+        else:
+            print('No func files. Neither BOLD nor SBREF will be shown.')
+
+
+    def set_permissions(self):
+        # The lab's group (GROUP, from setup_env.sh) may read and write
+        # everything made here. Best effort.
+        try:
+            gid = grp.getgrnam(os.environ.get('GROUP', 'fnl_lab')).gr_gid
+        except KeyError:
+            gid = None
+        for root, dirs, files in os.walk(self.html_path):
+            for name in [ root ] + [ os.path.join(root, file) for file in files ]:
+                # A hardlink (e.g., a gray plot staged with --stage-mode
+                # link) shares its mode and group with the DCAN-BOLD file it
+                # was made from, and a symlink's target is not ours either.
+                try:
+                    info = os.lstat(name)
+                except OSError:
+                    continue
+                if stat.S_ISLNK(info.st_mode) or (stat.S_ISREG(info.st_mode) and info.st_nlink > 1):
+                    continue
+                if gid is not None:
+                    try:
+                        os.chown(name, -1, gid)
+                    except OSError:
+                        pass
+                try:
+                    os.chmod(name, 0o770)
+                except OSError:
+                    pass
+
+
+    def missing_tools(self):
+        # The tools that the chosen renderers call, and that cannot be found.
+        tools = []
+        if 'workbench' in (self.sprite_renderer, self.view_renderer):
+            if self.wb_command is None:
+                tools.append('wb_command (set CARET7DIR, or put it on the PATH)')
+        if self.slice_renderer == 'fsl':
+            tools += [ tool for tool in FSL_SLICE_TOOLS if shutil.which(tool) is None ]
+        if self.resampler in ('flirt', 'validate'):
+            tools += [ tool for tool in FSL_RESAMPLE_TOOLS if shutil.which(tool) is None ]
+        return tools
+
+
+    def png_name(self, volume):
+        png = os.path.basename(volume)
+        png = png.replace('.nii.gz', '.png', 1)
+        return png.replace('.nii', '.png', 1)
+
+
+    def run(self):
+        """
+        Makes all of the images.
+
+        :return: True if every stage succeeded.
+        """
+        print('\nSTART: executive summary image preprocessing with %s jobs' % self.jobs)
+        missing = self.missing_tools()
+        if missing:
+            print('ERROR: cannot find %s. Is FSL (FSLDIR/bin on the PATH) or workbench set up? '
+                  'No images were made.' % ', '.join(missing))
+            return False
+        os.makedirs(self.images_path, exist_ok=True)
+
+        self.add_stages()
+        succeeded = self.graph.run(self.jobs)
+        self.graph.summary()
+
+        if self.mismatches:
+            print('ERROR: the numpy resampler does not agree with flirt:')
+            for mismatch in self.mismatches:
+                print('\t%s' % mismatch)
+            succeeded = False
+
+        # Clean up, even after a failed stage. The volumes kept for the
+        # stages go too: a batch worker goes on to other sessions.
+        self.volumes.clear()
+        self.grids.clear()
+        shutil.rmtree(self.working, ignore_errors=True)
+        if os.path.exists(self.pngs_scene):
+            os.remove(self.pngs_scene)
+        self.set_permissions()
+
+        print('DONE: executive summary prep')
+        return succeeded
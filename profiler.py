@@ -0,0 +1,213 @@
+__doc__ = """
+Records how long each stage of the Executive Summary takes, and how much
+CPU time and memory it uses, along with the same for every external tool
+(wb_command, slicesdir, slicer, flirt, ...) that is called. Tool calls are
+waited for with wait4, so each has its own resource usage.
+
+A RunProfile keeps the records of a run and writes them to profile.json in
+the executivesummary directory.
+"""
+
+import os
+import json
+import pstats
+import time
+import shlex
+import resource
+import threading
+import subprocess
+from contextlib import contextmanager
+
+PROFILE_NAME = 'profile.json'
+CPROFILE_NAME = 'profile.prof'
+
+
+def exit_code(status):
+    # Convert a wait status to a return code as subprocess does: negative
+    # for a signal.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def tool_name(cmd):
+    if isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    return os.path.basename(cmd[0]) if cmd else ''
+
+
+def run_tool(cmd, stage=None, **kwargs):
+    """
+    Runs a command, and waits for it with wait4 to get its resource usage.
+
+    :parameter: cmd: list of args, or a string with shell=True.
+    :parameter: stage: name of the stage the call belongs to.
+    :parameter: kwargs: passed to subprocess.Popen.
+    :return: tuple of return code and a record of the call.
+    """
+    start = time.time()
+    proc = subprocess.Popen(cmd, **kwargs)
+    _, status, usage = os.wait4(proc.pid, 0)
+    # The process has been reaped; let Popen know.
+    proc.returncode = exit_code(status)
+
+    record = {
+        'stage'      : stage,
+        'tool'       : tool_name(cmd),
+        'command'    : cmd if isinstance(cmd, str) else ' '.join(cmd),
+        'returncode' : proc.returncode,
+        'start'      : start,
+        'wall'       : time.time() - start,
+        'cpu_user'   : usage.ru_utime,
+        'cpu_sys'    : usage.ru_stime,
+        'peak_rss_kb': usage.ru_maxrss
+        }
+    return proc.returncode, record
+
+
+class RunProfile(object):
+
+    # Keeps the stages and tool calls of one run. When not enabled, stages
+    # and calls are run but not recorded, so callers need not check.
+
+    def __init__ (self, html_path, enabled=True, cprofile=False):
+        self.enabled = enabled or cprofile
+        self.path = os.path.join(html_path, PROFILE_NAME)
+        self.cprofile_path = os.path.join(html_path, CPROFILE_NAME)
+
+        self.stages = []
+        self.tools = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+        # cProfile only sees the thread that enables it, and the stages run
+        # in pools of threads. So each thread has its own profiler (and its
+        # own depth of nested stages), and they are merged when saved.
+        self.cprofile = cprofile
+        self.cprofiles = []
+        self.local = threading.local()
+
+
+    def start_cprofile(self):
+        # Profiles this thread, from its outermost stage.
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Since Python 3.12, one profiler sees every thread, and
+                # one (of an enclosing stage) is already on.
+                profile = None
+            self.local.profile = profile
+        self.local.depth = depth + 1
+
+
+    def stop_cprofile(self):
+        self.local.depth -= 1
+        if self.local.depth == 0 and self.local.profile is not None:
+            self.local.profile.disable()
+            with self.lock:
+                self.cprofiles.append(self.local.profile)
+            self.local.profile = None
+
+
+    @contextmanager
+    def stage(self, name):
+        # Records wall time, CPU time (of this process and of the children
+        # that were waited for) and peak RSS of the code in the 'with'.
+        if not self.enabled:
+            yield
+            return
+
+        # Stages may run at the same time in many threads. Then, CPU time
+        # is that of the whole process during the stage.
+        start = time.time()
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if self.cprofile:
+            self.start_cprofile()
+        try:
+            yield
+        finally:
+            if self.cprofile:
+                self.stop_cprofile()
+            self_after = resource.getrusage(resource.RUSAGE_SELF)
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+            with self.lock:
+                self.stages.append({
+                    'stage'               : name,
+                    'start'               : start,
+                    'wall'                : time.time() - start,
+                    'cpu_user'            : self_after.ru_utime - self_before.ru_utime,
+                    'cpu_sys'             : self_after.ru_stime - self_before.ru_stime,
+                    'children_cpu'        : (children_after.ru_utime - children_before.ru_utime) +
+                                            (children_after.ru_stime - children_before.ru_stime),
+                    # High-water marks, not increases: RSS of this process
+                    # and of the largest child so far.
+                    'peak_rss_kb'         : self_after.ru_maxrss,
+                    'children_peak_rss_kb': children_after.ru_maxrss
+                    })
+
+
+    def call(self, cmd, stage=None, **kwargs):
+        """
+        Runs an external tool, as subprocess.call does, and records the call.
+        Safe to use from many threads.
+
+        :return: return code of the tool.
+        """
+        if not self.enabled:
+            return subprocess.call(cmd, **kwargs)
+
+        returncode, record = run_tool(cmd, stage, **kwargs)
+        with self.lock:
+            self.tools.append(record)
+        return returncode
+
+
+    def summary(self, tools):
+        # Totals for each tool, e.g., how much of the run went to wb_command.
+        totals = {}
+        for record in tools:
+            total = totals.setdefault(record['tool'], { 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_kb': 0 })
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu_user'] + record['cpu_sys']
+            total['peak_rss_kb'] = max(total['peak_rss_kb'], record['peak_rss_kb'])
+        return totals
+
+
+    def save(self):
+        if not self.enabled:
+            return
+
+        tools = sorted(self.tools, key=lambda record: record['start'])
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        profile = {
+            'start'   : self.start,
+            'wall'    : time.time() - self.start,
+            'cpu'     : usage.ru_utime + usage.ru_stime,
+            'children_cpu': children.ru_utime + children.ru_stime,
+            'peak_rss_kb' : usage.ru_maxrss,
+            'stages'  : self.stages,
+            'tools'   : tools,
+            'summary' : self.summary(tools)
+            }
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(profile, fd, indent=1)
+        os.replace(tmp_path, self.path)
+        print('info: Run profile is in %s' % self.path)
+
+        if self.cprofiles:
+            stats = pstats.Stats(self.cprofiles[0])
+            for profile in self.cprofiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(self.cprofile_path)
+            print('info: cProfile stats are in %s' % self.cprofile_path)
@@ -0,0 +1,180 @@
+import os
+import numpy as np
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# How the anatomicals are resampled to each task's grid. 'flirt' calls
+# flirt -applyxfm; 'numpy' resamples in this process and keeps the result in
+# memory; 'validate' does both, checks that they agree, and uses flirt's.
+RESAMPLERS = [ 'flirt', 'numpy', 'validate' ]
+
+# Largest difference allowed between the numpy and flirt resamples, as a
+# fraction of the range of flirt's output.
+VALIDATE_TOLERANCE = 0.02
+
+# Voxels of the task grid resampled at a time, to bound the memory used by
+# the coordinates and weights.
+CHUNK_VOXELS = 1 << 20
+
+
+def grid_signature(img):
+    """
+    Identifies the voxel grid of a volume: its dims, voxel sizes, and sform
+    and qform (with their codes). Volumes with the same grid get the same
+    output from 'flirt -applyxfm -ref', so they can share it.
+
+    :parameter: img: path of a NIfTI volume. Only its header is read.
+    :return: tuple, or None if the header cannot be read.
+    """
+    if nibabel is None:
+        return None
+    try:
+        header = nibabel.load(img).header
+    except Exception:
+        return None
+
+    def rounded(values):
+        if values is None:
+            return None
+        return tuple(round(float(value), 5) for value in np.ravel(values))
+
+    sform, sform_code = header.get_sform(coded=True)
+    qform, qform_code = header.get_qform(coded=True)
+    return (tuple(int(dim) for dim in header.get_data_shape()[:3]),
+            rounded(header.get_zooms()[:3]),
+            int(sform_code), rounded(sform),
+            int(qform_code), rounded(qform))
+
+
+class Volume(object):
+
+    # A volume held in memory, e.g., a resampled brain. It is written to a
+    # file only for a tool that needs one.
+
+    def __init__ (self, name, image):
+        self.name = name
+        self.image = image
+
+
+    def save(self, directory):
+        # Uncompressed: the file is read once, by a tool, and thrown away.
+        path = os.path.join(directory, self.name + '.nii')
+        nibabel.save(self.image, path)
+        return path
+
+
+def fsl_voxel_to_mm(header):
+    # flirt's own coordinates: voxels scaled by the voxel size, with x
+    # flipped when the voxels are stored in neurological order. It does not
+    # use the sform or qform origin, so neither does this.
+    shape = header.get_data_shape()[:3]
+    zooms = header.get_zooms()[:3]
+    matrix = np.diag([ float(zoom) for zoom in zooms ] + [ 1.0 ])
+    if np.linalg.det(header.get_best_affine()) > 0:
+        matrix[0, 0] = -zooms[0]
+        matrix[0, 3] = (shape[0] - 1) * zooms[0]
+    return matrix
+
+
+def trilinear(data, coords):
+    """
+    Samples a volume at (fractional) voxel coordinates.
+
+    :parameter: data: 3-D array.
+    :parameter: coords: array of shape (3, N) of voxel coordinates.
+    :return: float32 array of N values; 0 outside of the volume.
+    """
+    shape = np.array(data.shape[:3])
+    base = np.floor(coords).astype(np.intp)
+    frac = (coords - base).astype(np.float32)
+    inside = np.all((coords >= 0) & (coords <= (shape - 1)[:, None]), axis=0)
+
+    # Clip the corners, so those of voxels on the last plane (and of those
+    # outside, which are zeroed below) can be looked up.
+    low = np.clip(base, 0, (shape - 1)[:, None])
+    high = np.clip(base + 1, 0, (shape - 1)[:, None])
+
+    values = np.zeros(coords.shape[1], dtype=np.float32)
+    for dx in (0, 1):
+        wx = frac[0] if dx else 1 - frac[0]
+        ix = high[0] if dx else low[0]
+        for dy in (0, 1):
+            wy = frac[1] if dy else 1 - frac[1]
+            iy = high[1] if dy else low[1]
+            for dz in (0, 1):
+                wz = frac[2] if dz else 1 - frac[2]
+                iz = high[2] if dz else low[2]
+                values += wx * wy * wz * data[ix, iy, iz]
+
+    values[~inside] = 0
+    return values
+
+
+def resample_to_grid(src_path, ref_path, name=None):
+    """
+    Resamples a volume into the voxel grid of another, as
+    'flirt -in src -ref ref -applyxfm' does (an identity transform, with
+    trilinear interpolation), in this process.
+
+    :parameter: src_path: volume to resample, e.g., T1w_restore_brain.nii.gz.
+    :parameter: ref_path: volume with the grid, e.g., a task's volume. Only
+                its header is read.
+    :parameter: name: name of the Volume. Default: src's, with '.2'.
+    :return: Volume with the resampled data and ref's header.
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to resample in-process.')
+
+    src = nibabel.load(src_path)
+    ref = nibabel.load(ref_path)
+    data = np.asanyarray(src.dataobj)
+    if data.ndim > 3:
+        data = data[..., 0]
+    data = data.astype(np.float32, copy=False)
+
+    # Task voxel -> flirt mm (the same in both) -> source voxel.
+    ref_to_src = np.linalg.inv(fsl_voxel_to_mm(src.header)) @ fsl_voxel_to_mm(ref.header)
+
+    shape = ref.header.get_data_shape()[:3]
+    out = np.zeros(shape, dtype=np.float32)
+    plane = shape[0] * shape[1]
+    ii, jj = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    ii = ii.ravel()
+    jj = jj.ravel()
+    step = max(1, CHUNK_VOXELS // plane)
+    for k0 in range(0, shape[2], step):
+        k1 = min(shape[2], k0 + step)
+        kk = np.repeat(np.arange(k0, k1), plane)
+        voxels = np.stack([ np.tile(ii, k1 - k0), np.tile(jj, k1 - k0), kk, np.ones(kk.size) ])
+        coords = (ref_to_src @ voxels)[:3]
+        out[:, :, k0:k1] = trilinear(data, coords).reshape((k1 - k0, shape[0], shape[1])).transpose(1, 2, 0)
+
+    header = ref.header.copy()
+    header.set_data_dtype(np.float32)
+    header.set_data_shape(shape)
+    image = nibabel.Nifti1Image(out, None, header=header)
+
+    if name is None:
+        name = os.path.basename(src_path).replace('.nii.gz', '').replace('.nii', '') + '.2'
+    return Volume(name, image)
+
+
+def compare(volume, flirt_path, tolerance=VALIDATE_TOLERANCE):
+    """
+    Compares an in-process resample with flirt's.
+
+    :return: tuple of whether they agree within tolerance, and a message.
+    """
+    expected = np.asanyarray(nibabel.load(flirt_path).dataobj).astype(np.float32)
+    if expected.ndim > 3:
+        expected = expected[..., 0]
+    actual = np.asanyarray(volume.image.dataobj)
+    if actual.shape != expected.shape:
+        return False, 'shape %s differs from flirt\'s %s' % (actual.shape, expected.shape)
+
+    scale = max(float(expected.max() - expected.min()), 1e-6)
+    diff = np.abs(actual - expected) / scale
+    message = 'max difference %.3g%%, mean %.3g%% of the range' % (100 * diff.max(), 100 * diff.mean())
+    return bool(diff.max() <= tolerance), message
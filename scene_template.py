@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Renders workbench scene templates. A template holds placeholders made of a
+key and a suffix, e.g., TX_IMG_NAME_and_PATH or RPIAL_PATH: the key's path
+goes where the suffix is _PATH or _NAME_and_PATH, and the path's file name
+where it is _NAME.
+
+A template is parsed once, into its text and placeholders, and is rendered
+in a single pass. Parsed templates are cached (by path, size and mtime), so
+sessions run one after another by the same process share them.
+
+'render' writes a scene with the given KEY=PATH values; 'frames' prints the
+number of frames (SceneInfo) in a template or scene.
+"""
+
+import os
+import re
+import argparse
+from functools import lru_cache
+
+# Longest first, so TX_IMG_NAME_and_PATH is not taken for TX_IMG_NAME.
+PLACEHOLDER_SUFFIXES = [ '_NAME_and_PATH', '_PATH', '_NAME' ]
+
+PLACEHOLDER_PATTERN = re.compile(r'\b([A-Z][A-Z0-9]*(?:_[A-Z0-9]+)*?)(%s)\b' % '|'.join(PLACEHOLDER_SUFFIXES))
+
+
+class SceneTemplate(object):
+
+    def __init__ (self, path):
+        self.path = path
+        with open(path) as fd:
+            text = fd.read()
+
+        # re.split with two groups gives: text, key, suffix, text, key, ...
+        pieces = PLACEHOLDER_PATTERN.split(text)
+        self.texts = pieces[0::3]
+        self.slots = list(zip(pieces[1::3], pieces[2::3]))
+        self.placeholders = sorted(set(key + suffix for key, suffix in self.slots))
+
+        # Each frame of a brainsprite scene has its own SceneInfo.
+        self.frame_count = text.count('SceneInfo Index=')
+
+
+    def render(self, values):
+        """
+        Fills in the placeholders whose keys have values. Others are left
+        as they are.
+
+        :parameter: values: dict of key (e.g., 'TX_IMG') to path.
+        :return: the text of the scene.
+        """
+        out = [ self.texts[0] ]
+        for (key, suffix), text in zip(self.slots, self.texts[1:]):
+            path = values.get(key)
+            if path is None:
+                out.append(key + suffix)
+            elif suffix == '_NAME':
+                out.append(os.path.basename(path))
+            else:
+                out.append(path)
+            out.append(text)
+        return ''.join(out)
+
+
+    def write(self, scene_path, values):
+        with open(scene_path, 'w') as fd:
+            fd.write(self.render(values))
+        return scene_path
+
+
+@lru_cache(maxsize=16)
+def _parse(path, size, mtime_ns):
+    return SceneTemplate(path)
+
+
+def load_template(path):
+    """
+    Returns the parsed template, parsing it only if it has not been
+    parsed since it last changed.
+    """
+    stat = os.stat(path)
+    return _parse(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def generate_parser():
+
+    parser = argparse.ArgumentParser(
+            prog='scene_template',
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter
+            )
+    parser.add_argument(
+            'action', choices=[ 'render', 'frames' ],
+            help='render a scene, or print the number of frames.'
+            )
+    parser.add_argument(
+            '--template', dest='template', required=True,
+            help='scene template (or, for frames, any scene).'
+            )
+    parser.add_argument(
+            '--output', dest='output',
+            help='scene to write.'
+            )
+    parser.add_argument(
+            '--values', dest='values', nargs='*', default=[], metavar='KEY=PATH',
+            help='value of each key, e.g., TX_IMG=/path/to/T1w_restore.nii.gz.'
+            )
+
+    return parser
+
+
+def _cli():
+    parser = generate_parser()
+    args = parser.parse_args()
+
+    template = load_template(args.template)
+
+    if args.action == 'frames':
+        print(template.frame_count)
+        return
+
+    if args.output is None:
+        parser.error('--output is required to render')
+    values = {}
+    for item in args.values:
+        key, _, path = item.partition('=')
+        if not key or not path:
+            parser.error('values must be KEY=PATH: %s' % item)
+        values[key] = path
+    template.write(args.output, values)
+
+
+if __name__ == '__main__':
+    _cli()
@@ -0,0 +1,219 @@
+import numpy as np
+from PIL import Image, ImageDraw
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# How the slice images (the subcorticals and the registrations) are made.
+# 'fsl' calls slicer, pngappend and slicesdir; 'numpy' slices the volumes in
+# this process.
+SLICE_RENDERERS = [ 'fsl', 'numpy' ]
+
+# Percentiles of a volume's non-zero intensities that set its range of greys.
+SLICE_PERCENTILES = (2, 98)
+
+# Color of the outline of the overlay, as slicer draws it.
+OUTLINE_COLOR = (255, 0, 0)
+
+AXES = { 'x': 0, 'y': 1, 'z': 2 }
+
+# Where slicesdir takes its slices, as fractions of each axis.
+REGISTRATION_FRACTIONS = (0.4, 0.5, 0.6)
+
+
+def parse_slices(items):
+    """
+    Parses slices given as AXIS=SLICE, e.g., x=36 for sagittal slice 36.
+
+    :parameter: items: strings, or (axis, slice) tuples, which are kept.
+    :return: list of (axis, slice) tuples, e.g., ('x', 36).
+    """
+    slices = []
+    for item in items:
+        if not isinstance(item, str):
+            slices.append((item[0], int(item[1])))
+            continue
+        axis, _, number = item.partition('=')
+        if axis not in AXES or not number.isdigit():
+            raise ValueError('slices must be AXIS=SLICE, with AXIS one of x, y or z: %s' % item)
+        slices.append((axis, int(number)))
+    return slices
+
+
+def load_data(volume):
+    """
+    Loads the data of a volume (its first frame, if it has more).
+
+    :parameter: volume: path of a NIfTI volume, or a nibabel image.
+    :return: 3-D float32 array, in the order of the voxels on disk.
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to slice volumes in-process.')
+    image = nibabel.load(volume) if isinstance(volume, str) else volume
+    if len(image.shape) > 3:
+        # Read only the first frame of a run.
+        data = np.asanyarray(image.dataobj[..., 0])
+    else:
+        data = np.asanyarray(image.dataobj)
+    return data.reshape(data.shape[:3]).astype(np.float32, copy=False)
+
+
+def intensity_range(data):
+    # The range to show as black to white: percentiles of the non-zero
+    # voxels, from no higher than 0, so the lowest label of an ROI volume
+    # (or a mask) is not shown as black.
+    values = data[data != 0]
+    if values.size == 0:
+        return 0.0, 1.0
+    vmin, vmax = np.percentile(values, SLICE_PERCENTILES)
+    vmin = min(0.0, float(vmin))
+    if vmax <= vmin:
+        vmax = vmin + 1.0
+    return vmin, float(vmax)
+
+
+def take_slice(data, axis, number):
+    """
+    Takes a slice as slicer shows it: the first voxel of the remaining axes
+    is at the left and at the bottom.
+
+    :parameter: data: 3-D array.
+    :parameter: axis: 'x', 'y' or 'z'.
+    :parameter: number: index of the slice along the axis.
+    :return: 2-D array (rows, columns).
+    """
+    plane = np.take(data, min(number, data.shape[AXES[axis]] - 1), axis=AXES[axis])
+    return plane.T[::-1]
+
+
+def outline(mask):
+    """
+    Finds the edges of a 2-D mask: pixels in the mask with a neighbour (up,
+    down, left or right) that is not.
+    """
+    inner = mask.copy()
+    inner[1:] &= mask[:-1]
+    inner[:-1] &= mask[1:]
+    inner[:, 1:] &= mask[:, :-1]
+    inner[:, :-1] &= mask[:, 1:]
+    return mask & ~inner
+
+
+def overlay_slice(base, overlay, axis, number, intensities, label=True):
+    """
+    Renders one slice of base in grey, with the edges of the (binarized)
+    overlay in red.
+
+    :parameter: base: 3-D array.
+    :parameter: overlay: 3-D array of the same shape, or None.
+    :parameter: intensities: (vmin, vmax) of base, shown as black and white.
+    :parameter: label: whether to write the slice number at the top left.
+    :return: RGB PIL image.
+    """
+    vmin, vmax = intensities
+    plane = take_slice(base, axis, number)
+    grey = np.clip((plane - vmin) * (255.0 / max(vmax - vmin, 1e-6)), 0, 255).astype(np.uint8)
+    rgb = np.repeat(grey[:, :, None], 3, axis=2)
+    if overlay is not None:
+        rgb[outline(take_slice(overlay, axis, number) > 0)] = OUTLINE_COLOR
+
+    image = Image.fromarray(rgb)
+    if label:
+        ImageDraw.Draw(image).text((1, 0), str(number), fill=(255, 255, 255))
+    return image
+
+
+def append_images(images):
+    """
+    Puts images side by side, top aligned, as pngappend does with '+'.
+    """
+    width = sum(image.width for image in images)
+    height = max(image.height for image in images)
+    appended = Image.new('RGB', (width, height))
+    left = 0
+    for image in images:
+        appended.paste(image, (left, 0))
+        left += image.width
+    return appended
+
+
+def save_image(image, path):
+    # GIFs hold 256 colors: the greys and the outline fit in an adaptive
+    # palette.
+    if path.lower().endswith('.gif'):
+        image = image.quantize(colors=256)
+    image.save(path)
+
+
+def overlay_montage(base, overlay, slices, out_path, label=True):
+    """
+    Renders slices of base, each with the outline of overlay, side by side
+    into one image.
+
+    :parameter: base: 3-D array (see load_data).
+    :parameter: overlay: 3-D array of the same shape, or None.
+    :parameter: slices: (axis, slice) tuples (see parse_slices).
+    :parameter: out_path: image to write, e.g., a .gif or .png.
+    :return: out_path
+    """
+    intensities = intensity_range(base)
+    images = [ overlay_slice(base, overlay, axis, number, intensities, label) for axis, number in slices ]
+    save_image(append_images(images), out_path)
+    return out_path
+
+
+def registration_row(base, overlay, out_path):
+    """
+    Renders the row slicesdir -p makes: sagittal, coronal and axial slices
+    at .4, .5 and .6 of each axis, with the outline of overlay in red.
+
+    :parameter: base: 3-D array (see load_data).
+    :parameter: overlay: 3-D array of the same shape, or None.
+    :parameter: out_path: image to write, e.g., a .gif.
+    :return: out_path
+    """
+    if overlay is not None and overlay.shape != base.shape:
+        raise ValueError('cannot outline a volume of shape %s over one of shape %s' % (overlay.shape, base.shape))
+    slices = [ (axis, int(round(fraction * (base.shape[AXES[axis]] - 1))))
+               for axis in [ 'x', 'y', 'z' ] for fraction in REGISTRATION_FRACTIONS ]
+    return overlay_montage(base, overlay, slices, out_path, label=False)
+
+
+def mid_slices(base, out_path):
+    """
+    Renders the row slicer -a makes: the middle sagittal, coronal and axial
+    slices.
+
+    :parameter: base: 3-D array (see load_data).
+    :parameter: out_path: image to write, e.g., a .png.
+    :return: out_path
+    """
+    slices = [ (axis, base.shape[AXES[axis]] // 2) for axis in [ 'x', 'y', 'z' ] ]
+    return overlay_montage(base, None, slices, out_path, label=False)
+
+
+def slice_mosaic(base, out_path, axis='z', count=12, columns=6, label=True):
+    """
+    Renders slices of base, evenly spaced along an axis (and clear of its
+    ends), in a grid.
+
+    :parameter: base: 3-D array (see load_data).
+    :parameter: out_path: image to write, e.g., a .png.
+    :parameter: axis: 'x', 'y' or 'z'. Default: axial slices.
+    :parameter: count: number of slices.
+    :parameter: columns: slices in each row of the grid.
+    :return: out_path
+    """
+    size = base.shape[AXES[axis]]
+    numbers = sorted(set(int(round(number)) for number in np.linspace(0, size - 1, count + 2)[1:-1]))
+    intensities = intensity_range(base)
+    images = [ overlay_slice(base, None, axis, number, intensities, label) for number in numbers ]
+
+    width, height = images[0].size
+    rows = (len(images) + columns - 1) // columns
+    mosaic = Image.new('RGB', (width * min(columns, len(images)), height * rows))
+    for idx, image in enumerate(images):
+        mosaic.paste(image, ((idx % columns) * width, (idx // columns) * height))
+    save_image(mosaic, out_path)
+    return out_path
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from functools import lru_cache
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# Colors of the outlines drawn over the anatomicals, by surface.
+CONTOUR_COLORS = { 'pial': (255, 0, 0), 'white': (0, 0, 255) }
+
+
+def read_surface(path):
+    """
+    Reads a GIFTI surface, with no caching.
+
+    :return: tuple of vertices (V x 3, in mm) and faces (F x 3).
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read %s' % path)
+    surface = nibabel.load(path)
+    vertices, faces = surface.agg_data(('pointset', 'triangle'))
+    return np.asarray(vertices, dtype=np.float64), np.asarray(faces, dtype=np.intp)
+
+
+@lru_cache(maxsize=8)
+def _load(path, size, mtime_ns):
+    return read_surface(path)
+
+
+def load_surface(path):
+    """
+    Loads a GIFTI surface. Surfaces are cached (by path, size and mtime), so
+    the T1 and T2 images made in a run load each surface once.
+
+    :return: tuple of vertices (V x 3, in mm) and faces (F x 3).
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read %s' % path)
+    stat = os.stat(path)
+    return _load(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def plane_segments(vertices, faces, axis, position):
+    """
+    Intersects a triangle mesh with the plane where coordinate 'axis' is
+    'position', all triangles at once.
+
+    :parameter: vertices: V x 3 coordinates (in any space; e.g., voxels).
+    :parameter: faces: F x 3 vertex indices.
+    :parameter: axis: 0, 1 or 2.
+    :parameter: position: where the plane cuts the axis.
+    :return: N x 2 x 3 array: the two ends of each segment of the outline.
+    """
+    corners = vertices[faces]
+    dist = corners[:, :, axis] - position
+    above = dist > 0
+    # A triangle crosses the plane if its corners are not all on one side.
+    count = above.sum(axis=1)
+    crossing = (count == 1) | (count == 2)
+    corners = corners[crossing]
+    dist = dist[crossing]
+    above = above[crossing]
+
+    # The corner alone on its side, and the other two.
+    alone = np.where(above.sum(axis=1) == 1, np.argmax(above, axis=1), np.argmin(above, axis=1))
+    rows = np.arange(len(corners))
+    ends = []
+    for shift in (1, 2):
+        other = (alone + shift) % 3
+        d0 = dist[rows, alone]
+        d1 = dist[rows, other]
+        t = (d0 / (d0 - d1))[:, None]
+        ends.append(corners[rows, alone] + t * (corners[rows, other] - corners[rows, alone]))
+    return np.stack(ends, axis=1)
+
+
+def draw_segments(image, segments, color):
+    """
+    Draws line segments, given in pixel (row, column) coordinates, into an
+    RGB image, all at once.
+
+    :parameter: image: H x W x 3 uint8 array; drawn on in place.
+    :parameter: segments: N x 2 x 2 array of (row, column) ends.
+    :parameter: color: (r, g, b).
+    """
+    if len(segments) == 0:
+        return
+    lengths = np.sqrt(((segments[:, 1] - segments[:, 0]) ** 2).sum(axis=1))
+    steps = int(np.ceil(lengths.max())) + 1
+    t = np.linspace(0.0, 1.0, steps)[None, :, None]
+    points = segments[:, :1] + t * (segments[:, 1:] - segments[:, :1])
+    points = np.rint(points.reshape(-1, 2)).astype(np.intp)
+    height, width = image.shape[:2]
+    inside = (points[:, 0] >= 0) & (points[:, 0] < height) & (points[:, 1] >= 0) & (points[:, 1] < width)
+    points = points[inside]
+    image[points[:, 0], points[:, 1]] = color
@@ -0,0 +1,62 @@
+import numpy as np
+from frames import iter_frames, CHUNK_BYTES
+from slices import slice_mosaic
+
+# The temporal statistics of a run, by the desc of their images.
+TEMPORAL_STATS = [ 'TemporalMean', 'TemporalStd', 'tSNR' ]
+
+# Bytes held for each voxel of a chunk: the float64 copy that the deviations
+# are squared in, and the frames as read (and scaled), at most 8 more.
+CHUNK_ITEMSIZE = 2 * np.dtype(np.float64).itemsize
+
+
+def temporal_stats(path, chunk_bytes=CHUNK_BYTES):
+    """
+    Computes the mean, standard deviation and tSNR (mean / std) of each
+    voxel over time, in one pass over the run, a chunk of frames at a time.
+    Each chunk's mean and sum of squared deviations are merged into the
+    running ones (Chan et al.), which does not lose precision as a sum of
+    squares would.
+
+    :parameter: path: 4-D NIfTI run, e.g., a BOLD run.
+    :parameter: chunk_bytes: most bytes of a chunk in memory at once.
+    :return: dict of statistic (see TEMPORAL_STATS) to 3-D float32 array.
+    """
+    count = 0
+    mean = None
+    m2 = None
+    for chunk in iter_frames(path, chunk_bytes, CHUNK_ITEMSIZE):
+        chunk = chunk.astype(np.float64)
+        chunk_count = chunk.shape[3]
+        chunk_mean = chunk.mean(axis=3)
+        # In place, so there is no temporary as big as the chunk.
+        chunk -= chunk_mean[..., None]
+        chunk **= 2
+        chunk_m2 = chunk.sum(axis=3)
+        if mean is None:
+            count, mean, m2 = chunk_count, chunk_mean, chunk_m2
+            continue
+        total = count + chunk_count
+        delta = chunk_mean - mean
+        mean += delta * (chunk_count / total)
+        m2 += chunk_m2 + delta ** 2 * (count * chunk_count / total)
+        count = total
+
+    std = np.sqrt(m2 / (count - 1)) if count > 1 else np.zeros_like(mean)
+    tsnr = np.divide(mean, std, out=np.zeros_like(mean), where=std > 0)
+    return { 'TemporalMean': mean.astype(np.float32),
+             'TemporalStd': std.astype(np.float32),
+             'tSNR': tsnr.astype(np.float32) }
+
+
+def temporal_mosaics(path, out_pre, chunk_bytes=CHUNK_BYTES):
+    """
+    Makes a mosaic of axial slices of each temporal statistic of a run.
+
+    :parameter: path: 4-D NIfTI run.
+    :parameter: out_pre: path and prefix of the images, e.g.,
+                img/sub-01_task-rest_run-01. Each is <out_pre>_desc-<stat>.png.
+    :return: list of the paths of the images.
+    """
+    stats = temporal_stats(path, chunk_bytes)
+    return [ slice_mosaic(stats[stat], '%s_desc-%s.png' % (out_pre, stat)) for stat in TEMPORAL_STATS ]
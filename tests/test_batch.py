@@ -0,0 +1,36 @@
+import ExecutiveSummaryBatch
+from ExecutiveSummaryBatch import run_session
+
+
+def run(tmp_path, monkeypatch, func_path, session_id):
+    # The func path that interface is called with, if it is.
+    called = {}
+
+    def interface(files_path, subject_id, session_id=None, func_path=None, **kwargs):
+        called['func_path'] = func_path
+        return True
+
+    monkeypatch.setattr(ExecutiveSummaryBatch, 'interface', interface)
+    label, status, _, log_path = run_session(str(tmp_path), '01', session_id, str(tmp_path),
+            { 'func_path': func_path })
+    with open(log_path) as fd:
+        return status, called.get('func_path'), fd.read()
+
+
+def test_placeholders(tmp_path, monkeypatch):
+    status, func_path, _ = run(tmp_path, monkeypatch, '/bids/{study}/sub-{subject}/ses-{session}/func', 'A')
+    assert status == 'ok'
+    assert func_path == '/bids/{study}/sub-01/ses-A/func'
+
+
+def test_session_placeholder_without_session(tmp_path, monkeypatch):
+    status, func_path, log = run(tmp_path, monkeypatch, '/bids/sub-{subject}/ses-{session}/func', None)
+    assert status == 'failed'
+    assert func_path is None
+    assert '{session}' in log and 'no session id' in log
+
+
+def test_no_session_needed(tmp_path, monkeypatch):
+    status, func_path, _ = run(tmp_path, monkeypatch, '/bids/sub-{subject}/func', None)
+    assert status == 'ok'
+    assert func_path == '/bids/sub-01/func'
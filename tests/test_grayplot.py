@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+nibabel = pytest.importorskip('nibabel')
+
+from grayplot import binned_sums, dtseries_rows, volume_rows
+
+
+def reference_rows(series, rows):
+    # series: grayordinates x frames. The mean of each row of the plot, and
+    # the summed squared change from each frame to the next.
+    count = series.shape[0]
+    bins = (np.arange(count) * rows) // count
+    means = np.zeros((rows, series.shape[1]))
+    for row in range(rows):
+        if (bins == row).any():
+            means[row] = series[bins == row].mean(axis=0)
+    squares = np.zeros(series.shape[1])
+    squares[1:] = (np.diff(series, axis=1) ** 2).sum(axis=0)
+    return means, squares
+
+
+def test_binned_sums():
+    rng = np.random.default_rng(0)
+    block = rng.random((11, 4))
+    bins = np.array([ 0, 0, 1, 3, 3, 3, 4, 6, 6, 6, 6 ])
+    expected = np.zeros((8, 4))
+    for grayordinate, row in enumerate(bins):
+        expected[row] += block[grayordinate]
+    np.testing.assert_allclose(binned_sums(block, bins, 8), expected)
+
+
+def save_dtseries(path, series):
+    frames = series.shape[1]
+    brain_models = nibabel.cifti2.BrainModelAxis.from_mask(np.ones(series.shape[0], dtype=bool), name='CortexLeft')
+    timepoints = nibabel.cifti2.SeriesAxis(0, 0.8, frames)
+    nibabel.save(nibabel.Cifti2Image(series.T.astype(np.float32), header=(timepoints, brain_models)), path)
+
+
+@pytest.mark.parametrize('chunk_bytes', [ 1, 13 * 4 * 7, 1 << 20 ])
+def test_dtseries_rows(tmp_path, chunk_bytes):
+    series = np.random.default_rng(1).normal(0, 1, (50, 13)).astype(np.float32)
+    path = str(tmp_path / 'run.dtseries.nii')
+    save_dtseries(path, series)
+
+    means, squares, count = dtseries_rows(path, rows=8, chunk_bytes=chunk_bytes)
+    expected_means, expected_squares = reference_rows(series.astype(np.float64), 8)
+    assert count == 50
+    np.testing.assert_allclose(means, expected_means, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(squares, expected_squares, rtol=1e-5)
+
+
+@pytest.mark.parametrize('chunk_bytes', [ 1, 4 * 5 * 3 * 4 * 4, 1 << 20 ])
+def test_volume_rows(tmp_path, chunk_bytes):
+    rng = np.random.default_rng(2)
+    data = rng.normal(100, 10, (4, 5, 3, 11)).astype(np.float32)
+    # Voxels that are 0 in the first frame are not in the plot.
+    data[0, :, :, 0] = 0
+    path = str(tmp_path / 'bold.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), path)
+
+    means, squares, count = volume_rows(path, rows=6, chunk_bytes=chunk_bytes)
+    series = data[data[..., 0] != 0].astype(np.float64)
+    expected_means, expected_squares = reference_rows(series, 6)
+    assert count == series.shape[0]
+    np.testing.assert_allclose(means, expected_means, rtol=1e-5)
+    np.testing.assert_allclose(squares, expected_squares, rtol=1e-5)
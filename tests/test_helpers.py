@@ -0,0 +1,47 @@
+import os
+import stat
+from types import SimpleNamespace
+
+from helpers import stage_file
+from preproc import Preprocessor
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_set_permissions_leaves_linked_sources_alone(tmp_path):
+    # A DCAN-BOLD gray plot, staged into img/ by link, as --stage-mode link
+    # does when both are on the same file system.
+    source = tmp_path / 'summary' / 'sub-01_task-rest_DVARS_and_FD.png'
+    source.parent.mkdir()
+    source.write_bytes(b'png')
+    os.chmod(source, 0o640)
+    images = tmp_path / 'executivesummary' / 'img'
+    images.mkdir(parents=True)
+    staged = images / source.name
+    assert stage_file(str(source), str(staged), 'link') in ('reflinked', 'linked', 'copied')
+    made = images / 'sub-01_T1.png'
+    made.write_bytes(b'png')
+
+    Preprocessor.set_permissions(SimpleNamespace(html_path=str(tmp_path / 'executivesummary')))
+
+    assert mode(source) == 0o640
+    assert mode(made) == 0o770
+    assert staged.read_bytes() == b'png'
+
+
+def test_stage_file_leaves_no_temp_file(tmp_path):
+    source = tmp_path / 'plot.png'
+    source.write_bytes(b'png')
+    images = tmp_path / 'img'
+    images.mkdir()
+    # Left by another layout of the same session; not this one's to touch.
+    other = images / ('.plot.png.%s.staging' % (os.getpid() + 1))
+    other.write_bytes(b'half')
+
+    for mode in ('copy', 'link'):
+        (images / 'plot.png').unlink(missing_ok=True)
+        stage_file(str(source), str(images / 'plot.png'), mode)
+        assert sorted(os.listdir(images)) == sorted([ other.name, 'plot.png' ])
+    assert other.read_bytes() == b'half'
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+nibabel = pytest.importorskip('nibabel')
+
+from resample import trilinear, resample_to_grid
+
+
+def reference_trilinear(data, point):
+    # One point at a time, straight from the definition.
+    if any(c < 0 or c > n - 1 for c, n in zip(point, data.shape)):
+        return 0.0
+    low = [ min(int(np.floor(c)), n - 2) for c, n in zip(point, data.shape) ]
+    frac = [ c - l for c, l in zip(point, low) ]
+    value = 0.0
+    for corner in np.ndindex(2, 2, 2):
+        weight = np.prod([ f if d else 1 - f for d, f in zip(corner, frac) ])
+        value += weight * data[tuple(l + d for l, d in zip(low, corner))]
+    return value
+
+
+def linear(i, j, k):
+    return 3.0 + 1.5 * i - 2.0 * j + 0.25 * k
+
+
+def test_trilinear_matches_reference():
+    rng = np.random.default_rng(0)
+    data = rng.random((5, 6, 7)).astype(np.float32)
+    # Inside, outside, on the voxels, and on the last planes.
+    coords = np.concatenate([ rng.uniform(-1, 8, (3, 200)),
+                              np.array([ [ 0, 4, 2, 4, 4.0 ], [ 0, 5, 3, 2.5, 5.0 ], [ 0, 6, 1, 6, 6.001 ] ]) ], axis=1)
+    expected = [ reference_trilinear(data, point) for point in coords.T ]
+    np.testing.assert_allclose(trilinear(data, coords), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_trilinear_is_exact_for_linear_data():
+    data = np.fromfunction(linear, (6, 5, 4)).astype(np.float32)
+    coords = np.random.default_rng(1).uniform(0, 3, (3, 100))
+    np.testing.assert_allclose(trilinear(data, coords), linear(*coords), rtol=1e-5)
+
+
+
+def save(path, data, zooms, neurological):
+    # Radiological (x flipped) or neurological order of the voxels.
+    affine = np.diag(list(zooms) + [ 1.0 ])
+    if not neurological:
+        affine[0, 0] = -zooms[0]
+    nibabel.save(nibabel.Nifti1Image(data, affine), path)
+    return path
+
+
+def test_resample_to_same_grid(tmp_path):
+    data = np.random.default_rng(2).random((5, 6, 7)).astype(np.float32)
+    src = save(str(tmp_path / 'src.nii.gz'), data, (2, 2, 2), False)
+    ref = save(str(tmp_path / 'ref.nii.gz'), np.zeros((5, 6, 7), np.float32), (2, 2, 2), False)
+    volume = resample_to_grid(src, ref)
+    assert volume.name == 'src.2'
+    np.testing.assert_allclose(np.asanyarray(volume.image.dataobj), data, rtol=1e-6)
+
+
+@pytest.mark.parametrize('neurological', [ False, True ])
+def test_resample_to_finer_grid(tmp_path, neurological):
+    # A 2 mm source into a 1 mm grid, in flirt's coordinates: voxels times
+    # their size, counted from the other end of x in neurological order.
+    data = np.fromfunction(linear, (5, 6, 7)).astype(np.float32)
+    src = save(str(tmp_path / 'src.nii'), data, (2, 2, 2), neurological)
+    ref = save(str(tmp_path / 'ref.nii'), np.zeros((10, 12, 14), np.float32), (1, 1, 1), neurological)
+    out = np.asanyarray(resample_to_grid(src, ref).image.dataobj)
+
+    i, j, k = np.indices(out.shape, dtype=np.float64)
+    x = (i - 1) / 2.0 if neurological else i / 2.0
+    expected = linear(x, j / 2.0, k / 2.0)
+    inside = (x >= 0) & (x <= 4) & (j / 2.0 <= 5) & (k / 2.0 <= 6)
+    expected[~inside] = 0
+    np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-5)
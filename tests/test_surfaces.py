@@ -0,0 +1,34 @@
+import numpy as np
+
+from surfaces import plane_segments
+
+# A tetrahedron: a base at z = 0 and an apex at z = 1.
+VERTICES = np.array([ [ 0, 0, 0 ], [ 1, 0, 0 ], [ 0, 1, 0 ], [ 0, 0, 1 ] ], dtype=np.float64)
+FACES = np.array([ [ 0, 1, 2 ], [ 0, 1, 3 ], [ 1, 2, 3 ], [ 2, 0, 3 ] ])
+
+
+def as_set(segments):
+    # Segments, with their ends in either order.
+    return { frozenset(tuple(np.round(end, 6)) for end in segment) for segment in segments }
+
+
+def test_plane_cuts_tetrahedron():
+    segments = plane_segments(VERTICES, FACES, 2, 0.5)
+    # The three sides are cut at the middle of their edges to the apex;
+    # the base is not cut.
+    a, b, c = (0.0, 0.0, 0.5), (0.5, 0.0, 0.5), (0.0, 0.5, 0.5)
+    assert segments.shape == (3, 2, 3)
+    assert as_set(segments) == { frozenset([ a, b ]), frozenset([ b, c ]), frozenset([ c, a ]) }
+
+
+def test_plane_cuts_along_other_axes():
+    segments = plane_segments(VERTICES, FACES, 0, 0.25)
+    assert segments.shape == (3, 2, 3)
+    np.testing.assert_allclose(segments[:, :, 0], 0.25)
+    # Every end is on the surface of the tetrahedron: x + y + z <= 1.
+    assert (segments.sum(axis=2) <= 1 + 1e-9).all()
+
+
+def test_plane_misses():
+    assert plane_segments(VERTICES, FACES, 2, 2.0).shape == (0, 2, 3)
+    assert plane_segments(VERTICES, FACES, 1, -0.5).shape == (0, 2, 3)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+nibabel = pytest.importorskip('nibabel')
+
+from temporal import temporal_stats
+
+
+@pytest.fixture
+def run_path(tmp_path):
+    # A run with a large mean and a small spread, where a sum of squares
+    # would lose precision.
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000.0, 2.0, (6, 5, 4, 37)).astype(np.float32)
+    data[0, 0, 0] = 0.0
+    path = str(tmp_path / 'bold.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), path)
+    return path, data.astype(np.float64)
+
+
+@pytest.mark.parametrize('frames_per_chunk', [ 1, 5, 36, 37 ])
+def test_chunked_matches_whole_run(run_path, frames_per_chunk):
+    path, data = run_path
+    # Bytes of the frames in a chunk, as temporal_stats counts them.
+    chunk_bytes = frames_per_chunk * 6 * 5 * 4 * 16
+    stats = temporal_stats(path, chunk_bytes)
+
+    mean = data.mean(axis=3)
+    std = data.std(axis=3, ddof=1)
+    tsnr = np.divide(mean, std, out=np.zeros_like(mean), where=std > 0)
+    np.testing.assert_allclose(stats['TemporalMean'], mean, rtol=1e-6)
+    np.testing.assert_allclose(stats['TemporalStd'], std, rtol=1e-4)
+    np.testing.assert_allclose(stats['tSNR'], tsnr, rtol=1e-4)
+    # A voxel that never changes has no std, and no tSNR.
+    assert stats['TemporalStd'][0, 0, 0] == 0
+    assert stats['tSNR'][0, 0, 0] == 0
+
+
+def test_single_frame(tmp_path):
+    data = np.arange(24, dtype=np.float32).reshape((2, 3, 4, 1))
+    path = str(tmp_path / 'bold.nii')
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), path)
+    stats = temporal_stats(path)
+    np.testing.assert_array_equal(stats['TemporalMean'], data[..., 0])
+    assert not stats['TemporalStd'].any()
@@ -0,0 +1,30 @@
+import os
+
+from PIL import Image
+
+from thumbnails import ThumbnailCache, THUMBNAIL_WIDTHS
+
+
+def test_thumbnail_for_each_width(tmp_path):
+    image_file = str(tmp_path / 'sub-01_desc-AtlasInT1w.gif')
+    Image.new('RGB', (2000, 400), (10, 20, 30)).save(image_file)
+
+    cache = ThumbnailCache(jobs=2)
+    row = cache.thumbnail(image_file, 'row')
+    quarter = cache.thumbnail(image_file, 'quarter')
+    cache.wait()
+
+    assert row != quarter
+    for thumb_file, kind in [ (row, 'row'), (quarter, 'quarter') ]:
+        with Image.open(thumb_file) as thumb:
+            assert thumb.format == 'GIF'
+            assert thumb.width == THUMBNAIL_WIDTHS[kind]
+
+    # One made by an older layout, at another width, is not reused.
+    old = tmp_path / 'thumbs' / os.path.basename(image_file)
+    old.write_bytes(open(quarter, 'rb').read())
+    cache = ThumbnailCache(jobs=1)
+    assert cache.thumbnail(image_file, 'quarter') == quarter
+    assert cache.thumbnail(image_file, 'row') == row
+    assert not cache.futures
+    cache.wait()
@@ -0,0 +1,73 @@
+import numpy as np
+from PIL import Image
+
+from views import render_view, NAMED_VIEWS, CONTOUR_COLORS
+
+# A 10 x 20 x 5 mm volume of 1 mm voxels, placed so that the plane of the
+# 'Axial-SuperiorFrontal' view (z = 50 mm) is its third slice.
+SHAPE = (10, 20, 5)
+AFFINE = np.array([ [ 1, 0, 0, -5 ], [ 0, 1, 0, -10 ], [ 0, 0, 1, 48 ], [ 0, 0, 0, 1 ] ], dtype=np.float64)
+VIEW = 'Axial-SuperiorFrontal'
+
+# The volume fits the height of a 200 x 200 image at 10 pixels per mm, and
+# is centered across it, 50 pixels from either side.
+SIZE = (200, 200)
+
+
+def pixel(i, j):
+    # Center (row, column) of voxel (i, j) of the slice: the subject's right
+    # at the right, anterior at the top.
+    return (SHAPE[1] - 0.5 - j) * 10 - 0.5, (i + 0.5) * 10 + 50 - 0.5
+
+
+def render(tmp_path, data, surfaces=None):
+    out = str(tmp_path / 'view.png')
+    render_view((data, AFFINE, (1.0, 1.0, 1.0), (0.0, 1.0)), out, VIEW, surfaces, SIZE)
+    return np.asarray(Image.open(out).convert('RGB'))
+
+
+def test_view_plane():
+    assert NAMED_VIEWS[VIEW] == ('z', 50.0)
+
+
+def test_bright_voxel_placement(tmp_path):
+    data = np.zeros(SHAPE, dtype=np.float32)
+    data[3, 15, 2] = 1.0
+    # Another slice; must not show.
+    data[6, 5, 3] = 1.0
+    image = render(tmp_path, data)[:, :, 0].astype(np.float64)
+
+    assert image.shape == (200, 200)
+    rows, columns = np.nonzero(image)
+    weights = image[rows, columns]
+    center = (np.average(rows, weights=weights), np.average(columns, weights=weights))
+    np.testing.assert_allclose(center, pixel(3, 15), atol=0.5)
+    assert not image[:, :50].any() and not image[:, 150:].any()
+
+
+def test_volume_fills_its_box(tmp_path):
+    image = render(tmp_path, np.ones(SHAPE, dtype=np.float32))[:, :, 0]
+    # Outside of the volume is black; within it (but for the half voxel on
+    # each edge, which is past the centers of the edge voxels) is white.
+    assert not image[:, :50].any() and not image[:, 150:].any()
+    assert (image[5:195, 55:145] == 255).all()
+
+
+def test_surface_outline_placement(tmp_path):
+    # A tetrahedron in mm whose edges to the apex cross z = 50 at (0, 0),
+    # (2, 0) and (0, 3) mm: voxels (5, 10), (7, 10) and (5, 13).
+    vertices = np.array([ [ 0, 0, 49 ], [ 4, 0, 49 ], [ 0, 6, 49 ], [ 0, 0, 51 ] ], dtype=np.float64)
+    faces = np.array([ [ 0, 1, 2 ], [ 0, 1, 3 ], [ 1, 2, 3 ], [ 2, 0, 3 ] ])
+    image = render(tmp_path, np.zeros(SHAPE, dtype=np.float32), [ ('lh.pial.surf.gii', vertices, faces) ])
+
+    red = np.all(image == CONTOUR_COLORS['pial'], axis=2)
+    rows, columns = np.nonzero(red)
+    assert rows.size
+    for i, j in [ (5, 10), (7, 10), (5, 13) ]:
+        row, column = pixel(i, j)
+        assert (np.hypot(rows - row, columns - column) <= 1.5).any()
+    # And nothing beyond the outline.
+    top, left = pixel(5, 13)
+    bottom, right = pixel(7, 10)
+    assert rows.min() >= top - 1.5 and rows.max() <= bottom + 1.5
+    assert columns.min() >= left - 1.5 and columns.max() <= right + 1.5
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from brainsprite import LANCZOS
+from helpers import stage_file
+
+# Width of the page the layout is made for, in CSS pixels, and the widest
+# each kind of layout row shows its image on it: 11 of the 12 columns of a
+# row, 9 of a half row, and a quarter of the page. Thumbnails are made no
+# wider than this; the modal containers still show the originals.
+LAYOUT_WIDTH = 1024
+THUMBNAIL_WIDTHS = { 'row': LAYOUT_WIDTH * 11 // 12, 'half': LAYOUT_WIDTH * 9 // 12, 'quarter': LAYOUT_WIDTH // 4 }
+
+# Thumbnails go in a subdirectory of the images directory, one for each
+# width, with the same names as their sources.
+THUMBNAILS_DIR = 'thumbs'
+
+
+def thumbnail_path(image_file, width):
+    return os.path.join(os.path.dirname(image_file), THUMBNAILS_DIR, str(width), os.path.basename(image_file))
+
+
+def is_current(thumb_file, image_file):
+    # A thumbnail is reused as long as its source has not changed since it
+    # was made.
+    try:
+        return os.stat(thumb_file).st_mtime >= os.stat(image_file).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def make_thumbnail(image_file, thumb_file, width):
+    """
+    Shrinks an image to the given width and writes it to thumb_file, in the
+    format its extension names (gifs get an adaptive palette). Images that
+    are no wider than that, and animated gifs, are linked or copied as they
+    are.
+
+    :parameter: image_file: path of the source image.
+    :parameter: thumb_file: path of the thumbnail to write.
+    :parameter: width: largest width of the thumbnail.
+    :return: None
+    """
+    with Image.open(image_file) as img:
+        if img.width <= width or getattr(img, 'n_frames', 1) > 1:
+            img = None
+        else:
+            height = max(1, round(img.height * width / img.width))
+            img = img.convert('RGB').resize((width, height), resample=LANCZOS)
+
+    if img is None:
+        stage_file(image_file, thumb_file, 'link')
+        return
+
+    image_format = Image.registered_extensions().get(os.path.splitext(thumb_file)[1].lower(), 'PNG')
+    if image_format == 'GIF':
+        img = img.quantize(colors=256)
+
+    # Write and rename, so that a thumbnail that is half written is never
+    # mistaken for a current one.
+    tmp_file = thumb_file + '.tmp'
+    img.save(tmp_file, image_format)
+    os.replace(tmp_file, thumb_file)
+
+
+class ThumbnailCache(object):
+
+    # Makes the thumbnails of the images placed in the layout, on a pool of
+    # threads, while the layout goes on. Call wait() before the page that
+    # uses them is put in place.
+
+    def __init__ (self, jobs=None):
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.futures = {}
+
+
+    def thumbnail(self, image_file, kind='row'):
+        """
+        Gets the path of the thumbnail of an image, and makes the thumbnail
+        (in the background) unless a current one is already there.
+
+        :parameter: image_file: path of the image, relative to the html.
+        :parameter: kind: one of THUMBNAIL_WIDTHS.
+        :return: path of the thumbnail, relative to the html.
+        """
+        width = THUMBNAIL_WIDTHS[kind]
+        thumb_file = thumbnail_path(image_file, width)
+        if thumb_file not in self.futures and not is_current(thumb_file, image_file):
+            os.makedirs(os.path.dirname(thumb_file), exist_ok=True)
+            self.futures[thumb_file] = (image_file, self.pool.submit(make_thumbnail,
+                    image_file, thumb_file, width))
+        return thumb_file
+
+
+    def wait(self):
+        # Wait for all of the thumbnails. If one could not be made, put the
+        # original in its place so the page still has the image.
+        for thumb_file, (image_file, future) in self.futures.items():
+            try:
+                future.result()
+            except Exception as err:
+                print('Unable to make thumbnail %s; using the original.\nError: %s' % (thumb_file, err))
+                stage_file(image_file, thumb_file, 'link')
+
+        self.pool.shutdown()
+        print('Made %s thumbnails.' % len(self.futures))
+        self.futures = {}
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from PIL import Image
+from brainsprite import axis_samples, FULL_FRAME_SIZE, SPRITE_PERCENTILES
+from surfaces import read_surface, plane_segments, draw_segments, CONTOUR_COLORS
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+# How the named pngs (T1-Axial-SuperiorFrontal.png, etc.) are made.
+# 'workbench' renders each scene of the pngs scene with wb_command; 'native'
+# slices the volumes and the surfaces in this process.
+VIEW_RENDERERS = [ 'workbench', 'native' ]
+
+# The slice of each named view: the axis it cuts, and where (in mm of the
+# MNI volumes in MNINonLinear).
+NAMED_VIEWS = {
+    'Axial-InferiorTemporal-Cerebellum':             ('z', -30.0),
+    'Axial-BasalGangila-Putamen':                    ('z', 2.0),
+    'Axial-SuperiorFrontal':                         ('z', 50.0),
+    'Coronal-PosteriorParietal-Lingual':             ('y', -70.0),
+    'Coronal-Caudate-Amygdala':                      ('y', 0.0),
+    'Coronal-OrbitoFrontal':                         ('y', 40.0),
+    'Sagittal-Insula-FrontoTemporal':                ('x', -48.0),
+    'Sagittal-CorpusCallosum':                       ('x', 0.0),
+    'Sagittal-Insula-Temporal-HippocampalSulcus':    ('x', -30.0),
+    }
+
+AXES = { 'x': 0, 'y': 1, 'z': 2 }
+
+# The axes across and up each view: axials and coronals have the subject's
+# right at the right; sagittals have anterior at the right.
+VIEW_AXES = { 0: (1, 2), 1: (0, 2), 2: (0, 1) }
+
+
+def load_volume(path):
+    """
+    Loads a volume in RAS order, with the range of its head's intensities,
+    for render_view. The views of a run share it: see
+    Preprocessor.cached.
+
+    :return: tuple of data (3-D float32), affine, zooms, and (vmin, vmax).
+    """
+    if nibabel is None:
+        raise RuntimeError('nibabel is needed to read %s' % path)
+    image = nibabel.as_closest_canonical(nibabel.load(path))
+    data = np.asanyarray(image.dataobj)
+    if data.ndim > 3:
+        data = data[..., 0]
+    data = data.astype(np.float32, copy=False)
+    head = data[data > 0]
+    if head.size:
+        vmin, vmax = np.percentile(head, SPRITE_PERCENTILES)
+    else:
+        vmin, vmax = 0.0, 1.0
+    return data, image.affine, image.header.get_zooms()[:3], (float(vmin), float(max(vmax, vmin + 1e-6)))
+
+
+def render_view(volume, out_path, view, surfaces=None, size=FULL_FRAME_SIZE):
+    """
+    Renders a named view, as the pngs scene shows it: a slice of the volume,
+    fit to the image, with the outlines of the surfaces where they cut it.
+
+    :parameter: volume: path of a volume (e.g., T1w_restore.nii.gz), or
+                what load_volume returned for it.
+    :parameter: out_path: .png to write.
+    :parameter: view: a key of NAMED_VIEWS, e.g., 'Axial-SuperiorFrontal'.
+    :parameter: surfaces: GIFTI surfaces (pial and/or white) to outline:
+                paths, or (path, vertices, faces) of surfaces already read.
+    :parameter: size: (width, height) of the image.
+    :return: out_path
+    """
+    if isinstance(volume, str):
+        volume = load_volume(volume)
+    data, affine, zooms, (vmin, vmax) = volume
+    axis_name, position = NAMED_VIEWS[view]
+    axis = AXES[axis_name]
+    across, up = VIEW_AXES[axis]
+    to_voxels = np.linalg.inv(affine)
+
+    # The slice in voxels, and the pixels (centered, at the same mm per
+    # pixel across and up) in voxels of the axes across and up.
+    point = np.zeros(3)
+    point[axis] = position
+    slice_index = (to_voxels[:3, :3] @ point + to_voxels[:3, 3])[axis]
+    width, height = size
+    mm_across = data.shape[across] * zooms[across]
+    mm_up = data.shape[up] * zooms[up]
+    pixels_per_mm = min(width / mm_across, height / mm_up)
+    left = (width - mm_across * pixels_per_mm) / 2.0
+    top = (height - mm_up * pixels_per_mm) / 2.0
+    scale_across = pixels_per_mm * zooms[across]
+    scale_up = pixels_per_mm * zooms[up]
+    columns = (np.arange(width) + 0.5 - left) / scale_across - 0.5
+    rows = data.shape[up] - 0.5 - (np.arange(height) + 0.5 - top) / scale_up
+
+    plane = axis_samples(data, axis, np.array([ slice_index ]))
+    plane = axis_samples(plane, across, columns)
+    plane = axis_samples(plane, up, rows)
+    plane = np.squeeze(plane, axis=axis).T
+    grey = np.clip((plane - vmin) * (255.0 / (vmax - vmin)), 0, 255).astype(np.uint8)
+    rgb = np.repeat(grey[:, :, None], 3, axis=2)
+
+    for surface in surfaces or []:
+        if isinstance(surface, str):
+            surface = (surface, ) + read_surface(surface)
+        surface, vertices, faces = surface
+        voxels = vertices @ to_voxels[:3, :3].T + to_voxels[:3, 3]
+        segments = plane_segments(voxels, faces, axis, slice_index)
+        # Voxels to (row, column) in pixels.
+        pixels = np.stack([ (data.shape[up] - 0.5 - segments[:, :, up]) * scale_up + top - 0.5,
+                            (segments[:, :, across] + 0.5) * scale_across + left - 0.5 ], axis=2)
+        kind = 'pial' if 'pial' in os.path.basename(surface) else 'white'
+        draw_segments(rgb, pixels, CONTOUR_COLORS[kind])
+
+    Image.fromarray(rgb).save(out_path)
+    return out_path